@@ -0,0 +1,2 @@
+# -*- coding: utf-8 -*-
+"""语义服务与爬虫共用的模块"""
@@ -0,0 +1,185 @@
+# -*- coding: utf-8 -*-
+"""
+线程安全的 pymysql 连接池，语义服务与爬虫共用（两边的 db_pool.py 只是转发到这里）。
+
+- 最大连接数 max_size，借不到连接时最多等待 timeout 秒；
+- 空闲超过 health_check_interval 秒的连接在借出前 ping 一次，失效则重连；
+- 使用中抛出连接类异常的连接直接丢弃，不回到池里；
+- 归还时 rollback，结束未提交的事务和 REPEATABLE READ 读快照；
+- stats() 返回借出次数、等待时间、失败次数等统计（计数都在锁内更新，是准确值）。
+
+用法：
+    pool = MySQLPool(host=..., user=..., max_size=10)
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT 1")
+"""
+import threading
+import time
+from contextlib import contextmanager
+
+import pymysql
+
+# 这些异常说明连接本身已不可用，需要丢弃
+_BROKEN_ERRORS = (pymysql.err.OperationalError, pymysql.err.InterfaceError, ConnectionError, OSError)
+
+
+class PoolTimeoutError(Exception):
+    """等待可用连接超时"""
+
+
+class MySQLPool:
+    def __init__(self, max_size=10, timeout=10.0, health_check_interval=30.0,
+                 connect_retries=3, name="mysql", **connect_kwargs):
+        self.max_size = max_size
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self.connect_retries = connect_retries
+        self.name = name
+        self.connect_kwargs = connect_kwargs
+
+        self._cond = threading.Condition()
+        self._idle = []          # [(conn, last_used_monotonic)]
+        self._size = 0           # 已创建且未关闭的连接数（空闲 + 借出）
+
+        self._stats = {
+            "checkouts": 0,
+            "waits": 0,
+            "wait_time_total_ms": 0.0,
+            "wait_time_max_ms": 0.0,
+            "timeouts": 0,
+            "failures": 0,
+            "connects": 0,
+            "reconnects": 0,
+            "discarded": 0,
+        }
+
+    # ---------- 建立 / 检查连接 ----------
+    def _connect(self):
+        last_error = None
+        for attempt in range(self.connect_retries):
+            try:
+                conn = pymysql.connect(**self.connect_kwargs)
+                self._count("connects")
+                return conn
+            except _BROKEN_ERRORS as e:
+                last_error = e
+                self._count("failures")
+                time.sleep(min(0.2 * 2 ** attempt, 2.0))
+        raise last_error
+
+    def _check(self, conn, last_used):
+        """空闲较久的连接先 ping，断开则自动重连"""
+        if time.monotonic() - last_used < self.health_check_interval:
+            return conn
+        try:
+            conn.ping(reconnect=True)
+            return conn
+        except _BROKEN_ERRORS:
+            self._count("reconnects")
+            self._close_quietly(conn)
+            return self._connect()
+
+    def _count(self, key):
+        """锁外路径（建连、ping、归还）更新统计用"""
+        with self._cond:
+            self._stats[key] += 1
+
+    @staticmethod
+    def _close_quietly(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    # ---------- 借出 / 归还 ----------
+    def acquire(self):
+        start = time.monotonic()
+        waited = False
+        with self._cond:
+            while True:
+                if self._idle:
+                    conn, last_used = self._idle.pop()
+                    break
+                if self._size < self.max_size:
+                    self._size += 1
+                    conn, last_used = None, None
+                    break
+                waited = True
+                remaining = self.timeout - (time.monotonic() - start)
+                if remaining <= 0 or not self._cond.wait(remaining):
+                    if self._idle or self._size < self.max_size:
+                        continue
+                    self._stats["timeouts"] += 1
+                    raise PoolTimeoutError(f"{self.name} 连接池等待超时（max_size={self.max_size}）")
+
+            wait_ms = (time.monotonic() - start) * 1000
+            self._stats["checkouts"] += 1
+            if waited:
+                self._stats["waits"] += 1
+            self._stats["wait_time_total_ms"] += wait_ms
+            self._stats["wait_time_max_ms"] = max(self._stats["wait_time_max_ms"], wait_ms)
+
+        # 建连 / ping 放在锁外，避免阻塞其它线程
+        try:
+            if conn is None:
+                return self._connect()
+            return self._check(conn, last_used)
+        except Exception:
+            self._release_slot()
+            raise
+
+    def release(self, conn, broken=False):
+        if not broken:
+            try:
+                conn.rollback()
+            except _BROKEN_ERRORS:
+                broken = True
+        if broken:
+            self._count("discarded")
+            self._close_quietly(conn)
+            self._release_slot()
+            return
+        with self._cond:
+            self._idle.append((conn, time.monotonic()))
+            self._cond.notify()
+
+    def _release_slot(self):
+        with self._cond:
+            self._size -= 1
+            self._cond.notify()
+
+    @contextmanager
+    def connection(self):
+        conn = self.acquire()
+        broken = False
+        try:
+            yield conn
+        except _BROKEN_ERRORS:
+            broken = True
+            self._count("failures")
+            raise
+        finally:
+            self.release(conn, broken=broken)
+
+    # ---------- 管理 ----------
+    def close_all(self):
+        with self._cond:
+            idle, self._idle = self._idle, []
+            self._size -= len(idle)
+        for conn, _ in idle:
+            self._close_quietly(conn)
+
+    def stats(self):
+        with self._cond:
+            stats = dict(self._stats)
+            stats.update(
+                name=self.name,
+                max_size=self.max_size,
+                size=self._size,
+                idle=len(self._idle),
+                in_use=self._size - len(self._idle),
+            )
+        checkouts = stats["checkouts"]
+        stats["wait_time_avg_ms"] = round(stats["wait_time_total_ms"] / checkouts, 3) if checkouts else 0.0
+        return stats
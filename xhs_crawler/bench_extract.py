@@ -0,0 +1,103 @@
+# -*- coding: utf-8 -*-
+"""
+页面字段提取基准：对比 evaluate（一次页面内求值）与 elements（逐元素 RPC）两种模式，
+并校验两者输出完全一致。
+
+页面用 page.set_content 注入合成的搜索结果 / 评论区 HTML（结构与选择器和线上页面一致），
+不访问小红书，不需要登录。
+
+用法：
+    python bench_extract.py --comments 500 --cards 30 --repeat 5
+"""
+import argparse
+import random
+import time
+from html import escape
+
+from playwright.sync_api import sync_playwright
+
+from dom_extract import EXTRACT_MODES, extract_comments, extract_note_cards
+
+TIMES = ["刚刚", "3分钟前", "2小时前", "今天 14:30", "昨天 09:15", "4天前", "10-12", "2024-03-15"]
+LOCATIONS = ["广东", "北京", "上海", "浙江", ""]
+
+
+def note_cards_html(n, rng):
+    cards = []
+    for i in range(n):
+        if i % 10 == 9:  # 广告卡片：没有封面链接
+            cards.append('<section class="note-item"><div class="ad">推广</div></section>')
+            continue
+        cards.append(
+            '<section class="note-item">'
+            f'<a class="cover" href="/explore/note{i:06d}?xsec_token=abc"></a>'
+            f'<a class="title"><span>  笔记标题 {i} {escape(rng.choice(["学习", "编程", "效率"]))} </span></a>'
+            f'<a class="author" href="/user/profile/author{i % 7:04d}">'
+            f'<span class="name">作者{i % 7}</span><span class="time">{rng.choice(TIMES)}</span></a>'
+            '</section>'
+        )
+    return "".join(cards)
+
+
+def comments_html(n, rng):
+    items = []
+    for i in range(n):
+        user = (f'<a class="name" href="/user/profile/user{rng.randrange(n // 2 + 1):05d}">用户{i}</a>'
+                if i % 25 else "")
+        location = rng.choice(LOCATIONS)
+        items.append(
+            '<div class="comment-item">'
+            f'{user}<div class="content"> 第 {i} 条评论：{"很有用" * rng.randint(1, 5)} </div>'
+            f'<div class="date"><span>{rng.choice(TIMES)}</span>'
+            + (f'<span class="location">{location}</span>' if location else "")
+            + '</div></div>'
+        )
+    return "".join(items)
+
+
+def timed(fn, repeat):
+    best = float("inf")
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="evaluate / elements 提取模式耗时对比")
+    parser.add_argument("--comments", type=int, default=500)
+    parser.add_argument("--cards", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    html = (f'<html><body><div class="feeds">{note_cards_html(args.cards, rng)}</div>'
+            f'<div class="comments">{comments_html(args.comments, rng)}</div></body></html>')
+
+    with sync_playwright() as p:
+        browser = p.chromium.launch(headless=True)
+        page = browser.new_page()
+        page.set_content(html)
+
+        outputs = {}
+        print(f"{'mode':<10} {'cards ms':>10} {'comments ms':>12} {'per comment ms':>15}")
+        for mode in EXTRACT_MODES:
+            cards_sec, cards = timed(lambda: extract_note_cards(page, "学习", args.cards, mode), args.repeat)
+            comments_sec, comments = timed(lambda: list(extract_comments(page, mode)), args.repeat)
+            outputs[mode] = ([(raw, repr(record)) for raw, record in cards], comments)
+            print(f"{mode:<10} {cards_sec * 1000:>10.1f} {comments_sec * 1000:>12.1f} "
+                  f"{comments_sec * 1000 / max(len(comments), 1):>15.3f}")
+        browser.close()
+
+    first, *rest = EXTRACT_MODES
+    same = all(outputs[mode] == outputs[first] for mode in rest)
+    print("✅ 两种模式输出一致" if same else "❌ 两种模式输出不一致")
+    if not same:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""连接池实现在 xhs_common/db_pool.py（与语义服务共用），这里只做转发，保持 from db_pool import MySQLPool 可用"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from xhs_common.db_pool import MySQLPool, PoolTimeoutError  # noqa: E402,F401
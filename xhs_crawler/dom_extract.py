@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+"""
+页面字段提取：搜索结果卡片（section.note-item）与评论（.comment-item）。
+
+两种模式，输出完全一致（同一套字段映射：note_card_record / comment_record）：
+    evaluate  一次 page.evaluate 在页面里收集所有元素的原始字段，一次往返
+    elements  逐个元素 query_selector / inner_text / get_attribute，
+              每个字段都是一次 Playwright ↔ 浏览器往返（每条评论 6~8 次），仅用于对照
+
+原始字段只取 innerText / getAttribute 的原值，strip、补全链接、解析 ID 和时间都在 Python 里做。
+对比两种模式的耗时：python bench_extract.py
+
+离线重解析（reparse.py）不开浏览器，用 selectolax 解析归档的 HTML（raw_*_html），
+产出同样的原始字段，再走同一套映射；相对时间（“3分钟前”）按抓取时间换算。
+selectolax 取的是 textContent，与 innerText 只在换行等空白上可能不同。
+"""
+import re
+from datetime import datetime, timedelta
+
+EXTRACT_MODES = ("evaluate", "elements")
+
+def extract_id_from_url(url: str) -> str | None:
+    if url is None or url == "":
+        return None
+    match = re.search(r'/([^/?]+)(?:\?|$)', url)
+    return match.group(1) if match else None
+def parse_xiaohongshu_time(time_str: str, now: datetime = None) -> str | None:
+    """
+    解析小红书各种时间显示格式，统一转为 'YYYY-MM-DD'（或更精确到秒，按需扩展）。
+    
+    支持格式：
+      - "刚刚"
+      - "3分钟前"
+      - "2小时前"
+      - "今天 14:30"
+      - "昨天 09:15"
+      - "4天前"
+      - "10-12"
+      - "2024-03-15"
+      - "2025-02-14 13:45:22" （兼容）
+    
+    Args:
+        time_str: 原始时间字符串
+        now: 参考时间（默认为当前系统时间）
+    
+    Returns:
+        标准 ISO 日期字符串（如 "2025-11-07"），或 None
+    """
+    if now is None:
+        now = datetime.now()
+    
+    time_str = time_str.strip()
+    if not time_str or time_str in ("N/A", "无", "未知"):
+        return None
+
+    # 1. 刚刚
+    if "刚刚" in time_str:
+        return now.strftime("%Y-%m-%d")
+
+    # 2. X分钟前
+    min_match = re.match(r'^(\d+)分钟前$', time_str)
+    if min_match:
+        minutes = int(min_match.group(1))
+        dt = now - timedelta(minutes=minutes)
+        return dt.strftime("%Y-%m-%d")
+
+    # 3. X小时前
+    hour_match = re.match(r'^(\d+)小时前$', time_str)
+    if hour_match:
+        hours = int(hour_match.group(1))
+        dt = now - timedelta(hours=hours)
+        return dt.strftime("%Y-%m-%d")
+
+    # 4. 今天 HH:mm[:ss]
+    today_match = re.match(r'^今天\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
+    if today_match:
+        h, m, s = int(today_match.group(1)), int(today_match.group(2)), today_match.group(3)
+        s = int(s) if s else 0
+        dt = now.replace(hour=h, minute=m, second=s, microsecond=0)
+        return dt.strftime("%Y-%m-%d")
+
+    # 5. 昨天 HH:mm[:ss]
+    yesterday_match = re.match(r'^昨天\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
+    if yesterday_match:
+        h, m, s = int(yesterday_match.group(1)), int(yesterday_match.group(2)), yesterday_match.group(3)
+        s = int(s) if s else 0
+        dt = (now - timedelta(days=1)).replace(hour=h, minute=m, second=s, microsecond=0)
+        return dt.strftime("%Y-%m-%d")
+
+    # 6. X天前
+    day_match = re.match(r'^(\d+)天前$', time_str)
+    if day_match:
+        days = int(day_match.group(1))
+        dt = now - timedelta(days=days)
+        return dt.strftime("%Y-%m-%d")
+
+    # 7. YYYY-MM-DD HH:mm:ss （完整时间）
+    full_match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
+    if full_match:
+        y, mo, d, h, m, s = map(int, full_match.groups()[:5]) + (int(full_match.group(6)) if full_match.group(6) else 0,)
+        try:
+            dt = datetime(y, mo, d, h, m, s)
+            return dt.strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+
+    # 8. YYYY-MM-DD
+    ymd_match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})$', time_str)
+    if ymd_match:
+        y, mo, d = map(int, ymd_match.groups())
+        try:
+            dt = datetime(y, mo, d)
+            return dt.strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+
+    # 9. MM-DD （最常见于搜索页）
+    md_match = re.match(r'^(\d{1,2})-(\d{1,2})$', time_str)
+    if md_match:
+        mo, d = map(int, md_match.groups())
+        try:
+            # 先试今年
+            candidate = datetime(now.year, mo, d)
+            if candidate > now:
+                candidate = datetime(now.year - 1, mo, d)
+            return candidate.strftime("%Y-%m-%d")
+        except ValueError:
+            pass
+
+    # 无法识别
+    return time_str
+
+
+# ===========================
+# 🧩 搜索结果卡片
+# ===========================
+NOTE_CARDS_JS = """
+(limit) => Array.from(document.querySelectorAll('section.note-item')).slice(0, limit).map(item => {
+    const one = sel => item.querySelector(sel);
+    const text = sel => { const el = one(sel); return el ? el.innerText : null; };
+    const attr = (sel, name) => { const el = one(sel); return el ? el.getAttribute(name) : null; };
+    return {
+        has_cover: one('a.cover') !== null,
+        has_author: one('a.author') !== null,
+        title: text('a.title span'),
+        author: text('a.author .name'),
+        user_url: attr('a.author', 'href'),
+        time: text('a.author .time'),
+        href: attr('a.cover', 'href'),
+    };
+})
+"""
+
+
+def raw_note_cards_elements(page, limit):
+    """逐元素读取卡片原始字段（对照用）"""
+    raws = []
+    for item in page.query_selector_all("section.note-item")[:limit]:
+        cover = item.query_selector("a.cover")
+        author_link = item.query_selector("a.author")
+        title_elem = item.query_selector("a.title span")
+        author_elem = item.query_selector("a.author .name")
+        time_elem = item.query_selector("a.author .time")
+        raws.append({
+            "has_cover": cover is not None,
+            "has_author": author_link is not None,
+            "title": title_elem.inner_text() if title_elem else None,
+            "author": author_elem.inner_text() if author_elem else None,
+            "user_url": author_link.get_attribute("href") if author_link else None,
+            "time": time_elem.inner_text() if time_elem else None,
+            "href": cover.get_attribute("href") if cover else None,
+        })
+    return raws
+
+
+def raw_note_cards_evaluate(page, limit):
+    return page.evaluate(NOTE_CARDS_JS, limit)
+
+
+def note_card_record(raw, keyword, now=None):
+    """
+    原始字段 → 笔记记录；没有封面链接的卡片（广告等）返回 None。
+    缺少作者链接或封面 href 的卡片抛出 ValueError，由调用方跳过。
+    now 为解析相对时间的参考时间（离线重解析时传抓取时间）。
+    """
+    if not raw["has_cover"]:
+        return None
+    if not raw["has_author"] or raw["href"] is None:
+        raise ValueError("卡片缺少作者链接或封面链接")
+    user_url = raw["user_url"]
+    href = raw["href"]
+    return {
+        "title": raw["title"].strip() if raw["title"] is not None else "N/A",
+        "author": raw["author"].strip() if raw["author"] is not None else "N/A",
+        "time": parse_xiaohongshu_time(raw["time"].strip(), now) if raw["time"] is not None else "N/A",
+        "url": f"https://www.xiaohongshu.com{href}" if href.startswith("/") else href,
+        "note_id": extract_id_from_url(href),
+        "user_id": extract_id_from_url(user_url),
+        "user_url": user_url,
+        "keyword": keyword,
+        "users": [],
+    }
+
+
+def extract_note_cards(page, keyword, limit, mode="evaluate"):
+    """返回 [(原始字段, 笔记记录或 None 或异常)]，按页面顺序"""
+    raws = raw_note_cards_evaluate(page, limit) if mode == "evaluate" else raw_note_cards_elements(page, limit)
+    results = []
+    for raw in raws:
+        try:
+            results.append((raw, note_card_record(raw, keyword)))
+        except Exception as e:
+            results.append((raw, e))
+    return results
+
+
+# ===========================
+# 🧩 评论
+# ===========================
+COMMENT_ITEMS_JS = """
+() => Array.from(document.querySelectorAll('.comment-item')).map(el => {
+    const one = sel => el.querySelector(sel);
+    const text = sel => { const node = one(sel); return node ? node.innerText : null; };
+    const name = one('a.name');
+    return {
+        user: name ? name.innerText : null,
+        href: name ? name.getAttribute('href') : null,
+        content: text('.content '),
+        time: text('.date span:not(.location)'),
+        location: text('.date .location'),
+    };
+})
+"""
+
+
+def raw_comments_elements(page):
+    """逐元素读取评论原始字段（对照用）"""
+    raws = []
+    for el in page.query_selector_all(".comment-item"):
+        user_elem = el.query_selector("a.name")
+        content_elem = el.query_selector(".content ")
+        time_elem = el.query_selector(".date span:not(.location)")
+        location_elem = el.query_selector(".date .location")
+        raws.append({
+            "user": user_elem.inner_text() if user_elem else None,
+            "href": user_elem.get_attribute("href") if user_elem else None,
+            "content": content_elem.inner_text() if content_elem else None,
+            "time": time_elem.inner_text() if time_elem else None,
+            "location": location_elem.inner_text() if location_elem else None,
+        })
+    return raws
+
+
+def raw_comments_evaluate(page):
+    return page.evaluate(COMMENT_ITEMS_JS)
+
+
+def comment_record(raw, now=None):
+    """原始字段 → 评论记录（user_url 为完整链接，href 保留站内路径供抓取用户主页）"""
+    href = raw["href"]
+    return {
+        "user": raw["user"].strip() if raw["user"] is not None else "匿名",
+        "content": raw["content"].strip() if raw["content"] is not None else "",
+        "location": raw["location"].strip() if raw["location"] is not None else "",
+        "time": parse_xiaohongshu_time(raw["time"].strip(), now) if raw["time"] is not None else "",
+        "user_id": extract_id_from_url(href),
+        "user_url": f"https://www.xiaohongshu.com{href}" if href and href.startswith("/") else None,
+    }
+
+
+def extract_comments(page, mode="evaluate"):
+    """按页面顺序逐条生成 (站内用户链接 href, 评论记录)；某条映射失败时之前的评论已经交给调用方"""
+    raws = raw_comments_evaluate(page) if mode == "evaluate" else raw_comments_elements(page)
+    for raw in raws:
+        yield raw["href"], comment_record(raw)
+
+
+# ===========================
+# 🧩 归档 HTML（离线重解析，selectolax）
+# ===========================
+def parse_html(html):
+    """解析一次，供下面几个函数共用（同一页面的正文和评论不必重复解析）"""
+    from selectolax.lexbor import LexborHTMLParser  # 只有离线重解析需要
+    return LexborHTMLParser(html)
+
+
+def _text(node, sel):
+    el = node.css_first(sel)
+    return el.text(deep=True) if el is not None else None
+
+
+def _attr(node, sel, name):
+    el = node.css_first(sel)
+    return el.attributes.get(name) if el is not None else None
+
+
+def raw_note_cards_html(tree, limit):
+    raws = []
+    for item in tree.css("section.note-item")[:limit]:
+        raws.append({
+            "has_cover": item.css_first("a.cover") is not None,
+            "has_author": item.css_first("a.author") is not None,
+            "title": _text(item, "a.title span"),
+            "author": _text(item, "a.author .name"),
+            "user_url": _attr(item, "a.author", "href"),
+            "time": _text(item, "a.author .time"),
+            "href": _attr(item, "a.cover", "href"),
+        })
+    return raws
+
+
+def raw_comments_html(tree):
+    raws = []
+    for el in tree.css(".comment-item"):
+        name = el.css_first("a.name")
+        raws.append({
+            "user": name.text(deep=True) if name is not None else None,
+            "href": name.attributes.get("href") if name is not None else None,
+            "content": _text(el, ".content "),
+            "time": _text(el, ".date span:not(.location)"),
+            "location": _text(el, ".date .location"),
+        })
+    return raws
+
+
+def note_text_html(tree):
+    """.note-text 的 innerHTML（与在线抓取时的 node_text 对应），没有则返回空串"""
+    node = tree.css_first(".note-text")
+    if node is None:
+        return ""
+    return "".join(child.html or "" for child in node.iter(include_text=True))
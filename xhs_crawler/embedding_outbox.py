@@ -0,0 +1,236 @@
+# -*- coding: utf-8 -*-
+"""
+爬虫 → 语义服务的向量化交接：事务性 outbox。
+
+新增评论的 ID 与评论本身在同一个事务里写入 xhs_embedding_outbox（见 persistence.py），
+评论入库即代表“一定会被编码”，爬虫不等待语义服务。
+OutboxConsumer 单独消费：按批取出到期的记录，一次 POST /api/embeddings/batch，
+成功后删除；失败则指数退避（重试间隔逐次翻倍，封顶 max_backoff_sec），记录最后一次错误。
+语义服务返回 4xx（请求本身有问题，重试也不会成功）时整批移到 xhs_embedding_outbox_dead，
+不再重试；408 / 409（索引尚未训练）/ 429 按临时错误处理。
+
+消费者可以作为爬虫进程里的后台线程运行，也可以单独运行：
+    python embedding_outbox.py            持续消费
+    python embedding_outbox.py --status   打印积压情况后退出
+
+只应有一个消费者在运行（取批和删除之间没有加锁）；重复投递是安全的，语义服务按评论 ID 原地替换。
+"""
+import threading
+
+import requests
+
+OUTBOX_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS xhs_embedding_outbox (
+        id BIGINT AUTO_INCREMENT PRIMARY KEY,
+        comment_id VARCHAR(255) NOT NULL,
+        attempts INT NOT NULL DEFAULT 0,
+        next_attempt_at TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+        last_error VARCHAR(500),
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        INDEX idx_next_attempt (next_attempt_at, id)
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+# 永久失败的记录（排查后可以手工挪回 xhs_embedding_outbox 重新投递）
+OUTBOX_DEAD_TABLE_SQL = """
+    CREATE TABLE IF NOT EXISTS xhs_embedding_outbox_dead (
+        id BIGINT PRIMARY KEY,
+        comment_id VARCHAR(255) NOT NULL,
+        attempts INT NOT NULL,
+        last_error VARCHAR(500),
+        created_at TIMESTAMP NULL,
+        failed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
+"""
+
+OUTBOX_INSERT_SQL = "INSERT INTO xhs_embedding_outbox (comment_id) VALUES (%s)"
+
+# 语义服务 /api/embeddings/batch 单次最多接收的评论数（EMBED_BATCH_MAX_IDS）
+SERVICE_MAX_BATCH = 1000
+# 这些 4xx 是临时状态，照常退避重试
+_RETRYABLE_STATUS = (408, 409, 429)
+
+
+def enqueue(cur, comment_ids):
+    """在调用方的事务里登记待编码的评论"""
+    if comment_ids:
+        cur.executemany(OUTBOX_INSERT_SQL, [(cid,) for cid in comment_ids])
+
+
+def backlog(pool):
+    """积压情况：待处理条数、其中重试中的条数、最老一条的等待秒数"""
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("""
+                SELECT COUNT(*), COALESCE(SUM(attempts > 0), 0),
+                       TIMESTAMPDIFF(SECOND, MIN(created_at), NOW())
+                FROM xhs_embedding_outbox
+            """)
+            pending, retrying, oldest = cur.fetchone()
+    return {"pending": int(pending), "retrying": int(retrying), "oldest_age_sec": oldest}
+
+
+class PermanentDeliveryError(Exception):
+    """语义服务拒绝了这批请求（4xx），重试不会成功"""
+
+
+class OutboxConsumer:
+    def __init__(self, pool, api_url, batch_size=500, poll_sec=2.0, timeout=30.0,
+                 base_backoff_sec=5.0, max_backoff_sec=600.0):
+        self.pool = pool
+        self.url = f"{api_url.rstrip('/')}/api/embeddings/batch"
+        if batch_size > SERVICE_MAX_BATCH:
+            print(f"⚠️ outbox_batch_size={batch_size} 超过语义服务单次上限，按 {SERVICE_MAX_BATCH} 投递")
+        self.batch_size = max(1, min(batch_size, SERVICE_MAX_BATCH))
+        self.poll_sec = poll_sec
+        self.timeout = timeout
+        self.base_backoff_sec = base_backoff_sec
+        self.max_backoff_sec = max_backoff_sec
+        self.session = requests.Session()
+        self._stop = threading.Event()
+        self._thread = None
+        self.stats = {"sent": 0, "batches": 0, "failures": 0, "missing": 0, "dead": 0}
+
+    # ---------- 单批 ----------
+    def _take(self):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute("""
+                    SELECT id, comment_id, attempts FROM xhs_embedding_outbox
+                    WHERE next_attempt_at <= NOW()
+                    ORDER BY next_attempt_at, id
+                    LIMIT %s
+                """, (self.batch_size,))
+                return cur.fetchall()
+
+    def _done(self, ids):
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.execute(f"DELETE FROM xhs_embedding_outbox WHERE id IN ({','.join(['%s'] * len(ids))})", ids)
+            conn.commit()
+
+    def _retry_later(self, rows, error):
+        """第 n 次失败后等待 base × 2^(n-1) 秒，封顶 max_backoff_sec"""
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                cur.executemany("""
+                    UPDATE xhs_embedding_outbox
+                    SET attempts = attempts + 1,
+                        next_attempt_at = NOW() + INTERVAL %s SECOND,
+                        last_error = %s
+                    WHERE id = %s
+                """, [(int(min(self.base_backoff_sec * 2 ** attempts, self.max_backoff_sec)), error[:500], row_id)
+                      for row_id, _, attempts in rows])
+            conn.commit()
+
+    def _dead_letter(self, rows, error):
+        """移到 xhs_embedding_outbox_dead，不再重试"""
+        ids = [row_id for row_id, _, _ in rows]
+        placeholders = ",".join(["%s"] * len(ids))
+        with self.pool.connection() as conn:
+            with conn.cursor() as cur:
+                # 建表是 DDL，会隐式提交，放在事务开始之前
+                cur.execute(OUTBOX_DEAD_TABLE_SQL)
+                cur.execute(f"""
+                    INSERT IGNORE INTO xhs_embedding_outbox_dead (id, comment_id, attempts, last_error, created_at)
+                    SELECT id, comment_id, attempts + 1, %s, created_at FROM xhs_embedding_outbox
+                    WHERE id IN ({placeholders})
+                """, [error[:500], *ids])
+                cur.execute(f"DELETE FROM xhs_embedding_outbox WHERE id IN ({placeholders})", ids)
+            conn.commit()
+
+    def drain_once(self):
+        """处理一批，返回处理的条数（0 表示当前没有到期的记录）"""
+        rows = self._take()
+        if not rows:
+            return 0
+        comment_ids = list(dict.fromkeys(cid for _, cid, _ in rows))
+        try:
+            resp = self.session.post(self.url, json={"comment_ids": comment_ids}, timeout=self.timeout)
+            if 400 <= resp.status_code < 500 and resp.status_code not in _RETRYABLE_STATUS:
+                raise PermanentDeliveryError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            if resp.status_code >= 300:
+                raise RuntimeError(f"HTTP {resp.status_code}: {resp.text[:200]}")
+            body = resp.json()
+        except PermanentDeliveryError as e:
+            self.stats["failures"] += 1
+            self.stats["dead"] += len(rows)
+            self._dead_letter(rows, str(e))
+            print(f"❌ 语义服务拒绝了这批评论（{len(rows)} 条移入 xhs_embedding_outbox_dead，不再重试）:", e)
+            return len(rows)
+        except Exception as e:
+            self.stats["failures"] += 1
+            self._retry_later(rows, str(e))
+            print(f"⚠️ 向量化投递失败（{len(rows)} 条稍后重试）:", e)
+            return len(rows)
+        # 语义服务查不到的评论（已被删除等）不再重试
+        missing = body.get("missing") or []
+        if missing:
+            self.stats["missing"] += len(missing)
+            print(f"⚠️ 语义服务未找到 {len(missing)} 条评论，已从 outbox 移除")
+        self._done([row_id for row_id, _, _ in rows])
+        self.stats["sent"] += len(comment_ids)
+        self.stats["batches"] += 1
+        return len(rows)
+
+    # ---------- 持续消费 ----------
+    def run(self):
+        while not self._stop.is_set():
+            try:
+                if self.drain_once():
+                    continue
+            except Exception as e:
+                print("❌ outbox 消费出错:", e)
+            self._stop.wait(self.poll_sec)
+
+    def start(self):
+        self._thread = threading.Thread(target=self.run, name="embedding-outbox", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self, timeout=None):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    import yaml
+
+    from db_pool import MySQLPool
+
+    parser = argparse.ArgumentParser(description="消费 xhs_embedding_outbox，把新增评论交给语义服务编码")
+    parser.add_argument("--status", action="store_true", help="只打印积压情况")
+    args = parser.parse_args()
+
+    with open("config.yaml", "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    semantic = config.get("semantic", {})
+    pool = MySQLPool(
+        max_size=2,
+        name="outbox",
+        host=config["mysql"]["host"],
+        port=int(config["mysql"]["port"]),
+        user=config["mysql"]["user"],
+        password=config["mysql"]["password"],
+        database=config["mysql"]["database"],
+        charset="utf8mb4",
+    )
+    if args.status:
+        print("📬 outbox 积压:", backlog(pool))
+    else:
+        consumer = OutboxConsumer(
+            pool,
+            semantic.get("api_url", "http://127.0.0.1:5000"),
+            batch_size=int(semantic.get("outbox_batch_size", 500)),
+            poll_sec=float(semantic.get("outbox_poll_sec", 2.0)),
+            timeout=float(semantic.get("request_timeout", 30)),
+            max_backoff_sec=float(semantic.get("outbox_max_backoff_sec", 600)),
+        )
+        print("📬 开始消费 outbox，当前积压:", backlog(pool))
+        try:
+            consumer.run()
+        except KeyboardInterrupt:
+            print("📊 outbox 消费统计:", consumer.stats)
@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+进程内“已入库用户”索引，替代逐条评论查库的 user_exists()。
+
+启动时用一次流式查询（SSCursor）把 xhs_users 的 user_id 读进内存，
+之后每篇笔记入库提交时把新用户加进来，存在性检查是一次内存查找。
+
+两种实现（config.yaml crawler.known_users_mode）：
+    set    精确的 Python set，千万级用户约占 1 GB 内存
+    bloom  布隆过滤器，按容量和误判率预分配位数组（千万用户、0.1% 误判约 17 MB）；
+           误判只会让个别新用户被当成已存在而不抓主页，不会误删或重复写入
+"""
+import hashlib
+import math
+import re
+
+import pymysql.cursors
+
+_USER_ID_RE = re.compile(r'/([^/?]+)(?:\?|$)')
+
+
+def user_key(user_id, user_url=None):
+    """用户的唯一键：user_id，缺失时从主页链接里解析（与入库时的 user_id 规则一致）"""
+    if user_id:
+        return user_id
+    if user_url:
+        m = _USER_ID_RE.search(user_url)
+        if m:
+            return m.group(1)
+    return None
+
+
+class BloomFilter:
+    def __init__(self, capacity, error_rate=0.001):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def _positions(self, key):
+        digest = hashlib.blake2b(key.encode("utf-8"), digest_size=16).digest()
+        h1, h2 = int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hashes))
+
+    def add(self, key):
+        for pos in self._positions(key):
+            self.bits[pos >> 3] |= 1 << (pos & 7)
+        self.count += 1
+
+    def __contains__(self, key):
+        return all(self.bits[pos >> 3] & (1 << (pos & 7)) for pos in self._positions(key))
+
+    def __len__(self):
+        return self.count
+
+
+class KnownUsers:
+    def __init__(self, mode="set", bloom_capacity=10_000_000, bloom_error_rate=0.001):
+        if mode not in ("set", "bloom"):
+            raise ValueError("known_users_mode 可选 set / bloom")
+        self.mode = mode
+        self._keys = BloomFilter(bloom_capacity, bloom_error_rate) if mode == "bloom" else set()
+
+    def load(self, pool, chunk_size=10000):
+        """从 xhs_users 流式加载全部用户，返回加载条数"""
+        loaded = 0
+        with pool.connection() as conn:
+            cursor = conn.cursor(pymysql.cursors.SSCursor)
+            try:
+                cursor.execute("SELECT user_id, user_url FROM xhs_users")
+                while True:
+                    rows = cursor.fetchmany(chunk_size)
+                    if not rows:
+                        break
+                    for user_id, user_url in rows:
+                        key = user_key(user_id, user_url)
+                        if key:
+                            self._keys.add(key)
+                            loaded += 1
+            finally:
+                cursor.close()
+        return loaded
+
+    def add(self, user_id, user_url=None):
+        key = user_key(user_id, user_url)
+        if key:
+            self._keys.add(key)
+
+    def __contains__(self, key):
+        return key is not None and key in self._keys
+
+    def exists(self, user_id, user_url=None):
+        return user_key(user_id, user_url) in self
+
+    def stats(self):
+        stats = {"mode": self.mode, "users": len(self._keys)}
+        if self.mode == "bloom":
+            stats.update(bits=self._keys.size, hashes=self._keys.hashes)
+        return stats
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""
+原始页面归档：抓到的搜索结果页、笔记页按 gzip 压缩的 HTML 落盘，
+选择器变了或要加字段时用 reparse.py 离线重新解析，不用再访问一遍小红书。
+
+目录结构（按 键 + 抓取时间 寻址，同一页面多次抓取各留一份）：
+    <root>/note/<note_id 前两位>/<note_id>/<抓取时间>.html.gz
+    <root>/search/<关键词 sha1 前两位>/<关键词 sha1>/<抓取时间>.html.gz
+抓取时间形如 20250314T153012123456，文件名按字典序即按时间排序。
+
+文件第一行是一个 HTML 注释，里面是 JSON 元数据（kind、key、url、fetched_at，
+笔记页还有抓取时的卡片字段 note），其余是 page.content() 的原样 HTML。
+写入先写临时文件再 rename，读到的文件总是完整的。
+"""
+import gzip
+import hashlib
+import json
+import os
+from datetime import datetime
+
+ARCHIVE_KINDS = ("note", "search")
+FETCHED_AT_FORMAT = "%Y-%m-%d %H:%M:%S"
+_HEADER_PREFIX = "<!-- xhs-archive "
+_HEADER_SUFFIX = " -->\n"
+
+
+def search_key(keyword):
+    return hashlib.sha1(keyword.encode("utf-8")).hexdigest()
+
+
+class PageArchive:
+    def __init__(self, root, compresslevel=6):
+        self.root = root
+        self.compresslevel = compresslevel
+
+    def _dir(self, kind, key):
+        return os.path.join(self.root, kind, key[:2], key)
+
+    def save(self, kind, key, html, url=None, fetched_at=None, **meta):
+        """写入一份快照，返回文件路径"""
+        if kind not in ARCHIVE_KINDS:
+            raise ValueError(f"kind 可选 {', '.join(ARCHIVE_KINDS)}")
+        fetched_at = fetched_at or datetime.now()
+        header = {"kind": kind, "key": key, "url": url,
+                  "fetched_at": fetched_at.strftime(FETCHED_AT_FORMAT), **meta}
+        directory = self._dir(kind, key)
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, fetched_at.strftime("%Y%m%dT%H%M%S%f") + ".html.gz")
+        tmp_path = path + ".tmp"
+        with gzip.open(tmp_path, "wt", encoding="utf-8", compresslevel=self.compresslevel) as f:
+            f.write(_HEADER_PREFIX + json.dumps(header, ensure_ascii=False).replace("--", "\\u002d\\u002d")
+                    + _HEADER_SUFFIX)
+            f.write(html)
+        os.replace(tmp_path, path)
+        return path
+
+    def save_note(self, note, html, fetched_at=None):
+        card = {k: v for k, v in note.items() if k not in ("users", "node_text")}
+        return self.save("note", note["note_id"], html, url=note.get("url"), fetched_at=fetched_at, note=card)
+
+    def save_search(self, keyword, html, url=None, fetched_at=None):
+        return self.save("search", search_key(keyword), html, url=url, fetched_at=fetched_at, keyword=keyword)
+
+    def snapshots(self, kind, latest_only=False, since=None):
+        """
+        按 (键, 抓取时间) 顺序列出快照路径；latest_only 时每个键只取最新一份，
+        since（datetime）之前抓取的跳过。
+        """
+        base = os.path.join(self.root, kind)
+        if not os.path.isdir(base):
+            return []
+        cutoff = since.strftime("%Y%m%dT%H%M%S%f") if since else ""
+        paths = []
+        for prefix in sorted(os.listdir(base)):
+            for key in sorted(os.listdir(os.path.join(base, prefix))):
+                directory = os.path.join(base, prefix, key)
+                names = sorted(n for n in os.listdir(directory) if n.endswith(".html.gz") and n >= cutoff)
+                if latest_only:
+                    names = names[-1:]
+                paths.extend(os.path.join(directory, n) for n in names)
+        return paths
+
+
+def read_snapshot(path):
+    """返回 (元数据, HTML)；元数据里的 fetched_at 转为 datetime"""
+    with gzip.open(path, "rt", encoding="utf-8") as f:
+        header = f.readline()
+        html = f.read()
+    if not header.startswith(_HEADER_PREFIX):
+        raise ValueError(f"不是归档快照: {path}")
+    meta = json.loads(header[len(_HEADER_PREFIX):-len(_HEADER_SUFFIX)])
+    meta["fetched_at"] = datetime.strptime(meta["fetched_at"], FETCHED_AT_FORMAT)
+    return meta, html
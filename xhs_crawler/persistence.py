@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+"""
+爬虫入库：一篇笔记连同它的评论、新抓到的用户在同一个事务里写入。
+
+- 评论 ID 由 (note_id, user_id 或昵称, 内容) 生成 uuid5，重复抓取得到同一个 ID；
+  在线抓取时主键或 uk_note_comment_user 冲突的评论被 INSERT IGNORE 跳过，不会中断同一篇笔记的其余评论；
+  离线重解析（upsert_comments=True）改用 ON DUPLICATE KEY UPDATE，用新解析出的字段覆盖已有评论；
+- 笔记、用户用 INSERT ... ON DUPLICATE KEY UPDATE：重复抓取时刷新正文 / 粉丝数等会变的字段，
+  同一篇笔记被不同关键词搜到时关键词追加合并（逗号分隔）；
+- 多行写入用 executemany（pymysql 会改写成一条多行 INSERT），整篇笔记一次提交，失败整体回滚；
+- 本次新增（以及重解析时内容变了）的评论 ID 在同一事务里登记到 xhs_embedding_outbox，
+  由 OutboxConsumer 异步交给语义服务。
+
+用法：
+    result = save_note_bundle(db_pool, note, comments, users)
+    result["comments"]  →  {"inserted": 新增条数, "updated": 被覆盖条数, "skipped": 已存在 / 重复条数}
+"""
+import uuid
+
+from embedding_outbox import enqueue
+
+# 评论 ID 的命名空间（固定值，修改会导致重复抓取时生成不同的 ID）
+COMMENT_ID_NAMESPACE = uuid.UUID("8f6d5c1e-3b0a-4f59-9a57-6f1f2f3c7d21")
+
+NOTE_UPSERT_SQL = """
+    INSERT INTO xhs_notes (note_id, title, node_text, author, user_id, publish_time, url, keywords)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        title = VALUES(title),
+        node_text = IF(VALUES(node_text) = '', node_text, VALUES(node_text)),
+        author = VALUES(author),
+        user_id = COALESCE(VALUES(user_id), user_id),
+        publish_time = VALUES(publish_time),
+        url = VALUES(url),
+        keywords = IF(keywords IS NULL OR FIND_IN_SET(VALUES(keywords), keywords),
+                      COALESCE(keywords, VALUES(keywords)), CONCAT(keywords, ',', VALUES(keywords)))
+"""
+
+COMMENT_INSERT_SQL = """
+    INSERT IGNORE INTO xhs_comments (id, note_id, user_name, content, comment_time, user_id, user_url, location)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+"""
+
+# 重解析用：ID 由 (note_id, 作者, 内容) 决定，冲突时用新解析出的其余字段覆盖
+COMMENT_UPSERT_SQL = """
+    INSERT INTO xhs_comments (id, note_id, user_name, content, comment_time, user_id, user_url, location)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        user_name = VALUES(user_name),
+        content = VALUES(content),
+        comment_time = VALUES(comment_time),
+        user_url = VALUES(user_url),
+        location = VALUES(location)
+"""
+
+USER_UPSERT_SQL = """
+    INSERT INTO xhs_users (user_id, user_url, user_name, user_red_id, location, gender, avatar_url,
+                           followers, following, likes)
+    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s)
+    ON DUPLICATE KEY UPDATE
+        user_url = VALUES(user_url),
+        user_name = VALUES(user_name),
+        user_red_id = VALUES(user_red_id),
+        location = VALUES(location),
+        gender = VALUES(gender),
+        avatar_url = COALESCE(VALUES(avatar_url), avatar_url),
+        followers = VALUES(followers),
+        following = VALUES(following),
+        likes = VALUES(likes)
+"""
+
+
+def comment_id(note_id, comment):
+    """同一篇笔记下同一用户的同一条内容 → 同一个 ID"""
+    author = comment.get("user_id") or comment.get("user") or ""
+    return str(uuid.uuid5(COMMENT_ID_NAMESPACE, "\x1f".join((note_id, author, comment.get("content") or ""))))
+
+
+def _user_row(u):
+    return (u["user_id"], u.get("user_url"), u.get("user_name"), u.get("user_red_id"), u.get("location"),
+            u.get("gender"), u.get("avatar_url"), u.get("followers"), u.get("following"), u.get("likes"))
+
+
+def _existing(cur, sql, keys):
+    if not keys:
+        return set()
+    cur.execute(sql.format(placeholders=",".join(["%s"] * len(keys))), keys)
+    return {row[0] for row in cur.fetchall()}
+
+
+def save_note_bundle(pool, note, comments=(), users=(), upsert_comments=False):
+    """
+    在一个事务里写入笔记、评论和用户，返回各自的计数：
+        note      "inserted" / "updated" / "unchanged"
+        comments  {"inserted", "updated", "skipped"}，以及本次新增评论的 ID（new_comment_ids）
+        users     {"inserted", "updated"}
+    upsert_comments 为 True 时已存在的评论被覆盖（reparse.py 用），否则跳过（在线抓取）。
+    任何一步失败整体回滚并抛出异常。
+    """
+    note_id = note["note_id"]
+    comment_rows = []
+    for cmt in comments:
+        comment_rows.append((comment_id(note_id, cmt), note_id, cmt.get("user"), cmt.get("content"),
+                             cmt.get("time"), cmt.get("user_id"), cmt.get("user_url"), cmt.get("location")))
+    # 同一批里重复的用户只保留最后一次抓到的
+    users = list({u["user_id"]: u for u in users if u and u.get("user_id")}.values())
+    user_rows = [_user_row(u) for u in users]
+    ids = list(dict.fromkeys(row[0] for row in comment_rows))
+
+    with pool.connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                if user_rows:
+                    known_users = _existing(cur, "SELECT user_id FROM xhs_users WHERE user_id IN ({placeholders})",
+                                            [row[0] for row in user_rows])
+                    cur.executemany(USER_UPSERT_SQL, user_rows)
+                else:
+                    known_users = set()
+
+                cur.execute(NOTE_UPSERT_SQL, (note_id, note.get("title"), note.get("node_text") or "",
+                                              note.get("author"), note.get("user_id"), note.get("time"),
+                                              note.get("url"), note.get("keyword")))
+                note_status = {0: "unchanged", 1: "inserted"}.get(cur.rowcount, "updated")
+
+                inserted = updated = 0
+                new_ids = []
+                if comment_rows and upsert_comments:
+                    inserted, updated, new_ids, changed_ids = _upsert_comments(cur, note_id, comment_rows)
+                    enqueue(cur, new_ids + changed_ids)
+                elif comment_rows:
+                    before = _existing(cur, "SELECT id FROM xhs_comments WHERE id IN ({placeholders})", ids)
+                    cur.executemany(COMMENT_INSERT_SQL, comment_rows)
+                    inserted = cur.rowcount
+                    if inserted:
+                        after = _existing(cur, "SELECT id FROM xhs_comments WHERE id IN ({placeholders})", ids)
+                        new_ids = [cid for cid in ids if cid in after and cid not in before]
+                        enqueue(cur, new_ids)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+
+    return {
+        "note": note_status,
+        "comments": {"inserted": inserted, "updated": updated, "skipped": len(comment_rows) - inserted - updated},
+        "users": {"inserted": len(user_rows) - len(known_users), "updated": len(known_users)},
+        "new_comment_ids": new_ids,
+    }
+
+
+def _upsert_comments(cur, note_id, comment_rows):
+    """
+    覆盖写入一篇笔记的评论，返回 (新增条数, 被覆盖条数, 新增 ID, 内容变了的 ID)。
+    uk_note_comment_user 只比较内容前 255 个字符，命中它的已有行 ID 不变、内容可能变，需要重新向量化。
+    """
+    sql = "SELECT id, content FROM xhs_comments WHERE note_id = %s"
+    cur.execute(sql, (note_id,))
+    before = dict(cur.fetchall())
+    cur.executemany(COMMENT_UPSERT_SQL, comment_rows)
+    # ON DUPLICATE KEY UPDATE 的影响行数：新增计 1，有字段变化的更新计 2，没变化的计 0
+    affected = cur.rowcount
+    cur.execute(sql, (note_id,))
+    after = dict(cur.fetchall())
+    new_ids = [cid for cid in after if cid not in before]
+    changed_ids = [cid for cid, content in before.items() if cid in after and after[cid] != content]
+    return len(new_ids), (affected - len(new_ids)) // 2, new_ids, changed_ids
+
+
+def save_users(pool, users):
+    """只写用户（所在笔记没能入库时用，避免已抓到的用户主页白抓），返回写入的用户数"""
+    users = list({u["user_id"]: u for u in users if u and u.get("user_id")}.values())
+    if not users:
+        return 0
+    with pool.connection() as conn:
+        try:
+            with conn.cursor() as cur:
+                cur.executemany(USER_UPSERT_SQL, [_user_row(u) for u in users])
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return len(users)
@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+离线重解析：对 page_archive 归档的页面重新跑一遍字段提取并入库，不访问小红书。
+
+    1. 搜索结果页：进程池并行解析全部快照，得到每篇笔记最新的卡片字段（标题、作者、发布时间……）
+    2. 笔记页：每篇笔记取最新一份快照，进程池并行解析正文和评论，
+       与第 1 步的卡片字段（没有时用快照里抓取时的卡片字段）合并后，
+       每个进程用自己的连接调用 save_note_bundle 入库（与在线抓取同一事务逻辑，新增评论进 outbox）；
+       与在线抓取不同，已存在的评论用新解析出的字段覆盖（upsert_comments=True）
+
+用法：
+    python reparse.py                        重新解析全部归档并入库
+    python reparse.py --dry-run              只解析、统计，不写库（改完选择器先看看结果）
+    python reparse.py --workers 8 --since 2025-03-01
+"""
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import yaml
+
+from dom_extract import (comment_record, note_card_record, note_text_html, parse_html, raw_comments_html,
+                         raw_note_cards_html)
+from page_archive import PageArchive, read_snapshot
+
+# 搜索页上的卡片全部重新解析（在线抓取时只取前 max_notes_per_keyword 条）
+MAX_CARDS_PER_PAGE = 10_000
+
+_worker = {}
+
+
+# ===========================
+# 🧩 单个快照的解析（在子进程里执行）
+# ===========================
+def parse_search_snapshot(path):
+    """返回 (抓取时间, [笔记记录], 解析失败的卡片数)"""
+    meta, html = read_snapshot(path)
+    records, failed = [], 0
+    for raw in raw_note_cards_html(parse_html(html), MAX_CARDS_PER_PAGE):
+        try:
+            record = note_card_record(raw, meta.get("keyword"), now=meta["fetched_at"])
+        except Exception:
+            failed += 1
+            continue
+        if record is not None:
+            records.append(record)
+    return meta["fetched_at"], records, failed
+
+
+def parse_note_snapshot(path, cards):
+    """返回 (笔记记录, [评论记录])"""
+    meta, html = read_snapshot(path)
+    tree = parse_html(html)
+    note = dict(meta.get("note") or {})
+    note.update(cards.get(meta["key"], {}))
+    note["note_id"] = meta["key"]
+    note["node_text"] = note_text_html(tree)
+    comments = [comment_record(raw, now=meta["fetched_at"]) for raw in raw_comments_html(tree)]
+    return note, comments
+
+
+def _init_worker(mysql_kwargs, cards, dry_run):
+    _worker["cards"] = cards
+    _worker["pool"] = None
+    if not dry_run:
+        from db_pool import MySQLPool
+
+        _worker["pool"] = MySQLPool(max_size=1, name=f"reparse-{os.getpid()}", **mysql_kwargs)
+
+
+def reparse_note(path):
+    """解析并入库一篇笔记，返回 (路径, 结果或 None, 错误信息或 None)"""
+    try:
+        note, comments = parse_note_snapshot(path, _worker["cards"])
+        if _worker["pool"] is None:
+            return path, {"note": "dry-run", "comments": {"inserted": 0, "updated": 0, "skipped": 0},
+                          "parsed": len(comments)}, None
+        from persistence import save_note_bundle
+
+        result = save_note_bundle(_worker["pool"], note, comments, upsert_comments=True)
+        result["parsed"] = len(comments)
+        return path, result, None
+    except Exception as e:
+        return path, None, f"{type(e).__name__}: {e}"
+
+
+# ===========================
+# 🧩 主流程
+# ===========================
+def collect_cards(executor, archive, since, chunksize):
+    """每篇笔记取抓取时间最新的卡片字段"""
+    paths = archive.snapshots("search", since=since)
+    cards, newest, failed = {}, {}, 0
+    for fetched_at, records, bad in executor.map(parse_search_snapshot, paths, chunksize=chunksize):
+        failed += bad
+        for record in records:
+            note_id = record["note_id"]
+            if note_id and fetched_at >= newest.get(note_id, fetched_at):
+                newest[note_id] = fetched_at
+                cards[note_id] = {k: v for k, v in record.items() if k != "users"}
+    print(f"🔎 搜索页快照 {len(paths)} 份 → 卡片 {len(cards)} 篇笔记（解析失败 {failed} 张）")
+    return cards
+
+
+def main():
+    parser = argparse.ArgumentParser(description="离线重解析归档页面并入库（不访问小红书）")
+    parser.add_argument("--config", default="config.yaml")
+    parser.add_argument("--archive-dir", help="默认取 config.yaml 的 crawler.archive_dir")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+    parser.add_argument("--since", help="只处理此日期（YYYY-MM-DD）之后抓取的快照")
+    parser.add_argument("--chunksize", type=int, default=16)
+    parser.add_argument("--dry-run", action="store_true", help="只解析不写库")
+    args = parser.parse_args()
+
+    with open(args.config, "r", encoding="utf-8") as f:
+        config = yaml.safe_load(f)
+    archive_dir = args.archive_dir or config["crawler"].get("archive_dir")
+    if not archive_dir or not os.path.isdir(archive_dir):
+        raise SystemExit(f"❌ 归档目录不存在: {archive_dir!r}（crawler.archive_dir 或 --archive-dir）")
+    archive = PageArchive(archive_dir)
+    since = datetime.strptime(args.since, "%Y-%m-%d") if args.since else None
+    mysql_kwargs = {
+        "host": config["mysql"]["host"],
+        "port": int(config["mysql"]["port"]),
+        "user": config["mysql"]["user"],
+        "password": config["mysql"]["password"],
+        "database": config["mysql"]["database"],
+        "charset": "utf8mb4",
+    }
+
+    started = time.time()
+    with ProcessPoolExecutor(args.workers) as executor:
+        cards = collect_cards(executor, archive, since, args.chunksize)
+
+    paths = archive.snapshots("note", latest_only=True, since=since)
+    print(f"🧾 笔记页快照 {len(paths)} 篇，{args.workers} 个进程{'（dry-run，不写库）' if args.dry_run else ''}")
+    totals = {"notes": 0, "errors": 0, "parsed": 0, "inserted": 0, "updated": 0, "skipped": 0}
+    with ProcessPoolExecutor(args.workers, initializer=_init_worker,
+                             initargs=(mysql_kwargs, cards, args.dry_run)) as executor:
+        for i, (path, result, error) in enumerate(executor.map(reparse_note, paths, chunksize=args.chunksize), 1):
+            if error:
+                totals["errors"] += 1
+                print(f"❌ {path}: {error}")
+            else:
+                totals["notes"] += 1
+                totals["parsed"] += result["parsed"]
+                totals["inserted"] += result["comments"]["inserted"]
+                totals["updated"] += result["comments"]["updated"]
+                totals["skipped"] += result["comments"]["skipped"]
+            if i % 500 == 0:
+                print(f"⏳ {i}/{len(paths)}，{i / (time.time() - started):.1f} 篇/秒")
+
+    print(f"✅ 重解析完成：笔记 {totals['notes']} 篇（失败 {totals['errors']}），评论 {totals['parsed']} 条，"
+          f"新增 {totals['inserted']} 条，更新 {totals['updated']} 条，未变 {totals['skipped']} 条，"
+          f"耗时 {time.time() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
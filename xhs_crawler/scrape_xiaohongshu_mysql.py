@@ -1,15 +1,17 @@
 # -*- coding: utf-8 -*-
 import os
 import time
-import re
 import yaml
-from datetime import datetime, timedelta
 import urllib.parse
-import pymysql
 from playwright.sync_api import sync_playwright, TimeoutError
-import requests
 import random
-import uuid
+
+from db_pool import MySQLPool
+from dom_extract import EXTRACT_MODES, extract_comments, extract_id_from_url, extract_note_cards
+from embedding_outbox import OUTBOX_DEAD_TABLE_SQL, OUTBOX_TABLE_SQL, OutboxConsumer, backlog
+from known_users import KnownUsers, user_key
+from page_archive import PageArchive
+from persistence import save_note_bundle, save_users
 
 # ===========================
 # 🧩 读取配置文件
@@ -22,6 +24,7 @@ MYSQL_DB_PORT = int(config["mysql"]["port"])
 MYSQL_DB_USER = config["mysql"]["user"]
 MYSQL_DB_PWD = config["mysql"]["password"]
 MYSQL_DB_NAME = config["mysql"]["database"]
+MYSQL_POOL_SIZE = int(config["mysql"].get("pool_size", 5))
 
 KEYWORDS = [kw.strip() for kw in config["crawler"]["keywords"].split(",")]
 MAX_NOTES_PER_KEYWORD = int(config["crawler"].get("max_notes_per_keyword", 30))
@@ -35,22 +38,53 @@ BATCH_SLEEP_AFTER = int(config["crawler"].get("batch_sleep_after", 10))
 BATCH_SLEEP_SEC = int(config["crawler"].get("batch_sleep_sec", 300))
 USER_AGENT_ROTATE = bool(config["crawler"].get("user_agent_rotate", True))
 PROXY = config["crawler"].get("proxy", "")
+# 页面字段提取：evaluate 一次页面内求值取全部字段；elements 逐元素读取（旧方式）
+EXTRACT_MODE = config["crawler"].get("extract_mode", "evaluate")
+if EXTRACT_MODE not in EXTRACT_MODES:
+    raise ValueError(f"crawler.extract_mode 可选 {', '.join(EXTRACT_MODES)}")
+# 原始页面归档目录（gzip HTML，供 reparse.py 离线重解析），留空不归档
+ARCHIVE_DIR = config["crawler"].get("archive_dir", "")
+# 已入库用户的内存索引：set（精确）或 bloom（超大用户表省内存）
+KNOWN_USERS_MODE = config["crawler"].get("known_users_mode", "set")
+KNOWN_USERS_BLOOM_CAPACITY = int(config["crawler"].get("known_users_bloom_capacity", 10_000_000))
+KNOWN_USERS_BLOOM_ERROR_RATE = float(config["crawler"].get("known_users_bloom_error_rate", 0.001))
+# 语义服务写入节点（多 worker 部署时查询节点只读，写入要发到 writer）
+SEMANTIC_API_URL = config.get("semantic", {}).get("api_url", "http://127.0.0.1:5000").rstrip("/")
+# 新增评论经 outbox 表异步交给语义服务：每批条数、空闲轮询间隔、请求超时、最长重试间隔
+OUTBOX_BATCH_SIZE = int(config.get("semantic", {}).get("outbox_batch_size", 500))
+OUTBOX_POLL_SEC = float(config.get("semantic", {}).get("outbox_poll_sec", 2.0))
+SEMANTIC_TIMEOUT = float(config.get("semantic", {}).get("request_timeout", 30))
+OUTBOX_MAX_BACKOFF_SEC = float(config.get("semantic", {}).get("outbox_max_backoff_sec", 600))
 
 # ===========================
 # 🧩 数据库操作
 # ===========================
-def get_conn():
-    return pymysql.connect(
-        host=MYSQL_DB_HOST,
-        port=MYSQL_DB_PORT,
-        user=MYSQL_DB_USER,
-        password=MYSQL_DB_PWD,
-        database=MYSQL_DB_NAME,
-        charset="utf8mb4"
-    )
+# 全局共享连接池，所有数据库操作复用连接
+db_pool = MySQLPool(
+    max_size=MYSQL_POOL_SIZE,
+    name="crawler",
+    host=MYSQL_DB_HOST,
+    port=MYSQL_DB_PORT,
+    user=MYSQL_DB_USER,
+    password=MYSQL_DB_PWD,
+    database=MYSQL_DB_NAME,
+    charset="utf8mb4"
+)
+
+# 进程内已入库用户，main() 启动时从 xhs_users 加载，每篇笔记入库后补充
+known_users = KnownUsers(KNOWN_USERS_MODE, KNOWN_USERS_BLOOM_CAPACITY, KNOWN_USERS_BLOOM_ERROR_RATE)
+# 本次运行已抓过主页、但所在笔记还没入库的用户（用户随笔记入库，之前不能再抓一遍）
+pending_users = set()
+
+# 原始页面归档（未配置 archive_dir 时为 None）
+page_archive = PageArchive(ARCHIVE_DIR) if ARCHIVE_DIR else None
 
 def init_db():
-    conn = get_conn()
+    with db_pool.connection() as conn:
+        _create_tables(conn)
+    print("✅ 数据库结构已初始化（xhs_notes + xhs_comments + xhs_users + xhs_embedding_outbox）")
+
+def _create_tables(conn):
     cur = conn.cursor()
     # 笔记表
     cur.execute("""
@@ -110,125 +144,16 @@ def init_db():
             INDEX idx_user_id (user_id)
         ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4;
     """)
+
+    # 待向量化的评论（与评论同一事务写入，见 embedding_outbox.py）
+    cur.execute(OUTBOX_TABLE_SQL)
+    cur.execute(OUTBOX_DEAD_TABLE_SQL)
     conn.commit()
     cur.close()
-    conn.close()
-    print("✅ 数据库结构已初始化（xhs_notes + xhs_comments + xhs_users）")
 
 # ===========================
-# 🧩 工具函数（时间、ID解析）
+# 🧩 工具函数（时间、ID 解析在 dom_extract.py）
 # ===========================
-def extract_id_from_url(url: str) -> str | None:
-    if url is None or url == "":
-        return None
-    match = re.search(r'/([^/?]+)(?:\?|$)', url)
-    return match.group(1) if match else None
-def parse_xiaohongshu_time(time_str: str, now: datetime = None) -> str | None:
-    """
-    解析小红书各种时间显示格式，统一转为 'YYYY-MM-DD'（或更精确到秒，按需扩展）。
-    
-    支持格式：
-      - "刚刚"
-      - "3分钟前"
-      - "2小时前"
-      - "今天 14:30"
-      - "昨天 09:15"
-      - "4天前"
-      - "10-12"
-      - "2024-03-15"
-      - "2025-02-14 13:45:22" （兼容）
-    
-    Args:
-        time_str: 原始时间字符串
-        now: 参考时间（默认为当前系统时间）
-    
-    Returns:
-        标准 ISO 日期字符串（如 "2025-11-07"），或 None
-    """
-    if now is None:
-        now = datetime.now()
-    
-    time_str = time_str.strip()
-    if not time_str or time_str in ("N/A", "无", "未知"):
-        return None
-
-    # 1. 刚刚
-    if "刚刚" in time_str:
-        return now.strftime("%Y-%m-%d")
-
-    # 2. X分钟前
-    min_match = re.match(r'^(\d+)分钟前$', time_str)
-    if min_match:
-        minutes = int(min_match.group(1))
-        dt = now - timedelta(minutes=minutes)
-        return dt.strftime("%Y-%m-%d")
-
-    # 3. X小时前
-    hour_match = re.match(r'^(\d+)小时前$', time_str)
-    if hour_match:
-        hours = int(hour_match.group(1))
-        dt = now - timedelta(hours=hours)
-        return dt.strftime("%Y-%m-%d")
-
-    # 4. 今天 HH:mm[:ss]
-    today_match = re.match(r'^今天\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
-    if today_match:
-        h, m, s = int(today_match.group(1)), int(today_match.group(2)), today_match.group(3)
-        s = int(s) if s else 0
-        dt = now.replace(hour=h, minute=m, second=s, microsecond=0)
-        return dt.strftime("%Y-%m-%d")
-
-    # 5. 昨天 HH:mm[:ss]
-    yesterday_match = re.match(r'^昨天\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
-    if yesterday_match:
-        h, m, s = int(yesterday_match.group(1)), int(yesterday_match.group(2)), yesterday_match.group(3)
-        s = int(s) if s else 0
-        dt = (now - timedelta(days=1)).replace(hour=h, minute=m, second=s, microsecond=0)
-        return dt.strftime("%Y-%m-%d")
-
-    # 6. X天前
-    day_match = re.match(r'^(\d+)天前$', time_str)
-    if day_match:
-        days = int(day_match.group(1))
-        dt = now - timedelta(days=days)
-        return dt.strftime("%Y-%m-%d")
-
-    # 7. YYYY-MM-DD HH:mm:ss （完整时间）
-    full_match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})\s+(\d{1,2}):(\d{2})(?::(\d{2}))?$', time_str)
-    if full_match:
-        y, mo, d, h, m, s = map(int, full_match.groups()[:5]) + (int(full_match.group(6)) if full_match.group(6) else 0,)
-        try:
-            dt = datetime(y, mo, d, h, m, s)
-            return dt.strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-
-    # 8. YYYY-MM-DD
-    ymd_match = re.match(r'^(\d{4})-(\d{1,2})-(\d{1,2})$', time_str)
-    if ymd_match:
-        y, mo, d = map(int, ymd_match.groups())
-        try:
-            dt = datetime(y, mo, d)
-            return dt.strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-
-    # 9. MM-DD （最常见于搜索页）
-    md_match = re.match(r'^(\d{1,2})-(\d{1,2})$', time_str)
-    if md_match:
-        mo, d = map(int, md_match.groups())
-        try:
-            # 先试今年
-            candidate = datetime(now.year, mo, d)
-            if candidate > now:
-                candidate = datetime(now.year - 1, mo, d)
-            return candidate.strftime("%Y-%m-%d")
-        except ValueError:
-            pass
-
-    # 无法识别
-    return time_str
-
 def random_wait(base=RANDOM_DELAY_MIN, var=RANDOM_DELAY_MAX):
     delay = base + random.random() * (var - base)
     print(f"⏳ 随机等待 {delay:.2f} 秒...")
@@ -248,83 +173,64 @@ def with_retry(max_retries=MAX_RETRIES):
         return wrapper
     return decorator
 
-# ===========================
-# 🧩 数据保存函数
-# ===========================
-def save_note_to_db(note):
-    conn = get_conn()
-    cur = conn.cursor()
+def archive_page(page, save):
+    """save(html) 把当前页面写入归档；未开启归档时跳过，失败只告警不影响抓取"""
+    if page_archive is None:
+        return
     try:
-        cur.execute("""
-            INSERT IGNORE INTO xhs_notes (note_id, title, node_text, author, user_id, publish_time, url, keywords)
-            VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-        """, (note["note_id"], note["title"], note["node_text"], note["author"], note.get("user_id"), note["time"], note["url"], note["keyword"]))
-        conn.commit()
+        save(page.content())
     except Exception as e:
-        print("❌ 保存笔记失败:", e)
-    finally:
-        cur.close()
-        conn.close()
+        print("⚠️ 页面归档失败:", e)
 
-def save_comments_to_db(note_url, comments):
-    conn = get_conn()
-    cur = conn.cursor()
-    note_id = extract_id_from_url(note_url)
-    if not note_id:
-        print("⚠️ 无法提取笔记ID，跳过评论保存")
-        return
+# ===========================
+# 🧩 数据保存函数
+# ===========================
+def save_note(note, comments, users):
+    """笔记 + 评论 + 新用户（以及新增评论的 outbox 记录）一个事务入库，不等待语义服务"""
+    if not note.get("note_id"):
+        print("⚠️ 无法提取笔记ID，跳过保存")
+        return None
     try:
-        ids = []
-        for cmt in comments:
-            id = str(uuid.uuid4())
-            cur.execute("""
-                INSERT INTO xhs_comments (id, note_id, user_name, content, comment_time, user_id, user_url, location)
-                VALUES (%s, %s, %s, %s, %s, %s, %s, %s)
-            """, (id, note_id, cmt["user"], cmt["content"], cmt["time"], cmt.get("user_id"), cmt.get("user_url"), cmt.get("location")))
-            ids.append(id)
-        conn.commit()
-        for id in ids:
-            requests.post("http://127.0.0.1:5000/api/embeddings", json={
-                "comment_id": id
-            })
-        print(f"💾 已新增 {len(comments)} 条评论")
+        result = save_note_bundle(db_pool, note, comments, users)
     except Exception as e:
-        print("❌ 保存评论失败:", e)
-    finally:
-        cur.close()
-        conn.close()
+        print(f"❌ 保存笔记 {note.get('note_id')} 失败（整篇回滚）:", e)
+        save_orphan_users(users)
+        return None
+    mark_users_saved(users)
+    print(f"💾 笔记 {note['note_id']}（{result['note']}）：新增评论 {result['comments']['inserted']} 条，"
+          f"跳过 {result['comments']['skipped']} 条；新增用户 {result['users']['inserted']} 个，"
+          f"更新 {result['users']['updated']} 个")
+    return result
 
 # ===========================
-# 🧩 用户检查与保存
+# 🧩 用户检查
 # ===========================
+def load_known_users():
+    started = time.time()
+    loaded = known_users.load(db_pool)
+    print(f"👥 已加载 {loaded} 个已入库用户（{known_users.mode}），耗时 {time.time() - started:.2f}s")
+
 def user_exists(user_id, user_url):
-    conn = get_conn()
-    cur = conn.cursor()
-    cur.execute("SELECT COUNT(*) FROM xhs_users WHERE user_id=%s OR user_url=%s", (user_id, user_url))
-    exists = cur.fetchone()[0] > 0
-    cur.close()
-    conn.close()
-    return exists
+    """内存查找，不访问数据库；本次已抓过主页、等待随笔记入库的用户也算存在"""
+    return known_users.exists(user_id, user_url) or user_key(user_id, user_url) in pending_users
 
-def save_user_to_db(user):
-    conn = get_conn()
-    cur = conn.cursor()
+def mark_users_saved(users):
+    for user in users:
+        if user:
+            known_users.add(user.get("user_id"), user.get("user_url"))
+            pending_users.discard(user_key(user.get("user_id"), user.get("user_url")))
+
+def save_orphan_users(users):
+    """所在笔记没能入库时单独写入已抓到的用户；仍然失败则移出 pending，之后遇到再抓"""
     try:
-        cur.execute("""
-            INSERT IGNORE INTO xhs_users (user_id, user_url, user_name, user_red_id, location, gender, avatar_url, followers, following, likes)
-            VALUES (%s,%s,%s,%s,%s,%s,%s,%s,%s,%s)
-        """, (
-            user.get("user_id"), user.get("user_url"), user.get("user_name"), user.get("user_red_id"),
-            user.get("location"), user.get("gender"), user.get("avatar_url"),
-            user.get("followers"), user.get("following"), user.get("likes")
-        ))
-        conn.commit()
-        print(f"✅ 用户 {user.get('user_name')} 信息已保存")
+        save_users(db_pool, users)
     except Exception as e:
-        print("❌ 保存用户失败:", e)
-    finally:
-        cur.close()
-        conn.close()
+        print("❌ 单独保存用户失败:", e)
+        for user in users:
+            if user:
+                pending_users.discard(user_key(user.get("user_id"), user.get("user_url")))
+        return
+    mark_users_saved(users)
 
 # ===========================
 # 🧩 爬取用户详情
@@ -332,6 +238,7 @@ def save_user_to_db(user):
         
 @with_retry()
 def scrape_user_detail(context, user_url):
+    """抓取用户主页，返回用户信息（随所在笔记一起入库），已存在或失败返回 None"""
     if not user_url:
         return None
 
@@ -367,8 +274,8 @@ def scrape_user_detail(context, user_url):
             "likes": likes,
         }
 
-        save_user_to_db(user_data)
         print(f"✅ 用户详情抓取完成: {user_name} ({user_id})")
+        pending_users.add(user_key(user_id, user_url))
         return user_data
     except Exception as e:
         print("❌ 用户详情抓取失败:", e)
@@ -396,40 +303,29 @@ def scrape_keyword(context,page, keyword):
     except Exception as e:
         print("⚠️ 搜索异常:", e)
         input("请手动处理验证码后回车继续 >>> ")
+    archive_page(page, lambda html: page_archive.save_search(keyword, html, target_url))
 
     results = []
-    note_items = page.query_selector_all("section.note-item")[:MAX_NOTES_PER_KEYWORD]
-    for item in note_items:
-        try:
-            if item.query_selector("a.cover") is None:
-                continue
-            title_elem = item.query_selector("a.title span")
-            title = title_elem.inner_text().strip() if title_elem else "N/A"
-            author_elem = item.query_selector("a.author .name")
-            user_url = item.query_selector("a.author").get_attribute("href")
-            user_id = extract_id_from_url(user_url)
-            author = author_elem.inner_text().strip() if author_elem else "N/A"
-            time_elem = item.query_selector("a.author .time")
-            post_time = parse_xiaohongshu_time(time_elem.inner_text().strip()) if time_elem else "N/A"
-            href = item.query_selector("a.cover").get_attribute("href")
-            detail_url = f"https://www.xiaohongshu.com{href}" if href.startswith("/") else href
-            note_id = extract_id_from_url(href)
-            results.append({
-                "title": title, "author": author, "time": post_time,
-                "url": detail_url, "note_id": note_id, "user_id": user_id, "user_url": user_url, 
-                "keyword": keyword
-            })
-            if user_id and not user_exists(user_id, user_url):
-                scrape_user_detail(context, user_url)
-        except Exception as e:
-            print("❌ 笔记解析失败",e)
+    for _, note in extract_note_cards(page, keyword, MAX_NOTES_PER_KEYWORD, EXTRACT_MODE):
+        if note is None:
+            continue
+        if isinstance(note, Exception):
+            print("❌ 笔记解析失败", note)
             continue
+        results.append(note)
+        if note["user_id"] and not user_exists(note["user_id"], note["user_url"]):
+            author_user = scrape_user_detail(context, note["user_url"])
+            if author_user:
+                note["users"].append(author_user)
     return results
 @with_retry()
-def scrape_comments_by_url(context, url):
+def scrape_comments_by_url(context, note):
+    url = note["url"]
     print(f"🧭 打开笔记: {url}")
     page = context.new_page()
     comments = []
+    users = []
+    seen_users = set()  # 同一篇笔记里抓取失败的用户不再重试（抓到的已记入 pending_users）
     node_text = ""
     try:
         page.add_init_script("""
@@ -451,33 +347,23 @@ def scrape_comments_by_url(context, url):
                 time.sleep(2)
             if page.locator('.end-container').count() or page.locator(".no-comments").count():
                 break
+        if note.get("note_id"):
+            archive_page(page, lambda html: page_archive.save_note(note, html))
         if page.locator(".no-comments").count():
-            return node_text,[]
-        elems = page.query_selector_all(".comment-item")
-        for el in elems:
-            user_elem = el.query_selector("a.name")
-            href = user_elem.get_attribute("href") if user_elem else None
-            user_url = f"https://www.xiaohongshu.com{href}" if href and href.startswith("/") else None
-            user_id = extract_id_from_url(href)
-            content_elem = el.query_selector(".content ")
-            time_elem = el.query_selector(".date span:not(.location)")
-            location_elem = el.query_selector(".date .location")
-            time_str = parse_xiaohongshu_time(time_elem.inner_text().strip()) if time_elem else ""
-            comments.append({
-                "user": user_elem.inner_text().strip() if user_elem else "匿名",
-                "content": content_elem.inner_text().strip() if content_elem else "",
-                "location": location_elem.inner_text().strip() if location_elem else "",
-                "time": time_str,
-                "user_id": user_id,
-                "user_url": user_url
-            })
-            if user_id and not user_exists(user_id, user_url):
-                scrape_user_detail(context, href)
+            return node_text, [], []
+        for href, comment in extract_comments(page, EXTRACT_MODE):
+            comments.append(comment)
+            user_id, user_url = comment["user_id"], comment["user_url"]
+            if user_id and user_id not in seen_users and not user_exists(user_id, user_url):
+                seen_users.add(user_id)
+                user = scrape_user_detail(context, href)
+                if user:
+                    users.append(user)
     except Exception as e:
         print("❌ 评论抓取失败:", e)
     finally:
         page.close()
-    return node_text,comments
+    return node_text, comments, users
 
 # ---------- 辅助：安全的查询器 ----------
 def safe_query_selector(page, selector: str, wait_timeout: int = 2500, retries: int = 2):
@@ -513,6 +399,10 @@ def safe_query_selector_text(page, selector: str, wait_timeout: int = 2500, defa
 # ---------- 在 main() 中使用更稳健的登录检测 ----------
 def main():
     init_db()
+    load_known_users()
+    outbox = OutboxConsumer(db_pool, SEMANTIC_API_URL, batch_size=OUTBOX_BATCH_SIZE, poll_sec=OUTBOX_POLL_SEC,
+                            timeout=SEMANTIC_TIMEOUT, max_backoff_sec=OUTBOX_MAX_BACKOFF_SEC).start()
+    print("📬 向量化 outbox 积压:", backlog(db_pool))
     with sync_playwright() as p:
         context = p.chromium.launch_persistent_context(
             user_data_dir="./xhs_profile",
@@ -601,15 +491,21 @@ def main():
                     print(f"😴 达到 {BATCH_SLEEP_AFTER} 篇，休息 {BATCH_SLEEP_SEC} 秒以防风控...")
                     time.sleep(BATCH_SLEEP_SEC)
                 try:
-                    node_text,comments = scrape_comments_by_url(context, note["url"])
+                    scraped = scrape_comments_by_url(context, note)
+                    if scraped is None:
+                        save_orphan_users(note["users"])
+                        continue
+                    node_text, comments, users = scraped
                     note["node_text"] = node_text
-                    save_note_to_db(note)
-                    if comments:
-                        save_comments_to_db(note["url"], comments)
+                    save_note(note, comments, note["users"] + users)
                 except Exception as e:
                     print(f"⚠️ 处理笔记 {note.get('url')} 时出错：", e)
 
         context.close()
+    # 剩余的积压留在表里，由下次运行或 python embedding_outbox.py 继续消费
+    outbox.stop(timeout=SEMANTIC_TIMEOUT)
+    print("📬 outbox 投递统计:", outbox.stats, "剩余积压:", backlog(db_pool))
+    print("📊 连接池统计:", db_pool.stats())
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,29 @@
+# -*- coding: utf-8 -*-
+"""
+需要 MySQL 的测试通过环境变量指定一个可以随意建表、删表的库，没有配置时跳过：
+    XHS_TEST_MYSQL_HOST / XHS_TEST_MYSQL_PORT / XHS_TEST_MYSQL_USER / XHS_TEST_MYSQL_PASSWORD / XHS_TEST_MYSQL_DATABASE
+"""
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def mysql_pool():
+    if not os.environ.get("XHS_TEST_MYSQL_HOST"):
+        pytest.skip("未配置 XHS_TEST_MYSQL_HOST")
+    pytest.importorskip("pymysql")
+    from db_pool import MySQLPool
+
+    pool = MySQLPool(max_size=2, name="test",
+                     host=os.environ["XHS_TEST_MYSQL_HOST"],
+                     port=int(os.environ.get("XHS_TEST_MYSQL_PORT", 3306)),
+                     user=os.environ.get("XHS_TEST_MYSQL_USER", "root"),
+                     password=os.environ.get("XHS_TEST_MYSQL_PASSWORD", ""),
+                     database=os.environ.get("XHS_TEST_MYSQL_DATABASE", "xhs_test"),
+                     charset="utf8mb4")
+    yield pool
+    pool.close_all()
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+OutboxConsumer：批大小不超过语义服务上限；4xx 移入死信表不再重试，5xx / 409 退避重试。
+需要 MySQL（见 conftest.py），语义服务用本地 HTTP 桩代替。
+"""
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+
+pytest.importorskip("requests")
+
+from embedding_outbox import (OUTBOX_DEAD_TABLE_SQL, OUTBOX_TABLE_SQL, SERVICE_MAX_BATCH,  # noqa: E402
+                              OutboxConsumer, enqueue)
+
+
+class FakeService(BaseHTTPRequestHandler):
+    status = 200
+    received = []
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        FakeService.received.append(len(body["comment_ids"]))
+        payload = json.dumps({"saved": len(body["comment_ids"]), "missing": []} if self.status == 200
+                             else {"error": "rejected"}).encode("utf-8")
+        self.send_response(self.status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def service():
+    server = HTTPServer(("127.0.0.1", 0), FakeService)
+    FakeService.status, FakeService.received = 200, []
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+
+
+@pytest.fixture
+def pool(mysql_pool):
+    with mysql_pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("DROP TABLE IF EXISTS xhs_embedding_outbox")
+            cur.execute("DROP TABLE IF EXISTS xhs_embedding_outbox_dead")
+            cur.execute(OUTBOX_TABLE_SQL)
+            cur.execute(OUTBOX_DEAD_TABLE_SQL)
+            enqueue(cur, [f"c{i}" for i in range(1500)])
+        conn.commit()
+    return mysql_pool
+
+
+def _count(pool, table, where="1"):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute(f"SELECT COUNT(*) FROM {table} WHERE {where}")
+            return cur.fetchone()[0]
+
+
+def test_batch_size_is_clamped(pool, service):
+    consumer = OutboxConsumer(pool, service, batch_size=5000)
+    assert consumer.batch_size == SERVICE_MAX_BATCH
+    assert consumer.drain_once() == SERVICE_MAX_BATCH
+    assert FakeService.received == [SERVICE_MAX_BATCH]
+    assert _count(pool, "xhs_embedding_outbox") == 500
+
+
+def test_client_error_is_dead_lettered(pool, service):
+    FakeService.status = 400
+    consumer = OutboxConsumer(pool, service, batch_size=1000)
+    assert consumer.drain_once() == 1000
+    assert _count(pool, "xhs_embedding_outbox") == 500
+    assert _count(pool, "xhs_embedding_outbox_dead", "last_error LIKE 'HTTP 400%'") == 1000
+    assert consumer.stats["dead"] == 1000
+
+
+@pytest.mark.parametrize("status", [409, 503])
+def test_transient_errors_are_retried(pool, service, status):
+    FakeService.status = status
+    consumer = OutboxConsumer(pool, service, batch_size=1000)
+    consumer.drain_once()
+    assert _count(pool, "xhs_embedding_outbox") == 1500
+    assert _count(pool, "xhs_embedding_outbox", "attempts = 1") == 1000
+    assert _count(pool, "xhs_embedding_outbox_dead") == 0
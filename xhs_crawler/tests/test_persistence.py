@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+save_note_bundle 的评论写入：在线抓取只插入新评论，重解析（upsert_comments=True）覆盖已有评论。
+需要 MySQL（见 conftest.py），没有配置时跳过。
+"""
+import pytest
+
+pytest.importorskip("requests")
+
+from embedding_outbox import OUTBOX_TABLE_SQL  # noqa: E402
+from persistence import comment_id, save_note_bundle  # noqa: E402
+
+NOTE = {"note_id": "test-note-1", "title": "标题", "node_text": "正文", "author": "作者", "time": "2025-03-01"}
+
+
+@pytest.fixture
+def pool(mysql_pool):
+    pool = mysql_pool
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            for table in ("xhs_embedding_outbox", "xhs_comments", "xhs_users", "xhs_notes"):
+                cur.execute(f"DROP TABLE IF EXISTS {table}")
+            cur.execute("""
+                CREATE TABLE xhs_notes (
+                    id BIGINT AUTO_INCREMENT PRIMARY KEY, note_id VARCHAR(64) NOT NULL, title VARCHAR(255),
+                    node_text TEXT, author VARCHAR(255), user_id VARCHAR(64), publish_time VARCHAR(100),
+                    url TEXT, keywords TEXT, UNIQUE KEY uk_note_id (note_id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            cur.execute("""
+                CREATE TABLE xhs_comments (
+                    id VARCHAR(255) PRIMARY KEY, note_id VARCHAR(64) NOT NULL, user_id VARCHAR(64),
+                    user_name VARCHAR(255), user_url TEXT, location VARCHAR(255), content TEXT,
+                    comment_time VARCHAR(100),
+                    UNIQUE KEY uk_note_comment_user (note_id, content(255), user_id)
+                ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4
+            """)
+            cur.execute(OUTBOX_TABLE_SQL)
+        conn.commit()
+    return pool
+
+
+def _comment(**fields):
+    comment = {"user": "小明", "user_id": "u1", "content": "好用", "time": "2025-03-01",
+               "location": "上海", "user_url": "https://www.xiaohongshu.com/user/profile/u1"}
+    comment.update(fields)
+    return comment
+
+
+def _row(pool, cid):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT comment_time, location, user_url FROM xhs_comments WHERE id = %s", (cid,))
+            return cur.fetchone()
+
+
+def _outbox(pool):
+    with pool.connection() as conn:
+        with conn.cursor() as cur:
+            cur.execute("SELECT comment_id FROM xhs_embedding_outbox ORDER BY id")
+            return [row[0] for row in cur.fetchall()]
+
+
+def test_online_save_skips_existing_comments(pool):
+    cid = comment_id(NOTE["note_id"], _comment())
+    first = save_note_bundle(pool, NOTE, [_comment()])
+    assert first["comments"] == {"inserted": 1, "updated": 0, "skipped": 0}
+    second = save_note_bundle(pool, NOTE, [_comment(location="北京")])
+    assert second["comments"] == {"inserted": 0, "updated": 0, "skipped": 1}
+    assert _row(pool, cid)[1] == "上海"
+    assert _outbox(pool) == [cid]
+
+
+def test_reparse_overwrites_existing_comments(pool):
+    cid = comment_id(NOTE["note_id"], _comment())
+    first = save_note_bundle(pool, NOTE, [_comment()], upsert_comments=True)
+    assert first["comments"] == {"inserted": 1, "updated": 0, "skipped": 0}
+
+    fixed = _comment(time="2025-03-02", location="北京", user_url="https://www.xiaohongshu.com/user/profile/u1?x=1")
+    second = save_note_bundle(pool, NOTE, [fixed], upsert_comments=True)
+    assert second["comments"] == {"inserted": 0, "updated": 1, "skipped": 0}
+    assert _row(pool, cid) == ("2025-03-02", "北京", "https://www.xiaohongshu.com/user/profile/u1?x=1")
+
+    third = save_note_bundle(pool, NOTE, [fixed], upsert_comments=True)
+    assert third["comments"] == {"inserted": 0, "updated": 0, "skipped": 1}
+    # 只有新增评论进 outbox；内容没变的覆盖不需要重新编码
+    assert _outbox(pool) == [cid]
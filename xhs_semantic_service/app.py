@@ -1,20 +1,118 @@
 # -*- coding: utf-8 -*-
-from flask import Flask, request, jsonify
-from text2vec import SentenceModel
-import faiss
+from flask import Flask, Response, g, has_request_context, request, jsonify
 import numpy as np
-import pymysql
+import pymysql.cursors
+import atexit
+import html
+import json
 import os
+import re
+import threading
+import time
+from contextlib import nullcontext
+
+import index_factory
+from attributes import AttributeIndex, bitmap_selector, parse_day
+from cache import TTLCache
+from embed_cache import EmbeddingCache
+from lexical_index import LexicalIndex
+from near_dup import NearDupIndex
+from note_index import NoteIndex
+from topics import TOPICS_FILE, TopicResult, run_topics
+from db_pool import MySQLPool
+from encoder import INFERENCE_ADDRESS, LocalEncoder, RemoteEncoder
+from metrics import Registry, StageTimer
+from vector_store import DEFAULT_SHARD, MANIFEST_NAME, ReadOnlyVectorStore, VectorStore
 
 app = Flask(__name__)
 
+# ===============================
+# 📈 指标：分阶段耗时直方图 + 慢请求日志（/metrics 输出）
+# ===============================
+# 总耗时超过该值（毫秒）的请求打印分阶段耗时
+SLOW_REQUEST_MS = float(os.environ.get("SLOW_REQUEST_MS", 1000))
+metrics = Registry()
+stage_seconds = metrics.histogram("xhs_stage_seconds", "各接口分阶段耗时（秒）", ("endpoint", "stage"))
+request_seconds = metrics.histogram("xhs_request_seconds", "请求总耗时（秒）", ("endpoint",))
+requests_total = metrics.counter("xhs_requests_total", "请求数", ("endpoint", "status"))
+slow_requests_total = metrics.counter("xhs_slow_requests_total", "超过 SLOW_REQUEST_MS 的请求数", ("endpoint",))
+
+
+def stage(name):
+    """给当前请求的一个阶段计时；后台线程里（没有请求上下文）调用时不计时"""
+    timer = g.get("timer") if has_request_context() else None
+    return timer.stage(name) if timer is not None else nullcontext()
+
+
+@app.before_request
+def start_request_timer():
+    g.timer = StageTimer(stage_seconds, request.endpoint or "unknown")
+
+
+@app.after_request
+def record_request_metrics(response):
+    timer = g.get("timer")
+    if timer is None:
+        return response
+    elapsed = timer.elapsed()
+    request_seconds.observe(elapsed, endpoint=timer.endpoint)
+    requests_total.inc(endpoint=timer.endpoint, status=response.status_code)
+    if elapsed * 1000 >= SLOW_REQUEST_MS:
+        slow_requests_total.inc(endpoint=timer.endpoint)
+        print("🐢 慢请求", json.dumps({
+            "endpoint": timer.endpoint,
+            "path": request.full_path.rstrip("?"),
+            "status": response.status_code,
+            "total_ms": round(elapsed * 1000, 2),
+            "stages_ms": timer.breakdown_ms(),
+        }, ensure_ascii=False))
+    return response
+
 # ===============================
 # 🔹 使用更强的中文语义模型
 # ===============================
-# 可选："shibing624/text2vec-large-chinese" 或 "BAAI/bge-large-zh-v1.5"
-model = SentenceModel("BAAI/bge-large-zh-v1.5")
+# 可选："shibing624/text2vec-large-chinese" 或 "BAAI/bge-large-zh-v1.5"（EMBED_MODEL）
+# 配置了 INFERENCE_ADDRESS 时模型只在独立推理进程（inference_server.py）里加载，
+# 本进程只做转发；否则在进程内加载（单进程开发模式）
+encoder = RemoteEncoder(INFERENCE_ADDRESS) if INFERENCE_ADDRESS else LocalEncoder()
 VECTOR_DIM = 1024  # bge-large 输出 1024 维
-INDEX_PATH = "vector_store.faiss"
+
+
+def encode_texts(texts):
+    return encoder.encode(texts)
+
+# 数据文件目录（docker 中挂载为卷）
+DATA_DIR = os.environ.get("DATA_DIR", ".")
+os.makedirs(DATA_DIR, exist_ok=True)
+# 每条写入先 fsync 到追加日志再返回；关闭后崩溃可能丢失最近的写入，但吞吐更高
+WAL_FSYNC = os.environ.get("WAL_FSYNC", "1") == "1"
+# 只读副本模式：快照以内存映射方式加载（多进程共享），不接受写入
+INDEX_MMAP = os.environ.get("INDEX_MMAP", "0") == "1"
+# 只读副本跟随写入节点的间隔：回放新增日志，发现新快照则重新加载
+REPLICA_SYNC_SEC = float(os.environ.get("REPLICA_SYNC_SEC", 2))
+# 只读副本拒绝写请求时提示的写入节点地址
+WRITER_URL = os.environ.get("WRITER_URL", "")
+# /api/init 流式重建时每批读取 + 编码的评论条数，决定重建过程的峰值内存
+INIT_CHUNK_SIZE = int(os.environ.get("INIT_CHUNK_SIZE", 2000))
+# /api/embeddings/batch 单次最多接收的评论数
+EMBED_BATCH_MAX_IDS = int(os.environ.get("EMBED_BATCH_MAX_IDS", 1000))
+# 评论向量持久缓存（按模型 + 规范化文本哈希），重建 / 写入时只编码没见过的文本
+EMBED_CACHE_ENABLED = os.environ.get("EMBED_CACHE", "1") == "1"
+# 向量分片方式：none（单一分片）或 month（按评论月份，新数据只写入当月的热分片）
+SHARD_BY = os.environ.get("SHARD_BY", "none")
+# 索引落盘检查点：每隔 CHECKPOINT_INTERVAL_SEC 秒，或累计 CHECKPOINT_MAX_DIRTY 条变更
+CHECKPOINT_INTERVAL_SEC = float(os.environ.get("CHECKPOINT_INTERVAL_SEC", 60))
+CHECKPOINT_MAX_DIRTY = int(os.environ.get("CHECKPOINT_MAX_DIRTY", 1000))
+
+embed_cache = EmbeddingCache(os.path.join(DATA_DIR, "embed_cache.sqlite"), lambda: encoder.model_name, VECTOR_DIM) \
+    if EMBED_CACHE_ENABLED else None
+
+
+def encode_documents(texts):
+    """评论编码（重建 / 写入路径）：先查持久缓存，只把没见过的文本送去模型"""
+    if embed_cache is None:
+        return encode_texts(texts)
+    return embed_cache.encode(texts, encode_texts)
 
 # ===============================
 # 🔹 MySQL 配置
@@ -28,23 +126,80 @@ MYSQL_CONFIG = {
     "charset": "utf8mb4"
 }
 
+# 全局共享连接池（所有接口复用，避免每次请求都握手建连）
+db_pool = MySQLPool(
+    max_size=int(os.environ.get("MYSQL_POOL_SIZE", 10)),
+    timeout=float(os.environ.get("MYSQL_POOL_TIMEOUT", 10)),
+    name="semantic",
+    **MYSQL_CONFIG,
+)
+
 # ===============================
-# 🔹 初始化 FAISS 索引（改为内积）
+# 🔹 初始化向量存储（内积索引 + ID 映射）
 # ===============================
-if os.path.exists(INDEX_PATH):
-    index = faiss.read_index(INDEX_PATH)
-    print("✅ 已加载现有向量索引")
-else:
-    # 改为内积索引（cosine similarity）
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    print("🆕 创建新向量索引（余弦相似度）")
-
-# comment_id 映射
-ID_MAP_PATH = "id_map.npy"
-if os.path.exists(ID_MAP_PATH):
-    id_map = np.load(ID_MAP_PATH, allow_pickle=True).tolist()
+# 加载最近的快照并回放追加日志；没有数据时新建内积索引（类型由 INDEX_TYPE 决定）
+if INDEX_MMAP:
+    # 副本可能先于写入节点启动，等写入节点生成第一份快照
+    while not os.path.exists(os.path.join(DATA_DIR, MANIFEST_NAME)):
+        print("⏳ 等待写入节点生成快照...")
+        time.sleep(2)
+    store = ReadOnlyVectorStore.open(DATA_DIR)
 else:
-    id_map = []
+    store = VectorStore.open(DATA_DIR, VECTOR_DIM, wal_fsync=WAL_FSYNC)
+
+# 评论内容与过滤属性的查询；id 之后的列 (content, 属性...) 称为一行 row，
+# 属性部分的顺序与 AttributeIndex.set 的行格式一致
+COMMENT_SQL = """
+    SELECT xc.id, xc.content, xc.note_id, xc.comment_time, xc.location, xn.keywords
+    FROM xhs_comments xc
+    LEFT JOIN xhs_notes xn ON xc.note_id = xn.note_id
+"""
+
+
+def shard_for(row):
+    """按 SHARD_BY 决定一条评论（row，见 COMMENT_SQL）写入的分片"""
+    if SHARD_BY == "month":
+        comment_time = row[2]
+        return str(comment_time)[:7] if parse_day(comment_time) >= 0 else "unknown"
+    return DEFAULT_SHARD
+
+
+class SideIndexes:
+    """
+    与 store 的 vid 对应的旁路索引，随 store 一起替换：
+        attrs    属性列（评论日期 / IP 属地 / 笔记 / 笔记关键词），用于过滤
+        lexical  BM25 倒排索引，用于混合检索
+        dups     SimHash 近重复聚类，用于折叠搜索结果里的重复评论
+        notes    笔记级向量（评论向量均值 + 笔记正文向量），用于按笔记检索；
+                 写入只标记所属笔记待刷新，由后台 refresh_notes 重新聚合
+    """
+
+    def __init__(self):
+        self.attrs = AttributeIndex()
+        self.lexical = LexicalIndex()
+        self.dups = NearDupIndex()
+        self.notes = NoteIndex(VECTOR_DIM)
+
+    def mark_ready(self):
+        self.attrs.ready = self.lexical.ready = self.dups.ready = True
+
+    def index_rows(self, vids, rows):
+        """向量写入后同步更新各旁路索引；原地替换的 vid 可能换了笔记，新旧笔记都要刷新"""
+        previous = self.attrs.notes_of(vids)
+        self.attrs.set(vids, [row[1:] for row in rows])
+        self.lexical.add(vids, [row[0] for row in rows])
+        self.dups.add(vids, [row[0] for row in rows])
+        self.notes.mark_dirty(np.concatenate([previous, self.attrs.notes_of(vids)]))
+
+    def unindex(self, vids):
+        """作废的 vid（被替换 / 删除）从各旁路索引中移除"""
+        self.notes.mark_dirty(self.attrs.notes_of(vids))
+        self.attrs.clear(vids)
+        self.lexical.remove(vids)
+        self.dups.remove(vids)
+
+
+side = SideIndexes()
 
 # ===============================
 # 📥 工具函数：向量归一化
@@ -54,146 +209,1117 @@ def normalize(vecs):
     return vecs / norms
 
 
+# 重建互斥锁（同一时间只允许一个 /api/init）；store 引用的读取锁；
+# 写入锁：串行化写入与 store 替换，保证重建期间的写入不会丢失
+init_lock = threading.Lock()
+index_lock = threading.Lock()
+write_lock = threading.Lock()
+# 重建进行中时记录期间的写入 [(comment_id, 向量或 None 表示删除, row)]，替换前补写到新 store
+rebuild_backlog = None
+
+# 索引版本号：任何写入 / 删除 / 重建 / 重置都会 +1，搜索结果缓存以它作为 key 的一部分
+index_version = 0
+# 笔记索引版本号：定时刷新笔记向量后 +1，只影响笔记搜索的缓存，不动评论搜索缓存
+note_version = 0
+
+# 查询文本 → 向量（与索引无关，不随版本失效）
+query_embed_cache = TTLCache(
+    maxsize=int(os.environ.get("QUERY_EMBED_CACHE_SIZE", 2048)),
+    ttl=float(os.environ.get("QUERY_EMBED_CACHE_TTL", 3600)),
+)
+# (查询, top_k, 搜索参数, 过滤条件, 模式, 索引版本) → 排序后的 [(comment_id, 分数字段)]
+search_result_cache = TTLCache(
+    maxsize=int(os.environ.get("SEARCH_RESULT_CACHE_SIZE", 1024)),
+    ttl=float(os.environ.get("SEARCH_RESULT_CACHE_TTL", 300)),
+)
+# 笔记搜索结果，key 同时带索引版本和笔记索引版本
+note_result_cache = TTLCache(
+    maxsize=int(os.environ.get("NOTE_RESULT_CACHE_SIZE", 256)),
+    ttl=float(os.environ.get("SEARCH_RESULT_CACHE_TTL", 300)),
+)
+
+
+def bump_index_version():
+    """索引内容变化后调用：版本号 +1，并清掉旧版本的搜索结果缓存"""
+    global index_version
+    with index_lock:
+        index_version += 1
+    search_result_cache.clear()
+    note_result_cache.clear()
+
+
+def bump_note_version():
+    """笔记向量刷新后调用：只让笔记搜索缓存失效"""
+    global note_version
+    with index_lock:
+        note_version += 1
+    note_result_cache.clear()
+
+
+def load_side_indexes(target_store, target_side):
+    """
+    从 MySQL 流式读取全部评论，按 target_store 当前的 vid 建立旁路索引。
+    MySQL 暂时不可用时每 30 秒重试；期间 store 被替换则放弃（新 store 自带旁路索引）。
+    """
+    while target_side is side:
+        started = time.time()
+        try:
+            with db_pool.connection() as conn:
+                cursor = conn.cursor(pymysql.cursors.SSCursor)
+                try:
+                    cursor.execute(COMMENT_SQL + " WHERE xc.content IS NOT NULL AND xc.content != ''")
+                    while True:
+                        rows = cursor.fetchmany(INIT_CHUNK_SIZE)
+                        if not rows:
+                            break
+                        pairs = [(target_store.cid_to_vid.get(r[0]), r[1:]) for r in rows]
+                        pairs = [(vid, row) for vid, row in pairs if vid is not None]
+                        target_side.index_rows([vid for vid, _ in pairs], [row for _, row in pairs])
+                finally:
+                    cursor.close()
+        except Exception as e:
+            print("❌ 加载过滤属性 / 倒排索引失败，30 秒后重试:", e)
+            time.sleep(30)
+            continue
+        target_side.mark_ready()
+        print(f"🏷️ 已加载 {len(target_side.attrs)} 条向量的过滤属性、倒排索引与近重复聚类，耗时 {time.time() - started:.2f}s")
+        return
+
+
+def start_side_index_load(target_store, target_side):
+    threading.Thread(target=load_side_indexes, args=(target_store, target_side),
+                     name="side-index-load", daemon=True).start()
+
+
+start_side_index_load(store, side)
+
+
+init_progress = {
+    "running": False,
+    "processed": 0,
+    "total": 0,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+
+
 # ===============================
-# 📥 初始化向量
+# 📥 初始化向量（流式重建）
 # ===============================
+def rebuild_index_streaming(chunk_size=INIT_CHUNK_SIZE):
+    """
+    通过服务端游标（SSCursor）分批读取评论，逐批编码并写入新索引，
+    全部完成后再原子替换当前的 store（vid 从 0 重新分配，相当于一次压缩）。
+    峰值内存只和 chunk_size 有关，与评论总量无关（id 列表除外）。
+
+    需要训练的索引（IVF 系列）先缓存前 TRAIN_SAMPLE_SIZE 条向量用于训练，
+    训练完成后再写入。评论主键是 uuid4，按主键顺序扫描的前 N 条
+    近似于均匀随机采样，因此不需要额外再编码一遍采样集。
+    """
+    global store, rebuild_backlog
+
+    with write_lock:
+        rebuild_backlog = []
+    try:
+        return _rebuild(chunk_size)
+    finally:
+        with write_lock:
+            rebuild_backlog = None
+
+
+def _rebuild(chunk_size):
+    global store, side
+
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT COUNT(*) FROM xhs_comments WHERE content IS NOT NULL AND content != ''")
+            init_progress["total"] = cursor.fetchone()[0]
+
+        new_store = VectorStore.create(VECTOR_DIM, expected_size=init_progress["total"])
+        new_side = SideIndexes()
+        train_size = min(index_factory.TRAIN_SAMPLE_SIZE, init_progress["total"])
+        pending = []  # 训练完成前暂存的 (ids, 向量, rows)
+        processed = 0
+        # 流式读取期间客户端在编码，两次 fetch 间隔可能超过默认的 60 秒写超时；
+        # 连接来自共享连接池，读完后恢复原值，避免之后借到这个连接的请求继承一小时超时
+        with conn.cursor() as cursor:
+            cursor.execute("SELECT @@SESSION.net_write_timeout")
+            net_write_timeout = int(cursor.fetchone()[0])
+            cursor.execute("SET SESSION net_write_timeout = 3600")
+        cursor = conn.cursor(pymysql.cursors.SSCursor)
+        try:
+            cursor.execute(COMMENT_SQL + " WHERE xc.content IS NOT NULL AND xc.content != ''")
+            while True:
+                with stage("fetch"):
+                    rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                with stage("encode"):
+                    vectors = encode_documents([r[1] for r in rows])
+                ids = [r[0] for r in rows]
+                rows = [r[1:] for r in rows]
+                processed += len(rows)
+
+                if new_store.is_trained:
+                    with stage("index_add"):
+                        vids = new_store.add(ids, vectors, [shard_for(r) for r in rows])
+                    with stage("side_index"):
+                        new_side.index_rows(vids, rows)
+                else:
+                    pending.append((ids, vectors, rows))
+                    if processed >= train_size:
+                        train_and_flush(new_store, new_side, pending)
+
+                init_progress["processed"] = processed
+                print(f"⏳ 初始化进度 {processed}/{init_progress['total']}")
+        finally:
+            # 连接已断开时这里也会失败：不能盖掉原来的异常，关闭连接让连接池丢弃它即可
+            try:
+                cursor.close()
+                with conn.cursor() as reset_cursor:
+                    reset_cursor.execute("SET SESSION net_write_timeout = %s", (net_write_timeout,))
+            except Exception as e:
+                print("⚠️ 恢复 net_write_timeout 失败，丢弃该连接:", e)
+                try:
+                    conn.close()
+                except Exception:
+                    pass
+
+    if processed == 0:
+        return 0
+    if pending:
+        train_and_flush(new_store, new_side, pending)
+    new_side.mark_ready()
+    # 替换前先聚合一遍笔记向量，切换后按笔记检索立即可用；期间的写入由后台刷新补上
+    with stage("notes"):
+        refresh_notes(new_store, new_side)
+
+    # 新的一代：先在锁外写好快照文件，再在写入锁内补写期间的写入、提交 manifest、替换
+    new_store.attach(DATA_DIR, store.generation + 1, WAL_FSYNC)
+    with stage("snapshot"):
+        snapshot = new_store.prepare_snapshot()
+    with write_lock, stage("swap"):
+        for comment_id, vector, row in rebuild_backlog:
+            old_vid = new_store.cid_to_vid.get(comment_id)
+            if vector is None:
+                new_store.remove([comment_id])
+                new_side.unindex([old_vid])
+            else:
+                vids = new_store.add([comment_id], vector[None, :], [shard_for(row)])
+                if old_vid != vids[0]:
+                    new_side.unindex([old_vid])
+                new_side.index_rows(vids, [row])
+        new_store.commit_snapshot(snapshot)
+        with index_lock:
+            old_store, store, side = store, new_store, new_side
+        old_store.close()
+    bump_index_version()
+    return processed
+
+
+def train_and_flush(target, target_side, pending):
+    """用暂存的向量训练索引，然后把它们写入索引并清空暂存区"""
+    if not target.is_trained:
+        sample = np.concatenate([vectors for _, vectors, _ in pending])
+        print(f"🧠 使用 {len(sample)} 条向量训练索引...")
+        with stage("train"):
+            target.train(sample)
+        del sample
+    for ids, vectors, rows in pending:
+        with stage("index_add"):
+            vids = target.add(ids, vectors, [shard_for(r) for r in rows])
+        with stage("side_index"):
+            target_side.index_rows(vids, rows)
+    pending.clear()
+
+
 @app.route("/api/init", methods=["POST"])
 def init_embeddings():
-    global index, id_map
+    if not init_lock.acquire(blocking=False):
+        return jsonify({"error": "正在初始化中，请稍后", "progress": init_progress}), 409
 
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor()
-    cursor.execute("SELECT id, content FROM xhs_comments WHERE content IS NOT NULL AND content != ''")
-    rows = cursor.fetchall()
-    conn.close()
+    init_progress.update(running=True, processed=0, total=0,
+                         started_at=time.time(), finished_at=None, error=None)
+    try:
+        count = rebuild_index_streaming()
+    except Exception as e:
+        init_progress["error"] = str(e)
+        raise
+    finally:
+        init_progress.update(running=False, finished_at=time.time())
+        init_lock.release()
 
-    if not rows:
+    if count == 0:
         return jsonify({"msg": "数据库中没有可用评论"}), 400
 
-    texts = [r[1] for r in rows]
-    ids = [r[0] for r in rows]
+    return jsonify({"msg": f"已初始化 {count} 条评论向量"})
 
-    vectors = model.encode(texts, normalize_embeddings=True)  # ✅ 自动归一化
-    vectors = np.array(vectors).astype("float32")
 
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    index.add(vectors)
-    faiss.write_index(index, INDEX_PATH)
+@app.route("/api/init/status", methods=["GET"])
+def init_status():
+    return jsonify({**init_progress, "index": store.describe()})
 
-    id_map = ids
-    np.save(ID_MAP_PATH, np.array(id_map, dtype=object))
 
-    return jsonify({"msg": f"已初始化 {len(rows)} 条评论向量"})
+# ===============================
+# 📥 写入评论向量（单条 / 批量共用）
+# ===============================
+def fetch_comments(comment_ids):
+    """一次 IN 查询取回评论内容和过滤属性，返回 {comment_id: (content, 属性...)}"""
+    if not comment_ids:
+        return {}
+    with db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(
+                COMMENT_SQL + f" WHERE xc.id IN ({','.join(['%s'] * len(comment_ids))})",
+                comment_ids,
+            )
+            return {row[0]: row[1:] for row in cursor.fetchall()}
+
+
+def ingest_comments(comment_ids):
+    """
+    查库 → 一次批量编码 → 写入索引（已存在的按最新内容替换）。
+    索引落盘交给后台检查点，这里只标记脏数据。
+    返回 (已写入的 {comment_id: vid}, 不存在的 id, 内容为空的 id)。
+    """
+    comment_ids = list(dict.fromkeys(comment_ids))
+    with stage("fetch"):
+        rows = fetch_comments(comment_ids)
+    missing = [cid for cid in comment_ids if cid not in rows]
+    empty = [cid for cid in comment_ids if cid in rows and not (rows[cid][0] or "").strip()]
+    valid = [cid for cid in comment_ids if cid in rows and cid not in empty]
+    if not valid:
+        return {}, missing, empty
+
+    with stage("encode"):
+        vectors = encode_documents([rows[cid][0] for cid in valid])
+    valid_rows = [rows[cid] for cid in valid]
+    with stage("lock_wait"):
+        write_lock.acquire()
+    try:
+        old_vids = [store.cid_to_vid.get(cid) for cid in valid]
+        with stage("index_add"):
+            vids = store.add(valid, vectors, [shard_for(row) for row in valid_rows])
+        with stage("side_index"):
+            side.unindex([old for old, vid in zip(old_vids, vids) if old != vid])
+            side.index_rows(vids, valid_rows)
+        if rebuild_backlog is not None:
+            rebuild_backlog.extend(zip(valid, vectors, valid_rows))
+    finally:
+        write_lock.release()
+    for cid in valid:
+        hydrate_cache.invalidate(cid)
+    bump_index_version()
+    mark_dirty(len(valid))
+    return dict(zip(valid, vids)), missing, empty
 
 
 # ===============================
-# 📥 保存单条评论向量
+# 📥 保存 / 更新单条评论向量
 # ===============================
 @app.route("/api/embeddings", methods=["POST"])
 def save_embedding():
-    global id_map
-
+    """写入评论向量；评论已存在时按最新内容重新编码并原地替换"""
     data = request.get_json()
     comment_id = data.get("comment_id")
     if not comment_id:
         return jsonify({"error": "缺少 comment_id"}), 400
 
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor()
-    cursor.execute("SELECT content FROM xhs_comments WHERE id = %s", (comment_id,))
-    row = cursor.fetchone()
-    conn.close()
+    if not store.is_trained:
+        return jsonify({"error": "索引尚未训练，请先调用 /api/init"}), 409
 
-    if not row:
+    saved, missing, empty = ingest_comments([comment_id])
+    if missing:
         return jsonify({"error": f"未找到ID为 {comment_id} 的评论"}), 404
-
-    content = row[0]
-    if not content.strip():
+    if empty:
         return jsonify({"error": "评论内容为空"}), 400
 
-    vector = model.encode([content], normalize_embeddings=True)
-    vector_np = np.array(vector).astype("float32")
-    index.add(vector_np)
-    faiss.write_index(index, INDEX_PATH)
+    return jsonify({"msg": "评论向量已保存", "comment_id": comment_id, "vid": saved[comment_id]})
+
+
+# ===============================
+# 📥 批量保存评论向量（一次查库 + 一次编码）
+# ===============================
+@app.route("/api/embeddings/batch", methods=["POST"])
+def save_embeddings_batch():
+    data = request.get_json() or {}
+    comment_ids = data.get("comment_ids")
+    if not comment_ids or not isinstance(comment_ids, list):
+        return jsonify({"error": "缺少 comment_ids"}), 400
+    if len(comment_ids) > EMBED_BATCH_MAX_IDS:
+        return jsonify({"error": f"单次最多 {EMBED_BATCH_MAX_IDS} 条"}), 400
+
+    if not store.is_trained:
+        return jsonify({"error": "索引尚未训练，请先调用 /api/init"}), 409
+
+    saved, missing, empty = ingest_comments([str(cid) for cid in comment_ids])
+    return jsonify({
+        "msg": f"已保存 {len(saved)} 条评论向量",
+        "saved": len(saved),
+        "missing": missing,
+        "empty": empty,
+    })
+
+
+# ===============================
+# 🗑️ 删除单条评论向量（评论被删除时调用）
+# ===============================
+@app.route("/api/embeddings/<comment_id>", methods=["DELETE"])
+def delete_embedding(comment_id):
+    with write_lock:
+        vid = store.cid_to_vid.get(comment_id)
+        removed = store.remove([comment_id])
+        side.unindex([vid])
+        if rebuild_backlog is not None:
+            rebuild_backlog.append((comment_id, None, None))
+    if removed == 0:
+        return jsonify({"error": f"索引中没有ID为 {comment_id} 的评论"}), 404
+    hydrate_cache.invalidate(comment_id)
+    bump_index_version()
+    mark_dirty(1)
+    return jsonify({"msg": "评论向量已删除", "comment_id": comment_id})
+
+
+# ===============================
+# 💾 检查点：写入后延迟落盘，按时间或脏数据量触发
+# ===============================
+dirty_count = 0
+dirty_lock = threading.Lock()
+checkpoint_event = threading.Event()
+
+
+def mark_dirty(n):
+    global dirty_count
+    with dirty_lock:
+        dirty_count += n
+        full = dirty_count >= CHECKPOINT_MAX_DIRTY
+    if full:
+        checkpoint_event.set()
+
+
+def checkpoint():
+    """
+    把当前 store 写一次压缩快照并截掉已覆盖的日志；没有新变更时返回 False。
+    写入的持久性由追加日志保证，检查点只决定重启时需要回放多少日志。
+    """
+    global dirty_count
+    with dirty_lock:
+        pending, dirty_count = dirty_count, 0
+    if not pending:
+        return False
+    with index_lock:
+        cur_store = store
+    try:
+        started = time.time()
+        cur_store.checkpoint()
+        print(f"💾 检查点完成：{pending} 条变更，耗时 {time.time() - started:.2f}s")
+    except Exception:
+        with dirty_lock:
+            dirty_count += pending
+        raise
+    return True
+
+
+def checkpoint_loop():
+    while True:
+        checkpoint_event.wait(CHECKPOINT_INTERVAL_SEC)
+        checkpoint_event.clear()
+        try:
+            checkpoint()
+        except Exception as e:
+            print("❌ 检查点失败:", e)
+
+
+threading.Thread(target=checkpoint_loop, name="checkpoint", daemon=True).start()
+atexit.register(checkpoint)
+
+
+@app.route("/api/checkpoint", methods=["POST"])
+def checkpoint_now():
+    saved = checkpoint()
+    return jsonify({"msg": "已写入检查点" if saved else "没有需要落盘的变更"})
+
+
+# ===============================
+# 📝 笔记向量：后台按批重新聚合待刷新的笔记
+# ===============================
+NOTE_REFRESH_SEC = float(os.environ.get("NOTE_REFRESH_SEC", 2))
+NOTE_REFRESH_BATCH = 1000
+NOTE_TEXT_SQL = "SELECT note_id, title, node_text FROM xhs_notes WHERE note_id IN ({placeholders})"
+_TAG_RE = re.compile(r"<[^>]+>")
+
+
+def note_text(title, node_text):
+    """笔记标题 + 正文（node_text 是抓取的 HTML 片段，去掉标签）"""
+    body = _TAG_RE.sub(" ", html.unescape(node_text or ""))
+    return " ".join(" ".join(part for part in (title, body) if part).split())
+
+
+def load_note_texts(target_side, note_codes):
+    """编码这些笔记的标题 + 正文；没有正文的记为 None，之后不再查询"""
+    note_ids = {target_side.attrs.note_ids[code]: code for code in note_codes}
+    note_ids.pop(None, None)
+    keys = list(note_ids)
+    texts = {}
+    for start in range(0, len(keys), NOTE_REFRESH_BATCH):
+        chunk = keys[start:start + NOTE_REFRESH_BATCH]
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute(NOTE_TEXT_SQL.format(placeholders=",".join(["%s"] * len(chunk))), chunk)
+                for note_id, title, node_text in cursor.fetchall():
+                    text = note_text(title, node_text)
+                    if text:
+                        texts[note_ids[note_id]] = text
+    codes = list(texts)
+    vectors = encode_documents([texts[code] for code in codes]) if codes else []
+    target_side.notes.set_text_vectors(codes, vectors)
+    target_side.notes.set_text_vectors([code for code in note_codes if code not in texts],
+                                       [None] * (len(note_codes) - len(codes)))
+
+
+def refresh_notes(target_store, target_side):
+    """
+    重新聚合待刷新笔记的向量（成员向量从 target_store 取回），返回刷新的笔记数。
+    旁路索引就绪前标记的笔记全部处理完后，笔记索引才算就绪。
+    """
+    was_ready = target_side.attrs.ready
+    dirty = sorted(target_side.notes.take_dirty())
+    try:
+        load_note_texts(target_side, target_side.notes.missing_text(dirty))
+        for start in range(0, len(dirty), NOTE_REFRESH_BATCH):
+            members = target_side.attrs.note_members(dirty[start:start + NOTE_REFRESH_BATCH])
+            cids = {code: [target_store.vid_to_cid[vid] for vid in vids.tolist() if vid in target_store.vid_to_cid]
+                    for code, vids in members.items()}
+            vectors = target_store.reconstruct([cid for group in cids.values() for cid in group])
+            target_side.notes.update({
+                code: np.asarray([vectors[cid] for cid in group if cid in vectors], dtype="float32").reshape(-1, VECTOR_DIM)
+                for code, group in cids.items()
+            })
+    except Exception:
+        target_side.notes.mark_dirty(dirty)
+        raise
+    if was_ready:
+        target_side.notes.ready = True
+    return len(dirty)
+
+
+def note_refresh_loop():
+    while True:
+        time.sleep(NOTE_REFRESH_SEC)
+        with index_lock:
+            cur_store, cur_side = store, side
+        try:
+            if refresh_notes(cur_store, cur_side):
+                bump_note_version()
+        except Exception as e:
+            print("❌ 笔记向量刷新失败:", e)
+
+
+threading.Thread(target=note_refresh_loop, name="note-refresh", daemon=True).start()
+
+
+# ===============================
+# 🔍 搜索结果回表：一次 IN 查询 + 热点行缓存
+# ===============================
+HYDRATE_SQL = """
+    SELECT
+        xn.note_id AS note_id,
+        xn.title AS note_title,
+        xn.node_text AS note_content,
+        xn.publish_time AS note_publish_time,
+        xcu.user_name   AS commenter_name,
+        xcu.user_red_id AS commenter_red_id,
+        xcu.location    AS commenter_location,
+        xnu.user_name   AS author_name,
+        xnu.user_red_id AS author_red_id,
+        xnu.location    AS author_location,
+        xc.content      AS comment_content,
+        xc.comment_time AS comment_time,
+        xc.id           AS comment_id
+    FROM xhs_comments xc
+    LEFT JOIN xhs_notes xn ON xc.note_id = xn.note_id
+    LEFT JOIN xhs_users xcu ON xc.user_id = xcu.user_id
+    LEFT JOIN xhs_users xnu ON xn.user_id = xnu.user_id
+    WHERE xc.id IN ({placeholders})
+"""
+
+# 评论 / 笔记 / 用户元数据缓存（按 comment_id），HYDRATE_CACHE_SIZE=0 关闭
+hydrate_cache = TTLCache(
+    maxsize=int(os.environ.get("HYDRATE_CACHE_SIZE", 10000)),
+    ttl=float(os.environ.get("HYDRATE_CACHE_TTL", 300)),
+)
+
+
+def hydrate_comments(comment_ids):
+    """
+    批量回表，返回 {comment_id: 结果字典}（不含 similarity）。
+    缓存命中的不再查库，其余用一次 IN 查询取回；排序由调用方按 FAISS 结果决定。
+    """
+    rows = hydrate_cache.get_many(comment_ids)
+    missing = list(dict.fromkeys(cid for cid in comment_ids if cid not in rows))
+    if not missing:
+        return rows
+
+    with stage("hydrate"), db_pool.connection() as conn:
+        with conn.cursor() as cursor:
+            cursor.execute(HYDRATE_SQL.format(placeholders=",".join(["%s"] * len(missing))), missing)
+            fetched = cursor.fetchall()
+
+    for row in fetched:
+        item = {
+            "note_id": row[0],
+            "note_title": row[1],
+            "note_content": row[2],
+            "publish_time": row[3],
+            "commenter_name": row[4],
+            "commenter_red_id": row[5],
+            "commenter_location": row[6],
+            "author_name": row[7],
+            "author_red_id": row[8],
+            "author_location": row[9],
+            "comment_content": row[10],
+            "comment_time": row[11],
+            "comment_id": row[12],
+        }
+        rows[item["comment_id"]] = item
+        hydrate_cache.put(item["comment_id"], item)
+    return rows
+
+
+# ===============================
+# 🔍 检索（带查询向量缓存与结果缓存）
+# ===============================
+# vector：纯向量；lexical：BM25 倒排；hybrid：两路各取候选后按 RRF 融合
+SEARCH_MODES = ("vector", "lexical", "hybrid")
+HYBRID_CANDIDATE_FACTOR = int(os.environ.get("HYBRID_CANDIDATE_FACTOR", 4))
+RRF_K = int(os.environ.get("RRF_K", 60))
+# 近重复折叠：默认关闭，请求参数 collapse=1 开启（NEAR_DUP_COLLAPSE=1 改为默认开启）；候选多取的倍数
+NEAR_DUP_COLLAPSE = os.environ.get("NEAR_DUP_COLLAPSE", "0") == "1"
+NEAR_DUP_CANDIDATE_FACTOR = int(os.environ.get("NEAR_DUP_CANDIDATE_FACTOR", 3))
+
 
-    id_map.append(comment_id)
-    np.save(ID_MAP_PATH, np.array(id_map, dtype=object))
+def embed_query(query):
+    return embed_queries([query])[0:1]
 
-    return jsonify({"msg": "评论向量已保存", "comment_id": comment_id})
+
+def embed_queries(queries):
+    """批量取查询向量 (n, dim)：缓存未命中的查询合并成一次编码"""
+    cached = {q: query_embed_cache.get(q) for q in dict.fromkeys(queries)}
+    missing = [q for q, vec in cached.items() if vec is None]
+    if missing:
+        with stage("encode"):
+            vectors = encode_texts(missing)
+        for q, vec in zip(missing, vectors):
+            cached[q] = vec[None, :]
+            query_embed_cache.put(q, cached[q])
+    return np.concatenate([cached[q] for q in queries])
+
+
+def vector_search(cur_store, q_vecs, k, nprobe=None, ef_search=None, mask=None, shards=None):
+    """
+    FAISS 检索（多个查询一次完成），mask 通过 IDSelector 在索引内部过滤，shards 限定查询的分片；
+    返回每个查询的 [(comment_id, 相似度)]
+    """
+    sel = bitmap_selector(mask) if mask is not None else None
+    with stage("index_search"):
+        D, I = cur_store.search(q_vecs, k, nprobe=nprobe, ef_search=ef_search, sel=sel, mask=mask, shards=shards)
+    return [list(zip(ids, dists)) for ids, dists in zip(I, D)]
+
+
+def combine_masks(a, b):
+    """两个按 vid 的布尔数组取“与”，长度不同时超出部分视为 False"""
+    if a is None or b is None:
+        return b if a is None else a
+    n = min(len(a), len(b))
+    return a[:n] & b[:n]
+
+
+def rrf_fuse(rankings, k=RRF_K):
+    """倒数排名融合：score = Σ 1 / (k + rank)，返回按分数降序的 [(comment_id, score)]"""
+    scores = {}
+    for ranking in rankings:
+        for rank, cid in enumerate(ranking, start=1):
+            scores[cid] = scores.get(cid, 0.0) + 1.0 / (k + rank)
+    return sorted(scores.items(), key=lambda item: item[1], reverse=True)
+
+
+def filters_key(filters):
+    return tuple(sorted((k, tuple(v) if isinstance(v, list) else v) for k, v in (filters or {}).items()))
+
+
+def search_ids(query, top_k, nprobe=None, ef_search=None, filters=None, mode="vector", collapse=False,
+               shards=None):
+    """
+    返回 [(comment_id, 分数字段)]，按最终排序。分数字段：
+        similarity  与查询的余弦相似度（所有模式都有）
+        bm25        词法得分（lexical / hybrid；未被词法召回时为 None）
+        score       RRF 融合分（hybrid）
+        duplicates  同簇被折叠掉的近重复评论数（collapse）
+    filters 为 AttributeIndex.mask 的参数，向量和词法两路都在检索内部过滤。
+    collapse 时先多取 NEAR_DUP_CANDIDATE_FACTOR 倍候选，同一近重复簇只保留排名最高的一条。
+    shards 限定向量检索只查询这些分片，词法检索同样只返回其中的评论。
+    """
+    # 先取一份引用，避免搜索过程中 /api/init 替换 store
+    with index_lock:
+        cur_store, cur_side, version = store, side, index_version
+    cache_key = search_cache_key(query, top_k, nprobe, ef_search, filters, mode, collapse, shards, version)
+    cached = search_result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with stage("filter"):
+        mask = cur_side.attrs.mask(**filters) if filters else None
+    if mask is not None and not mask.any():
+        search_result_cache.put(cache_key, [])
+        return []
+
+    q_vec = embed_query(query)
+    want = top_k * NEAR_DUP_CANDIDATE_FACTOR if collapse else top_k
+    bm25, similarity = {}, {}
+    if mode == "vector":
+        vector_hits = vector_search(cur_store, q_vec, want, nprobe, ef_search, mask, shards)[0]
+        similarity = dict(vector_hits)
+        ranked = [(cid, None) for cid, _ in vector_hits]
+    else:
+        n = want if mode == "lexical" else max(want * HYBRID_CANDIDATE_FACTOR, 50)
+        lexical_mask = combine_masks(mask, cur_store.shard_mask(shards)) if shards else mask
+        with stage("lexical_search"):
+            lexical_hits = [(cur_store.vid_to_cid[vid], score)
+                            for vid, score in cur_side.lexical.search(query, n, lexical_mask)
+                            if vid in cur_store.vid_to_cid]
+        bm25 = dict(lexical_hits)
+        if mode == "lexical":
+            ranked = [(cid, None) for cid, _ in lexical_hits]
+        else:
+            vector_hits = vector_search(cur_store, q_vec, n, nprobe, ef_search, mask, shards)[0]
+            similarity = dict(vector_hits)
+            ranked = rrf_fuse([[cid for cid, _ in vector_hits], [cid for cid, _ in lexical_hits]])
+
+    with stage("rank"):
+        result = finish_ranking(cur_store, cur_side, q_vec, ranked, similarity, bm25, mode, top_k, collapse)
+    search_result_cache.put(cache_key, result)
+    return result
+
+
+def search_cache_key(query, top_k, nprobe, ef_search, filters, mode, collapse, shards, version):
+    return (query, top_k, nprobe, ef_search, filters_key(filters), mode, collapse,
+            tuple(shards) if shards else None, version)
+
+
+def finish_ranking(cur_store, cur_side, q_vec, ranked, similarity, bm25, mode, top_k, collapse):
+    """近重复折叠、截断到 top_k、补算相似度，生成 search_ids 的返回格式"""
+    duplicates = None
+    if collapse:
+        fused = dict(ranked)
+        duplicates = dict(cur_side.dups.collapse([(cid, cur_store.cid_to_vid.get(cid)) for cid, _ in ranked]))
+        ranked = [(cid, fused[cid]) for cid in duplicates]
+    ranked = ranked[:top_k]
+
+    # 只被词法召回的评论没有向量分数，取回向量补算余弦相似度
+    need = [cid for cid, _ in ranked if cid not in similarity]
+    for cid, vector in cur_store.reconstruct(need).items():
+        similarity[cid] = float(np.dot(q_vec[0], vector))
+
+    result = []
+    for cid, fused in ranked:
+        fields = {"similarity": similarity.get(cid, 0.0)}
+        if mode != "vector":
+            fields["bm25"] = bm25.get(cid)
+        if fused is not None:
+            fields["score"] = fused
+        if duplicates is not None:
+            fields["duplicates"] = duplicates[cid]
+        result.append((cid, fields))
+    return result
+
+
+def search_ids_batch(requests):
+    """
+    多个查询一起检索，requests 为 search_ids 的关键字参数列表，返回值与之一一对应。
+    查询向量一次编码；向量模式下过滤条件 / 分片 / 搜索参数相同的查询合并成一次多行 FAISS 检索，
+    其余模式逐个走 search_ids（查询向量已在缓存里）。
+    """
+    with index_lock:
+        cur_store, cur_side, version = store, side, index_version
+    results = [None] * len(requests)
+    keys = [search_cache_key(r["query"], r["top_k"], r.get("nprobe"), r.get("ef_search"), r.get("filters"),
+                             r.get("mode", "vector"), r.get("collapse", False), r.get("shards"), version)
+            for r in requests]
+    todo = []
+    for i, key in enumerate(keys):
+        results[i] = search_result_cache.get(key)
+        if results[i] is None:
+            todo.append(i)
+    if not todo:
+        return results
+
+    q_vecs = embed_queries([requests[i]["query"] for i in todo])
+    q_vec_of = dict(zip(todo, q_vecs))
+    groups = {}
+    for i in todo:
+        r = requests[i]
+        if r.get("mode", "vector") != "vector":
+            results[i] = search_ids(**r)
+            continue
+        group_key = (filters_key(r.get("filters")), tuple(r.get("shards") or ()), r.get("nprobe"), r.get("ef_search"))
+        groups.setdefault(group_key, []).append(i)
+
+    for members in groups.values():
+        first = requests[members[0]]
+        filters = first.get("filters")
+        with stage("filter"):
+            mask = cur_side.attrs.mask(**filters) if filters else None
+        wants = {i: requests[i]["top_k"] * (NEAR_DUP_CANDIDATE_FACTOR if requests[i].get("collapse") else 1)
+                 for i in members}
+        if mask is not None and not mask.any():
+            hits = [[] for _ in members]
+        else:
+            hits = vector_search(cur_store, np.stack([q_vec_of[i] for i in members]), max(wants.values()),
+                                 first.get("nprobe"), first.get("ef_search"), mask, first.get("shards"))
+        for i, vector_hits in zip(members, hits):
+            vector_hits = vector_hits[:wants[i]]
+            with stage("rank"):
+                results[i] = finish_ranking(cur_store, cur_side, q_vec_of[i][None, :],
+                                            [(cid, None) for cid, _ in vector_hits], dict(vector_hits), {},
+                                            "vector", requests[i]["top_k"], requests[i].get("collapse", False))
+            search_result_cache.put(keys[i], results[i])
+    return results
+
+
+def parse_filters(args):
+    """
+    解析过滤参数，返回 (filters, 错误信息)：
+        date_from / date_to  评论日期 YYYY-MM-DD（含边界）
+        location             评论 IP 属地，逗号分隔多个
+        keyword              笔记关键词，逗号分隔多个
+        note_id              笔记 ID，逗号分隔多个
+    """
+    def split(name):
+        return [v.strip() for v in args.get(name, "").split(",") if v.strip()]
+
+    filters = {}
+    for name in ("date_from", "date_to"):
+        value = args.get(name, "").strip()
+        if value:
+            if parse_day(value) < 0:
+                return None, f"{name} 格式应为 YYYY-MM-DD"
+            filters[name] = value
+    for name, key in (("location", "locations"), ("keyword", "keywords"), ("note_id", "note_ids")):
+        values = split(name)
+        if values:
+            filters[key] = values
+    return filters, None
 
 
 # ===============================
-# 🔍 搜索接口（余弦相似度）
+# 🔍 搜索接口（向量 / 词法 / 混合，可按元数据过滤）
 # ===============================
+def parse_search_args(args):
+    """
+    解析一次搜索的参数（/api/search 的查询串，或 /api/search/batch 里的一项），
+    返回 (search_ids 的关键字参数, (错误信息, 状态码))，两者之一为 None
+    """
+    query = str(args.get("q", "")).strip()
+    mode = args.get("mode", "vector")
+    if not query:
+        return None, ("缺少参数 q", 400)
+    if mode not in SEARCH_MODES:
+        return None, (f"mode 可选 {', '.join(SEARCH_MODES)}", 400)
+    try:
+        top_k = int(args.get("top_k", 10))
+        nprobe = int(args["nprobe"]) if args.get("nprobe") else None
+        ef_search = int(args["ef_search"]) if args.get("ef_search") else None
+    except ValueError:
+        return None, ("top_k / nprobe / ef_search 应为整数", 400)
+    filters, error = parse_filters(args)
+    if error:
+        return None, (error, 400)
+    shards = sorted({v.strip() for v in args.get("shard", "").split(",") if v.strip()}) or None
+    if shards and not set(shards) <= set(store.shards):
+        return None, (f"未知的分片，可选 {', '.join(sorted(store.shards))}", 400)
+    if filters and not side.attrs.ready:
+        return None, ("过滤属性加载中，请稍后再试", 503)
+    if mode != "vector" and not side.lexical.ready:
+        return None, ("倒排索引加载中，请稍后再试", 503)
+    # 聚类还在加载时不折叠，而不是让整个搜索等待
+    collapse = str(args.get("collapse", "1" if NEAR_DUP_COLLAPSE else "0")) == "1" and side.dups.ready
+    return {"query": query, "top_k": top_k, "nprobe": nprobe, "ef_search": ef_search, "filters": filters,
+            "mode": mode, "collapse": collapse, "shards": shards}, None
+
+
+def hydrated_results(hits, rows):
+    results = []
+    for comment_id, fields in hits:
+        row = rows.get(comment_id)
+        if row:
+            results.append({**row, **fields})
+    return results
+
+
 @app.route("/api/search", methods=["GET"])
 def search():
+    params, error = parse_search_args(request.args)
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+    if store.ntotal == 0:
+        return jsonify({"error": "没有向量索引，请先初始化或添加"}), 400
+
+    hits = search_ids(**params)
+    rows = hydrate_comments([cid for cid, _ in hits])
+    with stage("serialize"):
+        return jsonify({"query": request.args.get("q", ""), "mode": params["mode"], "filters": params["filters"],
+                        "shards": params["shards"], "collapsed": params["collapse"],
+                        "results": hydrated_results(hits, rows)})
+
+
+SEARCH_BATCH_MAX_QUERIES = int(os.environ.get("SEARCH_BATCH_MAX_QUERIES", 256))
+
+
+@app.route("/api/search/batch", methods=["POST"])
+def search_batch():
+    """
+    多个查询一次请求：{"queries": [{"id": 可选, "q": ..., 其余参数同 /api/search}, ...]}，
+    返回 {"results": {id 或 q: 与 /api/search 相同的结果}}。
+    查询向量一次编码、同条件的向量检索合并成一次多行 FAISS 检索、全部命中一次回表。
+    """
+    items = (request.get_json(silent=True) or {}).get("queries")
+    if not isinstance(items, list) or not items:
+        return jsonify({"error": "queries 必须是非空列表"}), 400
+    if len(items) > SEARCH_BATCH_MAX_QUERIES:
+        return jsonify({"error": f"单次最多 {SEARCH_BATCH_MAX_QUERIES} 个查询"}), 400
+    if store.ntotal == 0:
+        return jsonify({"error": "没有向量索引，请先初始化或添加"}), 400
+
+    keys, requests = [], []
+    for n, item in enumerate(items):
+        if not isinstance(item, dict):
+            return jsonify({"error": f"第 {n + 1} 个查询应为对象"}), 400
+        # 与查询串同样的格式：列表按逗号拼接
+        args = {k: ",".join(map(str, v)) if isinstance(v, list) else str(v) for k, v in item.items() if v is not None}
+        params, error = parse_search_args(args)
+        if error:
+            return jsonify({"error": f"第 {n + 1} 个查询：{error[0]}"}), error[1]
+        keys.append(args.get("id", params["query"]))
+        requests.append(params)
+    if len(set(keys)) != len(keys):
+        return jsonify({"error": "查询重复，请用 id 区分"}), 400
+
+    all_hits = search_ids_batch(requests)
+    rows = hydrate_comments(list(dict.fromkeys(cid for hits in all_hits for cid, _ in hits)))
+    results = {}
+    for key, params, hits in zip(keys, requests, all_hits):
+        results[key] = {"query": params["query"], "mode": params["mode"], "filters": params["filters"],
+                        "shards": params["shards"], "collapsed": params["collapse"],
+                        "results": hydrated_results(hits, rows)}
+    with stage("serialize"):
+        return jsonify({"results": results})
+
+
+# ===============================
+# 📝 按笔记检索：笔记向量排序 + 每篇笔记内最相关的评论
+# ===============================
+NOTE_FIELDS = ("note_id", "note_title", "note_content", "publish_time",
+               "author_name", "author_red_id", "author_location")
+
+
+def search_note_ids(query, top_k, comments_per_note, filters=None):
+    """
+    返回 [(note_id, 笔记相似度, 参与聚合的评论数, [(comment_id, 相似度)])]。
+    先在笔记索引里取 top_k 篇，再只在这些笔记的评论里按查询相似度挑出前 comments_per_note 条；
+    filters 同时限定候选笔记（至少有一条评论满足条件）和挑出的评论。
+    """
+    with index_lock:
+        cur_store, cur_side, version = store, side, (index_version, note_version)
+    cache_key = (query, top_k, comments_per_note, filters_key(filters), version)
+    cached = note_result_cache.get(cache_key)
+    if cached is not None:
+        return cached
+
+    with stage("filter"):
+        mask = cur_side.attrs.mask(**filters) if filters else None
+    allowed = None
+    if mask is not None:
+        allowed = np.unique(cur_side.attrs.notes_of(np.flatnonzero(mask)))
+        allowed = allowed[allowed >= 0]
+
+    q_vec = embed_query(query)
+    with stage("note_search"):
+        notes = cur_side.notes.search(q_vec[0], top_k, allowed)
+    members = cur_side.attrs.note_members([code for code, _ in notes])
+    if mask is not None:
+        for code, vids in members.items():
+            vids = vids[vids < len(mask)]
+            members[code] = vids[mask[vids]]
+    cids = {code: [cur_store.vid_to_cid[vid] for vid in vids.tolist() if vid in cur_store.vid_to_cid]
+            for code, vids in members.items()}
+    with stage("rank"):
+        vectors = cur_store.reconstruct([cid for group in cids.values() for cid in group])
+
+    result = []
+    for code, score in notes:
+        scored = sorted(((cid, float(np.dot(q_vec[0], vectors[cid]))) for cid in cids[code] if cid in vectors),
+                        key=lambda item: item[1], reverse=True)
+        result.append((cur_side.attrs.note_ids[code], score, cur_side.notes.comment_counts.get(code, 0),
+                       scored[:comments_per_note]))
+    note_result_cache.put(cache_key, result)
+    return result
+
+
+@app.route("/api/search/notes", methods=["GET"])
+def search_notes():
     query = request.args.get("q", "")
     top_k = int(request.args.get("top_k", 10))
+    comments_per_note = int(request.args.get("comments", 3))
     if not query.strip():
         return jsonify({"error": "缺少参数 q"}), 400
+    filters, error = parse_filters(request.args)
+    if error:
+        return jsonify({"error": error}), 400
+    if not side.notes.ready:
+        return jsonify({"error": "笔记向量加载中，请稍后再试"}), 503
 
-    if index.ntotal == 0:
-        return jsonify({"error": "没有向量索引，请先初始化或添加"}), 400
+    hits = search_note_ids(query.strip(), top_k, comments_per_note, filters)
+    rows = hydrate_comments([cid for *_, comments in hits for cid, _ in comments])
+    results = []
+    for note_id, score, comment_count, comments in hits:
+        note = {"note_id": note_id}
+        items = []
+        for comment_id, similarity in comments:
+            row = rows.get(comment_id)
+            if row:
+                note.update({k: row[k] for k in NOTE_FIELDS})
+                items.append({**{k: v for k, v in row.items() if k not in NOTE_FIELDS}, "similarity": similarity})
+        results.append({**note, "score": score, "comment_count": comment_count, "comments": items})
 
-    q_vec = model.encode([query], normalize_embeddings=True)
-    q_vec = np.array(q_vec).astype("float32")
+    with stage("serialize"):
+        return jsonify({"query": query, "filters": filters, "results": results})
 
-    D, I = index.search(q_vec, top_k)
 
-    results = []
-    conn = pymysql.connect(**MYSQL_CONFIG)
-    cursor = conn.cursor()
+# ===============================
+# 🗂️ 主题聚类与关键词：后台批处理，接口只读取落盘的结果
+# ===============================
+# 写入节点定期重跑（距上次运行索引有变化时），0 关闭；只读副本直接读取写入节点生成的文件
+TOPIC_INTERVAL_SEC = float(os.environ.get("TOPIC_INTERVAL_SEC", 6 * 3600))
+topic_lock = threading.Lock()
+topic_progress = {
+    "running": False,
+    "phase": None,
+    "processed": 0,
+    "total": 0,
+    "started_at": None,
+    "finished_at": None,
+    "error": None,
+}
+# 已加载的结果，按文件修改时间判断是否需要重新加载
+_topic_result = {"mtime": None, "result": None}
 
-    for score, idx in zip(D[0], I[0]):
-        if idx >= len(id_map):
-            continue
-        comment_id = id_map[idx]
-        cursor.execute(
-            """
-            SELECT
-                xn.note_id AS note_id,
-                xn.title AS note_title,
-                xn.node_text AS note_content,
-                xn.publish_time AS note_publish_time,
-                xcu.user_name   AS commenter_name,
-                xcu.user_red_id AS commenter_red_id,
-                xcu.location    AS commenter_location,
-                xnu.user_name   AS author_name,
-                xnu.user_red_id AS author_red_id,
-                xnu.location    AS author_location,
-                xc.content      AS comment_content,
-                xc.comment_time AS comment_time,
-                xc.id           AS comment_id
-            FROM xhs_comments xc
-            LEFT JOIN xhs_notes xn ON xc.note_id = xn.note_id 
-            LEFT JOIN xhs_users xcu ON xc.user_id = xcu.user_id 
-            LEFT JOIN xhs_users xnu ON xn.user_id = xnu.user_id 
-            WHERE xc.id = %s
-            """,
-            (comment_id,)
-        )
-        row = cursor.fetchone()
-        if row:
-            results.append({
-                "note_id": row[0],
-                "note_title": row[1],
-                "note_content": row[2],
-                "publish_time": row[3],
-                "commenter_name": row[4],
-                "commenter_red_id": row[5],
-                "commenter_location": row[6],
-                "author_name": row[7],
-                "author_red_id": row[8],
-                "author_location": row[9],
-                "comment_content": row[10],
-                "comment_time": row[11],
-                "comment_id": row[12],
-                "similarity": float(score)
-            })
-    conn.close()
 
-    results = sorted(results, key=lambda x: x["similarity"], reverse=True)
-    return jsonify({"query": query, "results": results})
+def run_topic_job():
+    """聚类 + 关键词 + 落盘；已有任务在跑时返回 False"""
+    if not topic_lock.acquire(blocking=False):
+        return False
+    topic_progress.update(running=True, phase=None, processed=0, total=0,
+                          started_at=time.time(), finished_at=None, error=None)
+    try:
+        with index_lock:
+            cur_store, cur_side = store, side
+        if not cur_side.lexical.ready:
+            raise RuntimeError("倒排索引加载中，稍后再试")
+
+        def progress(phase, done, total):
+            topic_progress.update(phase=phase, processed=done, total=total)
+
+        result = run_topics(cur_store, cur_side.lexical, VECTOR_DIM, progress=progress)
+        if result is None:
+            raise RuntimeError("向量数少于主题数，无法聚类")
+        result.save(DATA_DIR)
+        print(f"🗂️ 主题聚类完成：{result.summary['vectors']} 条评论，{len(result)} 个主题，"
+              f"耗时 {result.summary['duration_sec']}s")
+    except Exception as e:
+        topic_progress["error"] = str(e)
+        print("❌ 主题聚类失败:", e)
+    finally:
+        topic_progress.update(running=False, finished_at=time.time())
+        topic_lock.release()
+    return True
+
+
+def topic_loop():
+    last_version = None
+    while True:
+        time.sleep(TOPIC_INTERVAL_SEC)
+        if index_version != last_version:
+            last_version = index_version
+            run_topic_job()
+
+
+if not INDEX_MMAP and TOPIC_INTERVAL_SEC > 0:
+    threading.Thread(target=topic_loop, name="topic-job", daemon=True).start()
+
+
+def current_topics():
+    """最近一次落盘的聚类结果（没有时为 None）"""
+    path = os.path.join(DATA_DIR, TOPICS_FILE)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+    if _topic_result["mtime"] != mtime:
+        _topic_result.update(result=TopicResult.load(path), mtime=mtime)
+    return _topic_result["result"]
+
+
+@app.route("/api/topics/run", methods=["POST"])
+def run_topics_now():
+    if topic_lock.locked():
+        return jsonify({"error": "主题聚类正在运行", "progress": topic_progress}), 409
+    threading.Thread(target=run_topic_job, name="topic-job-manual", daemon=True).start()
+    return jsonify({"msg": "已开始主题聚类", "progress": topic_progress}), 202
+
+
+@app.route("/api/topics", methods=["GET"])
+def list_topics():
+    result = current_topics()
+    if result is None:
+        return jsonify({"error": "还没有主题聚类结果", "progress": topic_progress}), 404
+    return jsonify({**result.summary, "progress": topic_progress})
+
+
+@app.route("/api/topics/<int:topic_id>", methods=["GET"])
+def topic_detail(topic_id):
+    """主题摘要 + 按与质心相似度排序的评论（offset / limit 分页）"""
+    result = current_topics()
+    if result is None:
+        return jsonify({"error": "还没有主题聚类结果", "progress": topic_progress}), 404
+    if not 0 <= topic_id < len(result):
+        return jsonify({"error": f"主题编号应在 0 ~ {len(result) - 1}"}), 404
+    offset = max(int(request.args.get("offset", 0)), 0)
+    limit = min(max(int(request.args.get("limit", 20)), 1), 100)
+    members = result.members(topic_id, offset, limit)
+    rows = hydrate_comments([cid for cid, _ in members])
+    comments = [{**rows[cid], "similarity": score} for cid, score in members if cid in rows]
+    return jsonify({**result.summary["topics"][topic_id], "offset": offset, "comments": comments})
+
+
+# ===============================
+# 🧩 分片：查看各分片状态 / 压缩分片
+# ===============================
+@app.route("/api/shards", methods=["GET"])
+def list_shards():
+    return jsonify({"shard_by": SHARD_BY, "shards": store.shard_stats()})
+
+
+@app.route("/api/shards/<name>/compact", methods=["POST"])
+def compact_shard(name):
+    """重建分片清理墓碑（IVF / HNSW 删除或替换时旧向量仍留在索引里），完成后由检查点落盘"""
+    if name not in store.shards:
+        return jsonify({"error": f"没有名为 {name} 的分片"}), 404
+    result = store.compact_shard(name)
+    if result is None:
+        return jsonify({"error": "压缩期间分片有写入，请稍后重试"}), 409
+    mark_dirty(1)
+    return jsonify({"msg": f"分片 {name} 已压缩", **result})
 
 
 # ===============================
@@ -201,15 +1327,220 @@ def search():
 # ===============================
 @app.route("/api/reset", methods=["POST"])
 def reset():
-    global index, id_map
-    index = faiss.IndexFlatIP(VECTOR_DIM)
-    id_map = []
-    if os.path.exists(INDEX_PATH):
-        os.remove(INDEX_PATH)
-    if os.path.exists(ID_MAP_PATH):
-        os.remove(ID_MAP_PATH)
+    global store, side
+    if init_lock.locked():
+        return jsonify({"error": "正在初始化中，请稍后再重置"}), 409
+    new_store = VectorStore.create(VECTOR_DIM)
+    new_side = SideIndexes()
+    new_side.mark_ready()
+    new_side.notes.ready = True
+    with write_lock:
+        new_store.attach(DATA_DIR, store.generation + 1, WAL_FSYNC)
+        new_store.checkpoint()
+        with index_lock:
+            old_store, store, side = store, new_store, new_side
+        old_store.close()
+    hydrate_cache.clear()
+    bump_index_version()
     return jsonify({"msg": "已清空向量索引"})
 
 
+# ===============================
+# 🔄 只读副本：重新加载最新快照 + 日志
+# ===============================
+WRITE_ENDPOINTS = {"init_embeddings", "save_embedding", "save_embeddings_batch",
+                   "delete_embedding", "checkpoint_now", "reset", "compact_shard", "run_topics_now"}
+
+
+@app.before_request
+def reject_writes_on_replica():
+    if INDEX_MMAP and request.endpoint in WRITE_ENDPOINTS:
+        return jsonify({"error": "只读副本（INDEX_MMAP=1）不接受写入", "writer": WRITER_URL or None}), 409
+
+
+def reload_store():
+    """
+    只读副本重新打开快照并回放日志，原子替换当前 store。
+    同一代内 vid 不变，属性列继续沿用，只补齐新出现的 vid；换代（重建 / 重置）则重新加载属性。
+    """
+    global store, side
+    new_store = ReadOnlyVectorStore.open(DATA_DIR)
+    same_generation = new_store.generation == store.generation
+    new_side = side if same_generation else SideIndexes()
+    with index_lock:
+        store, side = new_store, new_side
+    if same_generation:
+        fill_side_indexes(new_store, new_side, new_side.attrs.missing(list(new_store.vid_to_cid)))
+    else:
+        start_side_index_load(new_store, new_side)
+    bump_index_version()
+    return new_store
+
+
+def fill_side_indexes(target_store, target_side, vids):
+    """按 vid 补齐旁路索引（副本回放日志后调用，写入节点在写入时直接更新）"""
+    cids = [target_store.vid_to_cid[vid] for vid in vids if vid in target_store.vid_to_cid]
+    for start in range(0, len(cids), EMBED_BATCH_MAX_IDS):
+        rows = fetch_comments(cids[start:start + EMBED_BATCH_MAX_IDS])
+        pairs = [(target_store.cid_to_vid.get(cid), row) for cid, row in rows.items()]
+        pairs = [(vid, row) for vid, row in pairs if vid is not None]
+        target_side.index_rows([vid for vid, _ in pairs], [row for _, row in pairs])
+
+
+def sync_replica():
+    """回放写入节点新追加的日志；写入节点提交了新快照时整体重新加载"""
+    with index_lock:
+        cur_store = store
+    touched = cur_store.catch_up()
+    if touched is None:
+        reload_store()
+        return
+    if touched:
+        with index_lock:
+            cur_side = side
+        fill_side_indexes(cur_store, cur_side,
+                          [cur_store.cid_to_vid[cid] for cid in set(touched) if cid in cur_store.cid_to_vid])
+        for cid in touched:
+            hydrate_cache.invalidate(cid)
+        bump_index_version()
+
+
+def replica_sync_loop():
+    while True:
+        time.sleep(REPLICA_SYNC_SEC)
+        try:
+            sync_replica()
+        except Exception as e:
+            print("❌ 副本同步失败:", e)
+
+
+if INDEX_MMAP and REPLICA_SYNC_SEC > 0:
+    threading.Thread(target=replica_sync_loop, name="replica-sync", daemon=True).start()
+
+
+@app.route("/api/reload", methods=["POST"])
+def reload():
+    """立即重新加载（只作用于处理该请求的 worker；全部 worker 用 kill -HUP gunicorn 主进程）"""
+    if not INDEX_MMAP:
+        return jsonify({"error": "只有只读副本需要重新加载"}), 400
+    new_store = reload_store()
+    return jsonify({"msg": f"已重新加载 {len(new_store)} 条向量"})
+
+
+def rss_mb():
+    """当前进程常驻内存（Linux），mmap 的快照页只有被访问到才会计入"""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 1024 / 1024
+    except (OSError, ValueError):
+        return None
+
+
+# ===============================
+# ❤️ 存活 / 就绪探针
+# ===============================
+@app.route("/api/health", methods=["GET"])
+def health():
+    """存活探针：进程能响应即可，不检查依赖；只读副本附带快照是否退化为整体读入内存"""
+    body = {"status": "ok"}
+    if INDEX_MMAP:
+        body.update(mmap="full_load" if store.mmap_fallbacks else "mapped", mmap_fallbacks=store.mmap_fallbacks)
+    return jsonify(body)
+
+
+@app.route("/api/ready", methods=["GET"])
+def ready():
+    """就绪探针：推理进程和 MySQL 都可用时才接收流量"""
+    checks = {}
+    try:
+        encoder.ping()
+        checks["encoder"] = "ok"
+    except Exception as e:
+        checks["encoder"] = str(e)
+    try:
+        with db_pool.connection() as conn:
+            with conn.cursor() as cursor:
+                cursor.execute("SELECT 1")
+        checks["mysql"] = "ok"
+    except Exception as e:
+        checks["mysql"] = str(e)
+    ok = all(v == "ok" for v in checks.values())
+    body = {"status": "ready" if ok else "not_ready", "checks": checks,
+            "vectors": len(store), "read_only": store.read_only}
+    return jsonify(body), 200 if ok else 503
+
+
+# ===============================
+# 📊 运行状态统计
+# ===============================
+@app.route("/api/stats", methods=["GET"])
+def stats():
+    return jsonify({
+        "mysql_pool": db_pool.stats(),
+        "hydrate_cache": hydrate_cache.stats(),
+        "encoder": encoder.stats(),
+        "embed_cache": embed_cache.stats() if embed_cache else None,
+        "query_embed_cache": query_embed_cache.stats(),
+        "search_result_cache": search_result_cache.stats(),
+        "note_result_cache": note_result_cache.stats(),
+        "index_version": index_version,
+        "note_version": note_version,
+        "attributes": side.attrs.stats(),
+        "lexical": side.lexical.stats(),
+        "near_dup": side.dups.stats(),
+        "notes": side.notes.stats(),
+        "topics": topic_progress,
+        "dirty": dirty_count,
+        "wal_bytes": store.wal.size() if store.wal else 0,
+        "vectors": len(store),
+        "index": store.describe(),
+        "read_only": store.read_only,
+        "rss_mb": rss_mb(),
+    })
+
+
+# ===============================
+# 📈 Prometheus 抓取接口
+# ===============================
+def cache_stats():
+    caches = {
+        "hydrate": hydrate_cache.stats(),
+        "query_embed": query_embed_cache.stats(),
+        "search_result": search_result_cache.stats(),
+        "note_result": note_result_cache.stats(),
+    }
+    if embed_cache:
+        caches["embed"] = embed_cache.stats()
+    return caches
+
+
+metrics.gauge("xhs_vectors", "有效向量数", lambda: len(store))
+metrics.gauge("xhs_index_ntotal", "FAISS 索引中的向量数（含未压缩的墓碑）", lambda: store.ntotal)
+metrics.gauge("xhs_id_map_entries", "vid → comment_id 映射条数", lambda: len(store.vid_to_cid))
+metrics.gauge("xhs_shard_vectors", "各分片有效向量数",
+              lambda: {(s["name"],): s["alive"] for s in store.shard_stats()}, ("shard",))
+metrics.gauge("xhs_index_version", "索引版本号", lambda: index_version)
+metrics.gauge("xhs_dirty_changes", "上次检查点之后的变更数", lambda: dirty_count)
+metrics.gauge("xhs_wal_bytes", "当前日志段大小", lambda: store.wal.size() if store.wal else 0)
+metrics.gauge("xhs_rss_bytes", "进程常驻内存", lambda: rss_mb() * 1024 * 1024 if rss_mb() is not None else None)
+metrics.gauge("xhs_cache_entries", "缓存条目数", lambda: {(name,): st.get("size", st.get("entries"))
+                                                      for name, st in cache_stats().items()}, ("cache",))
+metrics.gauge("xhs_cache_hit_ratio", "缓存命中率（进程启动以来）",
+              lambda: {(name,): st["hit_rate"] for name, st in cache_stats().items()}, ("cache",))
+metrics.gauge("xhs_side_index_ready", "旁路索引是否加载完成",
+              lambda: {(name,): int(idx.ready) for name, idx in (("attributes", side.attrs), ("lexical", side.lexical),
+                                                                 ("near_dup", side.dups), ("notes", side.notes))},
+              ("index",))
+metrics.gauge("xhs_notes_pending", "待刷新的笔记向量数", lambda: side.notes.pending())
+metrics.gauge("xhs_mysql_pool_in_use", "正在使用的 MySQL 连接数", lambda: db_pool.stats()["in_use"])
+metrics.gauge("xhs_init_running", "是否正在 /api/init 重建", lambda: int(init_progress["running"]))
+
+
+@app.route("/metrics", methods=["GET"])
+def prometheus_metrics():
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+# 单进程开发模式；生产环境用 gunicorn -c gunicorn.conf.py app:app
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000, debug=True)
+    app.run(host="0.0.0.0", port=5000, debug=os.environ.get("FLASK_DEBUG", "1") == "1")
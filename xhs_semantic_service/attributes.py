@@ -0,0 +1,180 @@
+# -*- coding: utf-8 -*-
+"""
+向量属性列：按 vid 下标存放每条评论的可过滤属性，用于在 FAISS 搜索内部过滤。
+
+    day       评论日期（距 1970-01-01 的天数，-1 表示未知）
+    location  评论 IP 属地编码（-1 表示未知）
+    note      所属笔记编码（-1 表示未知）
+
+笔记关键词是笔记级属性，保存为 关键词 → {笔记编码}。
+过滤条件先在 numpy 上算出命中的 vid 位图，再包装成 faiss.IDSelectorBitmap
+交给索引，FAISS 只对命中的向量计算距离，不需要先取大量结果再在外面过滤。
+
+属性来自 MySQL，不随快照持久化：启动时全量加载一次，之后随写入增量更新。
+"""
+import threading
+
+import faiss
+import numpy as np
+
+UNKNOWN = -1
+_INITIAL_CAPACITY = 1024
+
+
+def parse_day(text):
+    """'YYYY-MM-DD'（或更长的时间字符串）→ 距 epoch 的天数；无法解析返回 -1"""
+    if not text:
+        return UNKNOWN
+    try:
+        return int(np.datetime64(str(text)[:10], "D").astype("int64"))
+    except ValueError:
+        return UNKNOWN
+
+
+def split_keywords(text):
+    """笔记的 keywords 字段可能是逗号分隔的多个关键词"""
+    if not text:
+        return []
+    return [kw.strip() for kw in str(text).replace("，", ",").split(",") if kw.strip()]
+
+
+class AttributeIndex:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.ready = False               # 全量加载完成前，过滤查询的结果不完整
+        self.day = np.full(_INITIAL_CAPACITY, UNKNOWN, dtype="int32")
+        self.location = np.full(_INITIAL_CAPACITY, UNKNOWN, dtype="int32")
+        self.note = np.full(_INITIAL_CAPACITY, UNKNOWN, dtype="int32")
+        self.location_codes = {}
+        self.note_codes = {}
+        self.note_ids = []               # 笔记编码 → note_id
+        self.keyword_notes = {}          # 关键词 → {笔记编码}
+
+    def __len__(self):
+        return int(np.count_nonzero(self.note != UNKNOWN))
+
+    # ---------- 写入 ----------
+    def _ensure_capacity(self, max_vid):
+        size = len(self.day)
+        if max_vid < size:
+            return
+        while size <= max_vid:
+            size *= 2
+        for name in ("day", "location", "note"):
+            old = getattr(self, name)
+            grown = np.full(size, UNKNOWN, dtype="int32")
+            grown[:len(old)] = old
+            setattr(self, name, grown)
+
+    @staticmethod
+    def _code(codes, value):
+        if not value:
+            return UNKNOWN
+        code = codes.get(value)
+        if code is None:
+            code = codes[value] = len(codes)
+        return code
+
+    def set(self, vids, rows):
+        """
+        rows: [(note_id, comment_time, location, note_keywords)]，与 vids 一一对应
+        """
+        if not vids:
+            return
+        with self.lock:
+            self._ensure_capacity(max(vids))
+            for vid, (note_id, comment_time, location, keywords) in zip(vids, rows):
+                note_code = self._code(self.note_codes, note_id)
+                if note_code == len(self.note_ids):
+                    self.note_ids.append(note_id)
+                self.day[vid] = parse_day(comment_time)
+                self.location[vid] = self._code(self.location_codes, (location or "").strip())
+                self.note[vid] = note_code
+                if note_code != UNKNOWN:
+                    for kw in split_keywords(keywords):
+                        self.keyword_notes.setdefault(kw, set()).add(note_code)
+
+    def clear(self, vids):
+        """作废的 vid（被替换 / 删除）不再命中任何过滤条件"""
+        with self.lock:
+            for vid in vids:
+                if vid is not None and vid < len(self.note):
+                    self.day[vid] = self.location[vid] = self.note[vid] = UNKNOWN
+
+    def missing(self, vids):
+        """返回 vids 中还没有属性的那些"""
+        vids = np.asarray(vids, dtype="int64")
+        with self.lock:
+            known = np.zeros(len(vids), dtype=bool)
+            inside = vids < len(self.note)
+            known[inside] = self.note[vids[inside]] != UNKNOWN
+        return vids[~known].tolist()
+
+    def notes_of(self, vids):
+        """vids 各自所属的笔记编码（未知为 -1）"""
+        vids = np.asarray([vid for vid in vids if vid is not None], dtype="int64")
+        with self.lock:
+            codes = np.full(len(vids), UNKNOWN, dtype="int32")
+            inside = vids < len(self.note)
+            codes[inside] = self.note[vids[inside]]
+        return codes
+
+    def note_members(self, note_codes):
+        """{笔记编码: 该笔记当前全部评论的 vid 数组}"""
+        note_codes = np.asarray(list(note_codes), dtype="int32")
+        with self.lock:
+            vids = np.flatnonzero(np.isin(self.note, note_codes))
+            codes = self.note[vids]
+        order = np.argsort(codes, kind="stable")
+        vids, codes = vids[order], codes[order]
+        bounds = np.searchsorted(codes, note_codes)
+        ends = np.searchsorted(codes, note_codes, side="right")
+        return {int(code): vids[start:end] for code, start, end in zip(note_codes, bounds, ends)}
+
+    # ---------- 过滤 ----------
+    def mask(self, date_from=None, date_to=None, locations=None, keywords=None, note_ids=None):
+        """
+        返回命中的 vid 布尔数组；没有任何过滤条件时返回 None。
+        同一字段内多个取值为“或”，不同字段之间为“与”。
+        """
+        if date_from is None and date_to is None and not locations and not keywords and not note_ids:
+            return None
+        with self.lock:
+            mask = self.note != UNKNOWN
+            if date_from is not None:
+                mask &= self.day >= parse_day(date_from)
+            if date_to is not None:
+                mask &= (self.day <= parse_day(date_to)) & (self.day != UNKNOWN)
+            if locations:
+                codes = [self.location_codes[loc] for loc in locations if loc in self.location_codes]
+                mask &= np.isin(self.location, codes)
+            notes = None
+            if keywords:
+                notes = set()
+                for kw in keywords:
+                    notes |= self.keyword_notes.get(kw, set())
+            if note_ids:
+                codes = {self.note_codes[nid] for nid in note_ids if nid in self.note_codes}
+                notes = codes if notes is None else notes & codes
+            if notes is not None:
+                mask &= np.isin(self.note, np.fromiter(notes, dtype="int32", count=len(notes)))
+        return mask
+
+    def stats(self):
+        with self.lock:
+            return {
+                "ready": self.ready,
+                "vectors": len(self),
+                "capacity": len(self.day),
+                "locations": len(self.location_codes),
+                "notes": len(self.note_codes),
+                "keywords": len(self.keyword_notes),
+            }
+
+
+def bitmap_selector(mask):
+    """布尔数组 → faiss.IDSelectorBitmap（第 i 位对应 vid i）"""
+    bitmap = np.packbits(mask, bitorder="little")
+    sel = faiss.IDSelectorBitmap(len(bitmap), faiss.swig_ptr(bitmap))
+    sel.referenced_bitmap = bitmap  # selector 只保存指针，搜索结束前必须保持数组存活
+    return sel
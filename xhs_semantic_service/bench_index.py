@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+"""
+近似索引基准测试：对比 flat / ivf_flat / ivf_pq / hnsw 以及不同向量编码
+（fp32 / fp16 / sq8，可选原始向量精排）的 recall@k、QPS 与每条向量的内存占用。
+
+用法：
+    # 使用现有数据目录（manifest.json + 各分片快照 + 日志）中的向量，只读，不改动数据目录
+    python bench_index.py --data-dir ./data --k 10 --max-vectors 500000
+
+    # 没有真实数据时用随机向量
+    python bench_index.py --synthetic 200000 --k 10 --nprobe 8,16,64 --ef-search 32,64,128
+
+    # 对比压缩编码的内存 / 召回，并测试保留原始向量精排
+    python bench_index.py --synthetic 200000 --types flat,ivf_flat,hnsw --codecs fp16,sq8 --rerank
+
+查询向量从数据集中抽样并加少量噪声，真值由 IndexFlatIP 精确搜索得到。
+真实数据从各分片取回向量，分片用了压缩编码（sq8 / pq 等）时取回的是量化后的近似值。
+"""
+import argparse
+import os
+import time
+
+import faiss
+import numpy as np
+
+import index_factory
+from vector_store import ReadOnlyVectorStore
+
+
+def load_vectors(args):
+    if args.synthetic:
+        rng = np.random.default_rng(args.seed)
+        xb = rng.standard_normal((args.synthetic, args.dim), dtype="float32")
+    else:
+        store = ReadOnlyVectorStore.open(args.data_dir)
+        comment_ids = list(store.cid_to_vid)
+        if not comment_ids:
+            raise SystemExit("❌ 索引为空")
+        if args.max_vectors and len(comment_ids) > args.max_vectors:
+            rng = np.random.default_rng(args.seed)
+            comment_ids = [comment_ids[i] for i in rng.choice(len(comment_ids), size=args.max_vectors, replace=False)]
+        xb = np.stack(list(store.reconstruct(comment_ids).values())).astype("float32")
+    faiss.normalize_L2(xb)
+    return xb
+
+
+def make_queries(xb, nq, seed):
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(xb), size=min(nq, len(xb)), replace=False)
+    xq = xb[picks] + rng.standard_normal((len(picks), xb.shape[1]), dtype="float32") * 0.05
+    faiss.normalize_L2(xq)
+    return xq
+
+
+def recall_at_k(I, gt):
+    hits = sum(len(set(row) & set(truth)) for row, truth in zip(I, gt))
+    return hits / gt.size
+
+
+def timed_search(idx, xq, k, params=None):
+    start = time.perf_counter()
+    _, I = idx.search(xq, k, params=params)
+    elapsed = time.perf_counter() - start
+    return I, len(xq) / elapsed
+
+
+def build(index_type, xb, train_size, seed, codec="fp32", rerank=False):
+    idx = index_factory.create_index(xb.shape[1], index_type, expected_size=len(xb), codec=codec, rerank=rerank)
+    start = time.perf_counter()
+    if not idx.is_trained:
+        rng = np.random.default_rng(seed)
+        sample = xb[rng.choice(len(xb), size=min(train_size, len(xb)), replace=False)]
+        idx.train(sample)
+    idx.add(xb)
+    return idx, time.perf_counter() - start
+
+
+def parse_int_list(text):
+    return [int(v) for v in text.split(",") if v.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="FAISS 索引 recall@k / QPS 基准")
+    parser.add_argument("--data-dir", default=os.environ.get("DATA_DIR", "."), help="语义服务的数据目录")
+    parser.add_argument("--max-vectors", type=int, default=0, help="真实数据最多随机取多少条（0 表示全部）")
+    parser.add_argument("--synthetic", type=int, default=0, help="生成 N 条随机向量代替真实数据")
+    parser.add_argument("--dim", type=int, default=1024)
+    parser.add_argument("--nq", type=int, default=1000)
+    parser.add_argument("--k", type=int, default=10)
+    parser.add_argument("--types", default="ivf_flat,ivf_pq,hnsw")
+    parser.add_argument("--codecs", default="fp32", help="逗号分隔：fp32,fp16,sq8")
+    parser.add_argument("--rerank", action="store_true", help="压缩编码额外测试保留原始向量精排")
+    parser.add_argument("--nprobe", default="1,4,16,64")
+    parser.add_argument("--ef-search", default="16,32,64,128,256")
+    parser.add_argument("--train-size", type=int, default=index_factory.TRAIN_SAMPLE_SIZE)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    xb = load_vectors(args)
+    xq = make_queries(xb, args.nq, args.seed)
+    print(f"📦 数据集 {xb.shape[0]} x {xb.shape[1]}，查询 {len(xq)} 条，k={args.k}")
+
+    flat, build_s = build("flat", xb, args.train_size, args.seed)
+    gt, flat_qps = timed_search(flat, xq, args.k)
+    flat_bpv = index_factory.bytes_per_vector(flat)
+    rows = [("flat", "fp32", "-", build_s, 1.0, flat_qps, flat_bpv)]
+
+    codecs = [c.strip() for c in args.codecs.split(",") if c.strip()]
+    variants = []
+    for index_type in [t.strip() for t in args.types.split(",") if t.strip()]:
+        # ivf_pq 自带压缩编码，flat + fp32 就是基准本身
+        type_codecs = ["pq"] if index_type == "ivf_pq" else [c for c in codecs if not (index_type == "flat" and c == "fp32")]
+        for codec in type_codecs:
+            variants.append((index_type, codec, False))
+            if args.rerank and codec != "fp32":
+                variants.append((index_type, codec, True))
+
+    for index_type, codec, rerank in variants:
+        idx, build_s = build(index_type, xb, args.train_size, args.seed,
+                             codec="fp32" if codec == "pq" else codec, rerank=rerank)
+        bpv = index_factory.bytes_per_vector(idx)
+        label = codec + ("+rerank" if rerank else "")
+        if index_type == "hnsw":
+            sweep = [("efSearch", v, index_factory.search_params(idx, ef_search=v))
+                     for v in parse_int_list(args.ef_search)]
+        elif index_type == "flat":
+            sweep = [("-", "", None)]
+        else:
+            sweep = [("nprobe", v, index_factory.search_params(idx, nprobe=v))
+                     for v in parse_int_list(args.nprobe)]
+        for name, value, params in sweep:
+            I, qps = timed_search(idx, xq, args.k, params)
+            param = f"{name}={value}" if value != "" else name
+            rows.append((index_type, label, param, build_s, recall_at_k(I, gt), qps, bpv))
+
+    print(f"\n{'type':<10}{'codec':<14}{'param':<16}{'build(s)':>10}{'recall@' + str(args.k):>12}"
+          f"{'QPS':>12}{'speedup':>10}{'bytes/vec':>12}{'mem':>8}")
+    for index_type, codec, param, build_s, recall, qps, bpv in rows:
+        print(f"{index_type:<10}{codec:<14}{param:<16}{build_s:>10.1f}{recall:>12.4f}"
+              f"{qps:>12.1f}{qps / flat_qps:>9.1f}x{bpv:>12.0f}{bpv / flat_bpv:>7.0%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""
+动态微批：把并发请求线程提交的编码请求合并成一个 batch 调用模型。
+
+后台线程取到第一个请求后，继续收集后续请求，直到累计文本数达到
+max_batch_size，或距第一个请求入队超过 max_wait_ms，然后一次性编码，
+再把结果按请求拆分回各自的 Future。
+"""
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import numpy as np
+
+# batch 大小分布的桶上界
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+
+class _Job:
+    __slots__ = ("texts", "future", "enqueued_at")
+
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.enqueued_at = time.monotonic()
+
+
+class EmbeddingBatcher:
+    def __init__(self, encode_fn, max_batch_size=32, max_wait_ms=5.0, name="encoder"):
+        """
+        encode_fn: list[str] -> np.ndarray，返回归一化后的向量
+        """
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.name = name
+        self._queue = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "batches": 0,
+            "items": 0,
+            "requests": 0,
+            "errors": 0,
+            "queue_delay_total_ms": 0.0,
+            "queue_delay_max_ms": 0.0,
+            "encode_time_total_ms": 0.0,
+        }
+        self._batch_hist = {str(b): 0 for b in BATCH_SIZE_BUCKETS}
+        self._batch_hist["+Inf"] = 0
+        self._thread = threading.Thread(target=self._run, name=f"{name}-batcher", daemon=True)
+        self._thread.start()
+
+    def encode(self, texts, timeout=None):
+        """提交一组文本并等待结果，返回 float32 矩阵（行顺序与 texts 一致）"""
+        job = _Job(list(texts))
+        self._queue.put(job)
+        return job.future.result(timeout=timeout)
+
+    # ---------- 后台线程 ----------
+    def _collect(self):
+        """阻塞等待第一个请求，然后在截止时间内尽量凑满一个 batch"""
+        jobs = [self._queue.get()]
+        size = len(jobs[0].texts)
+        deadline = jobs[0].enqueued_at + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                job = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            jobs.append(job)
+            size += len(job.texts)
+        return jobs, size
+
+    def _run(self):
+        while True:
+            jobs, size = self._collect()
+            started = time.monotonic()
+            texts = [t for job in jobs for t in job.texts]
+            try:
+                vectors = np.asarray(self.encode_fn(texts), dtype="float32")
+            except Exception as e:
+                with self._stats_lock:
+                    self._stats["errors"] += 1
+                for job in jobs:
+                    job.future.set_exception(e)
+                continue
+            finished = time.monotonic()
+
+            offset = 0
+            for job in jobs:
+                job.future.set_result(vectors[offset:offset + len(job.texts)])
+                offset += len(job.texts)
+            self._record(jobs, size, started, finished)
+
+    def _record(self, jobs, size, started, finished):
+        with self._stats_lock:
+            s = self._stats
+            s["batches"] += 1
+            s["items"] += size
+            s["requests"] += len(jobs)
+            s["encode_time_total_ms"] += (finished - started) * 1000
+            for job in jobs:
+                delay_ms = (started - job.enqueued_at) * 1000
+                s["queue_delay_total_ms"] += delay_ms
+                s["queue_delay_max_ms"] = max(s["queue_delay_max_ms"], delay_ms)
+            bucket = next((str(b) for b in BATCH_SIZE_BUCKETS if size <= b), "+Inf")
+            self._batch_hist[bucket] += 1
+
+    # ---------- 统计 ----------
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+            stats["batch_size_histogram"] = dict(self._batch_hist)
+        batches, requests = stats["batches"], stats["requests"]
+        stats.update(
+            name=self.name,
+            max_batch_size=self.max_batch_size,
+            max_wait_ms=self.max_wait * 1000,
+            queued=self._queue.qsize(),
+            avg_batch_size=round(stats["items"] / batches, 3) if batches else 0.0,
+            queue_delay_avg_ms=round(stats["queue_delay_total_ms"] / requests, 3) if requests else 0.0,
+            encode_time_avg_ms=round(stats["encode_time_total_ms"] / batches, 3) if batches else 0.0,
+        )
+        return stats
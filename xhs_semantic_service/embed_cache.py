@@ -0,0 +1,130 @@
+# -*- coding: utf-8 -*-
+"""
+持久化的评论向量缓存：(模型名, 规范化文本哈希) → 向量，存放在 DATA_DIR 下的 sqlite 文件。
+
+大量评论是完全相同的短文本（“哈哈哈”“求链接”、纯表情），重建和写入时
+先按规范化文本去重并查缓存，只有没见过的文本才送去模型编码；
+模型不变时重新 /api/init 基本只剩读库和建索引的开销。
+
+规范化（首尾去空白、连续空白合并为一个空格）只用于计算缓存键，送去模型的始终是原文：
+每个键的向量是第一次遇到时那条原文的编码，不经缓存的文本得到的向量与以前完全相同；
+只有空白不同的文本共用这一个向量，与各自单独编码可能有细微差别。每条约 4 KB（1024 维 float32）。
+"""
+import hashlib
+import sqlite3
+import threading
+
+import numpy as np
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS embeddings (
+    model TEXT NOT NULL,
+    text_hash BLOB NOT NULL,
+    vector BLOB NOT NULL,
+    PRIMARY KEY (model, text_hash)
+) WITHOUT ROWID
+"""
+# sqlite 单条语句的参数个数上限（旧版本为 999）
+_MAX_PARAMS = 900
+
+
+def normalize_text(text):
+    return " ".join((text or "").split())
+
+
+def text_key(text):
+    return hashlib.blake2b(normalize_text(text).encode("utf-8"), digest_size=16).digest()
+
+
+class EmbeddingCache:
+    def __init__(self, path, model_name, dim):
+        """model_name 可以是字符串，也可以是第一次用到时才调用的函数（远程推理进程可能还没启动）"""
+        self.path = path
+        self._model_name = model_name
+        self.dim = dim
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(_SCHEMA)
+        self._conn.commit()
+        self._stats = {"lookups": 0, "hits": 0, "misses": 0, "batch_duplicates": 0, "encoded": 0}
+        # 条目数只在启动时数一次，之后由 put_many 维护（/metrics 抓取时不扫表）
+        self._entries = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+
+    @property
+    def model_name(self):
+        if callable(self._model_name):
+            self._model_name = self._model_name()
+        return self._model_name
+
+    def get_many(self, keys):
+        """返回 {key: 向量}，只包含命中的"""
+        keys = list(keys)
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), _MAX_PARAMS):
+                chunk = keys[start:start + _MAX_PARAMS]
+                rows = self._conn.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? "
+                    f"AND text_hash IN ({','.join('?' * len(chunk))})",
+                    [self.model_name, *chunk],
+                ).fetchall()
+                for key, blob in rows:
+                    vector = np.frombuffer(blob, dtype="float32")
+                    if len(vector) == self.dim:
+                        found[bytes(key)] = vector
+        return found
+
+    def put_many(self, items):
+        """items: {key: 向量}；已有的键保持不变（同一模型同一文本的向量相同）"""
+        if not items:
+            return
+        with self._lock:
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, text_hash, vector) VALUES (?, ?, ?)",
+                [(self.model_name, key, np.asarray(vec, dtype="float32").tobytes()) for key, vec in items.items()],
+            )
+            self._conn.commit()
+            self._entries += self._conn.total_changes - before
+
+    def encode(self, texts, encode_fn):
+        """
+        编码一批评论：批内相同文本只算一次，缓存命中的直接返回，其余调用 encode_fn 后写回缓存。
+        encode_fn 收到的是原文（同键取批内第一次出现的那条）。
+        返回与 texts 行顺序一致的 float32 矩阵。
+        """
+        keys = [text_key(t) for t in texts]
+        unique = {}
+        for key, text in zip(keys, texts):
+            unique.setdefault(key, text)
+        found = self.get_many(unique)
+        unseen = {key: text for key, text in unique.items() if key not in found}
+        if unseen:
+            vectors = np.asarray(encode_fn(list(unseen.values())), dtype="float32")
+            fresh = dict(zip(unseen, vectors))
+            self.put_many(fresh)
+            found.update(fresh)
+        with self._lock:
+            s = self._stats
+            s["lookups"] += len(keys)
+            s["batch_duplicates"] += len(keys) - len(unique)
+            s["hits"] += len(unique) - len(unseen)
+            s["misses"] += len(unseen)
+            s["encoded"] += len(unseen)
+        return np.stack([found[key] for key in keys]) if keys else np.zeros((0, self.dim), dtype="float32")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["entries"] = self._entries
+        lookups = stats["lookups"]
+        # 命中率按“没有送去模型的文本”计算，批内重复也算省下的编码
+        stats["hit_rate"] = round(1 - stats["encoded"] / lookups, 4) if lookups else 0.0
+        stats.update(model=None if callable(self._model_name) else self._model_name, path=self.path)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
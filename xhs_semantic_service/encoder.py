@@ -0,0 +1,166 @@
+# -*- coding: utf-8 -*-
+"""
+文本编码器：进程内加载模型（LocalEncoder），或者连到独立推理进程（RemoteEncoder）。
+两者接口一致：encode(texts) -> float32 归一化矩阵，model_name，ping()，stats()。
+
+多 worker 部署时每个 HTTP worker 只持有 RemoteEncoder，
+1.3 GB 的模型只在 inference_server.py 里加载一份，
+各 worker 的请求在推理进程里继续合并成微批。
+
+INFERENCE_ADDRESS 格式：
+    unix:/tmp/xhs-embed.sock   Unix 域套接字（同机部署）
+    127.0.0.1:6000             TCP
+"""
+import os
+import threading
+import time
+from multiprocessing.connection import Client
+
+import numpy as np
+
+from embed_batcher import EmbeddingBatcher
+
+MODEL_NAME = os.environ.get("EMBED_MODEL", "BAAI/bge-large-zh-v1.5")
+# 动态微批：并发请求的编码合并成一个 batch，凑满或超时即执行
+EMBED_MAX_BATCH_SIZE = int(os.environ.get("EMBED_MAX_BATCH_SIZE", 32))
+EMBED_MAX_WAIT_MS = float(os.environ.get("EMBED_MAX_WAIT_MS", 5))
+
+INFERENCE_ADDRESS = os.environ.get("INFERENCE_ADDRESS", "")
+INFERENCE_AUTHKEY = os.environ.get("INFERENCE_AUTHKEY", "xhs-semantic").encode("utf-8")
+INFERENCE_TIMEOUT = float(os.environ.get("INFERENCE_TIMEOUT", 60))
+
+# 这些异常说明与推理进程的连接已不可用，需要丢弃重连
+_BROKEN_ERRORS = (EOFError, ConnectionError, OSError)
+
+
+def parse_address(text):
+    """'unix:/path' → ('/path', 'AF_UNIX')；'host:port' → ((host, port), 'AF_INET')"""
+    if text.startswith("unix:"):
+        return text[len("unix:"):], "AF_UNIX"
+    host, _, port = text.rpartition(":")
+    return (host or "127.0.0.1", int(port)), "AF_INET"
+
+
+class InferenceError(Exception):
+    """推理进程返回错误或超时"""
+
+
+class LocalEncoder:
+    def __init__(self, model_name=MODEL_NAME, max_batch_size=EMBED_MAX_BATCH_SIZE,
+                 max_wait_ms=EMBED_MAX_WAIT_MS):
+        from text2vec import SentenceModel
+
+        self.model_name = model_name
+        self.model = SentenceModel(model_name)
+        self.max_batch_size = max_batch_size
+        self.batcher = EmbeddingBatcher(self.encode_batch, max_batch_size=max_batch_size,
+                                        max_wait_ms=max_wait_ms)
+
+    def encode_batch(self, texts):
+        vectors = self.model.encode(texts, normalize_embeddings=True)  # ✅ 自动归一化
+        return np.asarray(vectors, dtype="float32")
+
+    def encode(self, texts):
+        """少量文本走微批队列，本身已经够大的批次（如 /api/init）直接调用模型"""
+        if len(texts) >= self.max_batch_size:
+            return self.encode_batch(texts)
+        return self.batcher.encode(texts)
+
+    def ping(self):
+        return True
+
+    def stats(self):
+        return {"mode": "local", "model": self.model_name, "batcher": self.batcher.stats()}
+
+
+class RemoteEncoder:
+    """
+    推理进程客户端。维护一组空闲连接供请求线程复用（一个连接同一时间只承载一个请求），
+    连接断开时丢弃并重连一次，推理进程重启对调用方透明。
+    大批量文本（如 /api/init 的一整块）按 max_batch_size 拆成多次请求，timeout 针对每一次请求。
+    """
+
+    def __init__(self, address=INFERENCE_ADDRESS, authkey=INFERENCE_AUTHKEY, timeout=INFERENCE_TIMEOUT,
+                 max_batch_size=EMBED_MAX_BATCH_SIZE):
+        self.address, self.family = parse_address(address)
+        self.authkey = authkey
+        self.timeout = timeout
+        self.max_batch_size = max_batch_size
+        self._lock = threading.Lock()
+        self._idle = []
+        self._model_name = None
+        self._stats = {"requests": 0, "calls": 0, "errors": 0, "connects": 0, "reconnects": 0,
+                       "time_total_ms": 0.0}
+
+    def _connect(self):
+        conn = Client(self.address, family=self.family, authkey=self.authkey)
+        with self._lock:
+            self._stats["connects"] += 1
+        return conn
+
+    def _call(self, op, payload=None, timeout=None):
+        timeout = self.timeout if timeout is None else timeout
+        for attempt in range(2):
+            with self._lock:
+                conn = self._idle.pop() if self._idle else None
+            try:
+                if conn is None:
+                    conn = self._connect()
+                conn.send((op, payload))
+                if not conn.poll(timeout):
+                    conn.close()
+                    raise InferenceError(f"推理进程 {timeout}s 内未响应")
+                status, result = conn.recv()
+            except _BROKEN_ERRORS:
+                if conn is not None:
+                    conn.close()
+                if attempt:
+                    raise
+                with self._lock:
+                    self._stats["reconnects"] += 1
+                continue
+            with self._lock:
+                self._idle.append(conn)
+            if status != "ok":
+                raise InferenceError(result)
+            return result
+
+    def encode(self, texts):
+        texts = list(texts)
+        started = time.monotonic()
+        try:
+            parts = []
+            for i in range(0, max(len(texts), 1), self.max_batch_size):
+                parts.append(self._call("encode", texts[i:i + self.max_batch_size]))
+                with self._lock:
+                    self._stats["calls"] += 1
+            return parts[0] if len(parts) == 1 else np.concatenate(parts)
+        except Exception:
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._stats["requests"] += 1
+                self._stats["time_total_ms"] += (time.monotonic() - started) * 1000
+
+    def ping(self, timeout=2.0):
+        return self._call("ping", timeout=timeout)
+
+    @property
+    def model_name(self):
+        """推理进程实际加载的模型名（第一次访问时询问推理进程）"""
+        if self._model_name is None:
+            self._model_name = self.ping(timeout=self.timeout)
+        return self._model_name
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats, idle=len(self._idle))
+        requests = stats["requests"]
+        stats["time_avg_ms"] = round(stats["time_total_ms"] / requests, 3) if requests else 0.0
+        try:
+            server = self._call("stats", timeout=2.0)
+        except Exception as e:
+            server = {"error": str(e)}
+        return {"mode": "remote", "address": f"{self.address}", "client": stats, "server": server}
@@ -0,0 +1,26 @@
+# -*- coding: utf-8 -*-
+"""
+gunicorn 生产配置：gunicorn -c gunicorn.conf.py app:app
+
+推荐部署（见 docker-compose.yml）：
+    inference  python inference_server.py，唯一加载模型的进程
+    writer     1 个 worker，INDEX_MMAP=0，处理 /api/init、/api/embeddings 等写入并做检查点
+    search     WEB_CONCURRENCY 个 worker，INDEX_MMAP=1，只读内存映射同一份快照，
+               每 REPLICA_SYNC_SEC 秒回放写入节点的新日志，发现新快照自动重新加载
+
+kill -HUP <gunicorn 主进程> 会平滑重启所有 worker，重新打开最新快照。
+不使用 preload_app：faiss / MySQL 连接 / 后台线程都在各 worker 里各自初始化，
+worker 不加载模型，启动很快。
+"""
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:5000")
+workers = int(os.environ.get("WEB_CONCURRENCY", 4))
+# gthread：每个 worker 多个请求线程，faiss 搜索和 MySQL 查询都会释放 GIL
+worker_class = "gthread"
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# gthread 的心跳不受单个请求阻塞影响，/api/init 这类长请求不会触发超时
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", 120))
+graceful_timeout = int(os.environ.get("GUNICORN_GRACEFUL_TIMEOUT", 30))
+keepalive = 5
+accesslog = "-"
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+FAISS 索引工厂：根据配置创建 flat / ivf_flat / ivf_pq / hnsw 索引，
+以及构造每次查询用的搜索参数（nprobe / efSearch / ID 过滤）。
+
+向量编码（VECTOR_CODEC）：
+    fp32  原始 float32（4 字节 / 维）
+    fp16  半精度标量量化（2 字节 / 维）
+    sq8   8bit 标量量化（1 字节 / 维，需要训练）
+fp16 / sq8 对 flat、ivf_flat、hnsw 生效；ivf_pq 本身就是压缩编码，忽略该配置。
+RERANK_ORIGINAL=1 时额外保留原始向量（IndexRefineFlat），
+先用压缩向量召回 k * RERANK_K_FACTOR 条，再用原始向量精排。
+
+所有索引均使用内积（向量已归一化，即余弦相似度）。
+"""
+import math
+import os
+
+import faiss
+
+INDEX_TYPES = ("flat", "ivf_flat", "ivf_pq", "hnsw")
+VECTOR_CODECS = ("fp32", "fp16", "sq8")
+
+INDEX_TYPE = os.environ.get("INDEX_TYPE", "flat")
+VECTOR_CODEC = os.environ.get("VECTOR_CODEC", "fp32")
+RERANK_ORIGINAL = os.environ.get("RERANK_ORIGINAL", "0") == "1"
+RERANK_K_FACTOR = float(os.environ.get("RERANK_K_FACTOR", 4))
+IVF_NLIST = int(os.environ.get("IVF_NLIST", 0))          # 0 = 按数据量自动选择
+PQ_M = int(os.environ.get("PQ_M", 64))                   # 子量化器个数，需整除向量维度
+PQ_NBITS = int(os.environ.get("PQ_NBITS", 8))
+HNSW_M = int(os.environ.get("HNSW_M", 32))
+HNSW_EF_CONSTRUCTION = int(os.environ.get("HNSW_EF_CONSTRUCTION", 200))
+DEFAULT_NPROBE = int(os.environ.get("NPROBE", 16))
+DEFAULT_EF_SEARCH = int(os.environ.get("EF_SEARCH", 64))
+# 带过滤条件的搜索按命中比例放大 efSearch 时的上限
+FILTER_MAX_EF_SEARCH = int(os.environ.get("FILTER_MAX_EF_SEARCH", 1024))
+TRAIN_SAMPLE_SIZE = int(os.environ.get("TRAIN_SAMPLE_SIZE", 50000))
+
+# 只读内存映射加载：IVF 的倒排表总是可以 mmap；
+# faiss >= 1.10 提供 IO_FLAG_MMAP_IFC 时 flat 类编码也可以 mmap，旧版会整体读入内存
+HAS_MMAP_IFC = hasattr(faiss, "IO_FLAG_MMAP_IFC")
+MMAP_IO_FLAGS = faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+
+_SQ_TYPES = {
+    "fp16": faiss.ScalarQuantizer.QT_fp16,
+    "sq8": faiss.ScalarQuantizer.QT_8bit,
+}
+
+
+def default_nlist(n):
+    """经验值：约 4 * sqrt(n) 个聚类中心，至少 1 个、且不超过样本数"""
+    if IVF_NLIST > 0:
+        return IVF_NLIST
+    return max(1, min(n, int(4 * math.sqrt(max(n, 1)))))
+
+
+def create_index(dim, index_type=None, expected_size=0, codec=None, rerank=None):
+    """
+    创建一个空索引。IVF 类索引和 sq8 编码返回时尚未训练，需要先 train 再 add。
+    expected_size 用于自动推算 nlist。
+    """
+    index_type = index_type or INDEX_TYPE
+    codec = codec or VECTOR_CODEC
+    rerank = RERANK_ORIGINAL if rerank is None else rerank
+    if codec not in VECTOR_CODECS:
+        raise ValueError(f"未知的向量编码: {codec}，可选 {VECTOR_CODECS}")
+    qtype = _SQ_TYPES.get(codec)
+
+    if index_type == "flat":
+        if qtype is None:
+            # 原始向量本身就是精确结果，不需要再精排
+            return faiss.IndexFlatIP(dim)
+        idx = faiss.IndexScalarQuantizer(dim, qtype, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == "hnsw":
+        if qtype is None:
+            idx = faiss.IndexHNSWFlat(dim, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            idx = faiss.IndexHNSWSQ(dim, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        idx.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        idx.hnsw.efSearch = DEFAULT_EF_SEARCH
+    elif index_type in ("ivf_flat", "ivf_pq"):
+        nlist = default_nlist(expected_size)
+        quantizer = faiss.IndexFlatIP(dim)
+        if index_type == "ivf_pq":
+            idx = faiss.IndexIVFPQ(quantizer, dim, nlist, PQ_M, PQ_NBITS, faiss.METRIC_INNER_PRODUCT)
+        elif qtype is None:
+            idx = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            idx = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, qtype, faiss.METRIC_INNER_PRODUCT)
+        idx.nprobe = DEFAULT_NPROBE
+    else:
+        raise ValueError(f"未知的索引类型: {index_type}，可选 {INDEX_TYPES}")
+
+    lossy = qtype is not None or index_type == "ivf_pq"
+    if rerank and lossy:
+        idx = faiss.IndexRefineFlat(idx)
+        idx.k_factor = RERANK_K_FACTOR
+    return idx
+
+
+def read_index(path, mmap=False, fallbacks=None):
+    """
+    读取索引文件；mmap=True 时以只读内存映射方式加载，可在多个进程间共享物理内存。
+    没能映射、编码被整体读入内存时，把文件名和原因追加到 fallbacks（列表）。
+    """
+    if not mmap:
+        return faiss.read_index(path)
+    reason = None if HAS_MMAP_IFC else f"faiss {faiss.__version__} 不支持 IO_FLAG_MMAP_IFC"
+    try:
+        idx = faiss.read_index(path, MMAP_IO_FLAGS)
+    except RuntimeError as e:
+        # IVF 的倒排表只能用普通文件方式 mmap，不能和 IO_FLAG_MMAP_IFC 同时使用
+        reason = f"IO_FLAG_MMAP_IFC 被拒绝（{str(e).strip().splitlines()[-1]}）"
+        idx = faiss.read_index(path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    refine, inner = unwrap_refine(idx)
+    # 普通 mmap 只映射 IVF 倒排表：不带精排的 IVF 仍然是映射的，其余编码都在内存里
+    if reason and fallbacks is not None and (refine is not None or faiss.try_extract_index_ivf(inner) is None):
+        fallbacks.append(f"{os.path.basename(path)}: {reason}")
+    return idx
+
+
+def base_index(idx):
+    """去掉 IndexIDMap 包装，返回实际的索引对象"""
+    if isinstance(idx, faiss.IndexIDMap):
+        return faiss.downcast_index(idx.index)
+    return idx
+
+
+def unwrap_refine(idx):
+    """返回 (IndexRefine 或 None, 实际做召回的索引)"""
+    base = base_index(idx)
+    if isinstance(base, faiss.IndexRefine):
+        return base, faiss.downcast_index(base.base_index)
+    return None, base
+
+
+def supports_remove(idx):
+    """
+    只有 flat 类编码（IndexFlat / IndexScalarQuantizer）删除后会重排内部下标，
+    与 IndexIDMap2 的映射保持一致；IVF 删除不重排，HNSW 与带精排的索引不支持删除，
+    这些索引改用墓碑（只删映射，下次重建时清理）。
+    """
+    refine, inner = unwrap_refine(idx)
+    return refine is None and isinstance(inner, faiss.IndexFlatCodes)
+
+
+def search_params(idx, nprobe=None, ef_search=None, sel=None, selectivity=1.0):
+    """
+    为单次查询构造 SearchParameters，不修改索引本身的状态（并发安全）。
+    sel 为按 vid 过滤的 faiss.IDSelector，selectivity 为过滤条件命中的比例：
+    IVF / HNSW 按比例放大 nprobe / efSearch，使访问到的命中候选数与不过滤时相当。
+    不适用的参数会被忽略；什么都不需要时返回 None（使用索引默认值）。
+    """
+    refine, inner = unwrap_refine(idx)
+    scale = 1.0 / max(selectivity, 1e-9) if sel is not None and selectivity < 1.0 else 1.0
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        if scale > 1.0:
+            nprobe = min(ivf.nlist, math.ceil((nprobe or ivf.nprobe) * scale))
+        # IVF 只接受 SearchParametersIVF，带过滤条件时也要用它承载 sel
+        if nprobe is not None or sel is not None:
+            params = faiss.SearchParametersIVF(nprobe=int(nprobe or ivf.nprobe))
+        else:
+            params = None
+    elif isinstance(inner, faiss.IndexHNSW):
+        if scale > 1.0:
+            ef_search = min(FILTER_MAX_EF_SEARCH, math.ceil((ef_search or inner.hnsw.efSearch) * scale))
+        if ef_search is not None or sel is not None:
+            params = faiss.SearchParametersHNSW(efSearch=int(ef_search or inner.hnsw.efSearch))
+        else:
+            params = None
+    else:
+        params = None
+
+    if sel is not None:
+        if params is None:
+            params = faiss.SearchParameters()
+        params.sel = sel
+
+    if refine is not None and params is not None:
+        return faiss.IndexRefineSearchParameters(k_factor=refine.k_factor, base_index_params=params)
+    return params
+
+
+def bytes_per_vector(idx):
+    """序列化后平均每条向量占用的字节数（含倒排表 / 图结构等开销）"""
+    if idx.ntotal == 0:
+        return 0.0
+    return faiss.serialize_index(idx).nbytes / idx.ntotal
+
+
+def describe(idx):
+    """简要描述索引类型与关键参数，用于接口返回和日志"""
+    refine, inner = unwrap_refine(idx)
+    info = {"class": type(inner).__name__, "ntotal": int(idx.ntotal), "is_trained": bool(idx.is_trained)}
+    if refine is not None:
+        info.update(rerank=True, k_factor=float(refine.k_factor))
+    ivf = faiss.try_extract_index_ivf(inner)
+    if ivf is not None:
+        info.update(nlist=int(ivf.nlist), nprobe=int(ivf.nprobe))
+    if isinstance(inner, faiss.IndexHNSW):
+        info.update(efSearch=int(inner.hnsw.efSearch), efConstruction=int(inner.hnsw.efConstruction))
+    return info
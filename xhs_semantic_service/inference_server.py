@@ -0,0 +1,65 @@
+# -*- coding: utf-8 -*-
+"""
+独立推理进程：只在这里加载一份模型，HTTP worker 通过 RemoteEncoder 连进来编码。
+
+每个客户端连接一个线程，所有连接的编码请求进入同一个微批队列，
+因此多个 worker 的并发查询仍然会被合并成一个 batch。
+
+协议（multiprocessing.connection，带 authkey 握手）：
+    请求 (op, payload)，op ∈ encode / ping / stats
+    响应 ("ok", 结果) 或 ("error", 错误信息)
+
+用法：
+    INFERENCE_ADDRESS=unix:/tmp/xhs-embed.sock python inference_server.py
+"""
+import os
+import threading
+from multiprocessing.connection import Listener
+
+from encoder import INFERENCE_ADDRESS, INFERENCE_AUTHKEY, LocalEncoder, parse_address
+
+
+def handle(conn, encoder):
+    with conn:
+        while True:
+            try:
+                op, payload = conn.recv()
+            except (EOFError, ConnectionError, OSError):
+                return
+            try:
+                if op == "encode":
+                    result = encoder.encode(payload)
+                elif op == "ping":
+                    result = encoder.model_name
+                elif op == "stats":
+                    result = encoder.stats()
+                else:
+                    raise ValueError(f"未知操作: {op}")
+                reply = ("ok", result)
+            except Exception as e:
+                reply = ("error", f"{type(e).__name__}: {e}")
+            try:
+                conn.send(reply)
+            except (ConnectionError, OSError):
+                return
+
+
+def main():
+    address, family = parse_address(INFERENCE_ADDRESS or "unix:/tmp/xhs-embed.sock")
+    if family == "AF_UNIX" and os.path.exists(address):
+        os.unlink(address)  # 上次退出残留的套接字文件
+    encoder = LocalEncoder()
+    with Listener(address, family=family, authkey=INFERENCE_AUTHKEY) as listener:
+        print(f"🧠 推理进程已启动：{encoder.model_name} @ {address}")
+        while True:
+            try:
+                conn = listener.accept()
+            except Exception as e:
+                # 认证失败等单个连接的错误不影响继续服务
+                print("❌ 接受连接失败:", e)
+                continue
+            threading.Thread(target=handle, args=(conn, encoder), daemon=True).start()
+
+
+if __name__ == "__main__":
+    main()
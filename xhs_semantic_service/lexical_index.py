@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+进程内中文倒排索引（BM25），与 FAISS 索引并行维护，用于混合检索的词法一路。
+
+分词不依赖词典：
+    中文连续片段 → 字符 bigram（单字片段保留单字）
+    英文 / 数字片段 → 整词（小写、全角转半角），含 . _ - 的型号同时拆出各段，
+                      如 "RTX-4090" → rtx-4090 / rtx / 4090
+
+倒排表按内部文档号存储（array，紧凑且可追加），vid 被替换或删除时旧文档只标记失效，
+失效文档占比超过 LEXICAL_COMPACT_RATIO 时重新编号、清理倒排表。
+查询时只在命中查询词的倒排表上算 BM25，按候选文档号稀疏累加，
+再用属性过滤位图（与向量检索同一个 mask）筛选，开销与命中的倒排表长度成正比，与总文档数无关。
+"""
+import math
+import os
+import re
+import unicodedata
+from array import array
+from collections import Counter
+
+import numpy as np
+
+from vector_store import RWLock
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 失效文档占比超过该值（且至少 _MIN_COMPACT_DEAD 条）时压缩
+LEXICAL_COMPACT_RATIO = float(os.environ.get("LEXICAL_COMPACT_RATIO", 0.3))
+_MIN_COMPACT_DEAD = 1024
+_INITIAL_CAPACITY = 1024
+
+_RUN_RE = re.compile(r"[a-z0-9]+(?:[._\-][a-z0-9]+)*|[\u3400-\u4dbf\u4e00-\u9fff]+")
+_PART_RE = re.compile(r"[._\-]")
+
+
+def tokenize(text):
+    if not text:
+        return []
+    text = unicodedata.normalize("NFKC", str(text)).lower()
+    tokens = []
+    for m in _RUN_RE.finditer(text):
+        run = m.group()
+        if run[0].isascii():
+            tokens.append(run)
+            if _PART_RE.search(run):
+                tokens.extend(part for part in _PART_RE.split(run) if part)
+        elif len(run) == 1:
+            tokens.append(run)
+        else:
+            tokens.extend(run[i:i + 2] for i in range(len(run) - 1))
+    return tokens
+
+
+def _grow(arr, size, fill):
+    grown = np.full(size, fill, dtype=arr.dtype)
+    grown[:len(arr)] = arr
+    return grown
+
+
+class LexicalIndex:
+    def __init__(self):
+        self.lock = RWLock()
+        self.ready = False                # 全量加载完成前结果不完整
+        self.postings = {}                # token → (array('i') 文档号, array('H') 词频)
+        self.n_docs = 0                   # 已分配的文档号（含失效的）
+        self.doc_vid = np.full(_INITIAL_CAPACITY, -1, dtype="int64")
+        self.doc_len = np.zeros(_INITIAL_CAPACITY, dtype="float32")
+        self.doc_alive = np.zeros(_INITIAL_CAPACITY, dtype=bool)
+        self.vid_doc = {}                 # vid → 当前文档号
+        self.alive_docs = 0
+        self.alive_len = 0.0
+
+    def __len__(self):
+        return self.alive_docs
+
+    # ---------- 写入 ----------
+    def _kill(self, vid):
+        doc = self.vid_doc.pop(vid, None)
+        if doc is not None and self.doc_alive[doc]:
+            self.doc_alive[doc] = False
+            self.alive_docs -= 1
+            self.alive_len -= float(self.doc_len[doc])
+
+    def add(self, vids, texts):
+        """写入 / 替换文档；同一 vid 的旧内容失效"""
+        with self.lock.write():
+            need = self.n_docs + len(vids)
+            if need > len(self.doc_vid):
+                size = max(need, len(self.doc_vid) * 2)
+                self.doc_vid = _grow(self.doc_vid, size, -1)
+                self.doc_len = _grow(self.doc_len, size, 0)
+                self.doc_alive = _grow(self.doc_alive, size, False)
+            for vid, text in zip(vids, texts):
+                self._kill(vid)
+                tokens = tokenize(text)
+                doc = self.n_docs
+                self.n_docs += 1
+                self.doc_vid[doc] = vid
+                self.doc_len[doc] = len(tokens)
+                self.doc_alive[doc] = True
+                self.vid_doc[vid] = doc
+                self.alive_docs += 1
+                self.alive_len += len(tokens)
+                for token, tf in Counter(tokens).items():
+                    plist = self.postings.get(token)
+                    if plist is None:
+                        plist = self.postings[token] = (array("i"), array("H"))
+                    plist[0].append(doc)
+                    plist[1].append(min(tf, 65535))
+            self._maybe_compact()
+
+    def remove(self, vids):
+        with self.lock.write():
+            for vid in vids:
+                if vid is not None:
+                    self._kill(vid)
+            self._maybe_compact()
+
+    def _maybe_compact(self):
+        dead = self.n_docs - self.alive_docs
+        if dead >= _MIN_COMPACT_DEAD and dead > self.n_docs * LEXICAL_COMPACT_RATIO:
+            self.compact()
+
+    def compact(self):
+        """去掉失效文档：存活文档按原顺序重新编号，倒排表只保留存活文档（调用方持有写锁）"""
+        alive = self.doc_alive[:self.n_docs]
+        new_doc = np.cumsum(alive, dtype="int64") - 1
+        for token, (docs, tfs) in list(self.postings.items()):
+            doc_arr = np.frombuffer(docs, dtype="int32")
+            keep = alive[doc_arr]
+            if keep.all():
+                new_docs = new_doc[doc_arr].astype("int32")
+                new_tfs = tfs
+            elif keep.any():
+                new_docs = new_doc[doc_arr[keep]].astype("int32")
+                new_tfs = array("H", np.frombuffer(tfs, dtype="uint16")[keep].tobytes())
+            else:
+                del self.postings[token]
+                continue
+            self.postings[token] = (array("i", new_docs.tobytes()), new_tfs)
+        n = self.alive_docs
+        size = max(_INITIAL_CAPACITY, n)
+        self.doc_vid = _grow(self.doc_vid[:self.n_docs][alive], size, -1)
+        self.doc_len = _grow(self.doc_len[:self.n_docs][alive], size, 0)
+        self.doc_alive = _grow(np.ones(n, dtype=bool), size, False)
+        self.vid_doc = {int(vid): doc for doc, vid in enumerate(self.doc_vid[:n].tolist())}
+        self.n_docs = n
+
+    # ---------- 查询 ----------
+    def _score(self, terms):
+        """
+        对查询词累加 BM25，返回 (候选文档号, 分数)，只包含命中查询词的存活文档。
+        倒排表的 buffer 视图不离开本函数。
+        """
+        n = max(self.alive_docs, 1)
+        avgdl = self.alive_len / n if self.alive_len > 0 else 1.0
+        all_docs, all_scores = [], []
+        for token, qtf in terms.items():
+            plist = self.postings.get(token)
+            if plist is None:
+                continue
+            docs = np.frombuffer(plist[0], dtype="int32")
+            alive = self.doc_alive[docs]
+            docs = docs[alive]
+            if not len(docs):
+                continue
+            tf = np.frombuffer(plist[1], dtype="uint16")[alive].astype("float32")
+            df = len(docs)
+            idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * self.doc_len[docs] / avgdl)
+            all_docs.append(docs)
+            all_scores.append(qtf * idf * tf * (BM25_K1 + 1) / (tf + norm))
+        if not all_docs:
+            return np.zeros(0, dtype="int64"), np.zeros(0, dtype="float32")
+        if len(all_docs) == 1:
+            return all_docs[0].astype("int64"), all_scores[0]
+        docs, inverse = np.unique(np.concatenate(all_docs), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(all_scores), minlength=len(docs))
+        return docs.astype("int64"), scores.astype("float32")
+
+    def search(self, text, k, mask=None):
+        """
+        返回 [(vid, bm25 分数)]，按分数降序。mask 为按 vid 的布尔过滤数组（可为 None）。
+        """
+        terms = Counter(tokenize(text))
+        if not terms or k <= 0:
+            return []
+        with self.lock.read():
+            docs, scores = self._score(terms)
+            vids = self.doc_vid[docs]
+            hit = scores > 0
+            if mask is not None:
+                inside = vids < len(mask)
+                hit &= inside
+                hit[inside] &= mask[vids[inside]]
+            vids, scores = vids[hit], scores[hit]
+            order = np.arange(len(vids))
+            if len(order) > k:
+                order = np.argpartition(-scores, k - 1)[:k]
+            order = order[np.argsort(-scores[order], kind="stable")]
+            return [(int(vids[i]), float(scores[i])) for i in order]
+
+    def term_counts(self, labels, n_labels, min_df=1, chunk=5000):
+        """
+        按分组统计词频：labels 为按 vid 的组号数组（-1 表示不参与），
+        返回 (词列表, (词数, n_labels) 的词频矩阵)；只统计文档频次 ≥ min_df 的词。
+        分块持有读锁，统计期间写入只会短暂等待。
+        """
+        with self.lock.read():
+            terms = [t for t, plist in self.postings.items() if len(plist[0]) >= min_df]
+        kept, rows = [], []
+        for start in range(0, len(terms), chunk):
+            with self.lock.read():
+                alive = self.doc_alive[:self.n_docs]
+                vids = self.doc_vid[:self.n_docs]
+                for term in terms[start:start + chunk]:
+                    plist = self.postings.get(term)
+                    if plist is None:     # 两块之间被 compact() 清理掉了
+                        continue
+                    docs = np.frombuffer(plist[0], dtype="int32")
+                    tf = np.frombuffer(plist[1], dtype="uint16")
+                    docs_vids = vids[docs]
+                    group = np.full(len(docs), -1, dtype="int64")
+                    inside = docs_vids < len(labels)
+                    group[inside] = labels[docs_vids[inside]]
+                    use = alive[docs] & (group >= 0)
+                    if use.any():
+                        kept.append(term)
+                        rows.append(np.bincount(group[use], weights=tf[use], minlength=n_labels))
+        counts = np.stack(rows).astype("float32") if rows else np.zeros((0, n_labels), dtype="float32")
+        return kept, counts
+
+    def stats(self):
+        with self.lock.read():
+            return {
+                "ready": self.ready,
+                "docs": self.alive_docs,
+                "dead_docs": self.n_docs - self.alive_docs,
+                "terms": len(self.postings),
+                "avg_doc_len": round(self.alive_len / self.alive_docs, 2) if self.alive_docs else 0.0,
+            }
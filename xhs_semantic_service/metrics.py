@@ -0,0 +1,174 @@
+# -*- coding: utf-8 -*-
+"""
+进程内指标，按 Prometheus 文本格式输出（/metrics），不依赖 prometheus_client。
+
+    Counter    单调递增计数
+    Histogram  固定分桶的耗时分布（秒），按标签分组
+    Gauge      抓取时调用回调现算（索引大小、缓存命中率等），不在写入路径上维护
+
+分阶段计时：一次请求内用 StageTimer.stage(名字) 包住各阶段，
+耗时既计入 xhs_stage_seconds{endpoint, stage} 直方图，也留在 StageTimer 里供慢请求日志输出。
+同一阶段在一次请求内出现多次（如 /api/init 逐批编码）时，直方图每次都记录，日志里累加。
+
+gunicorn 多 worker 时每个 worker 各自计数，所有样本带 worker（pid）标签，按 worker 求和即可。
+"""
+import math
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _format_value(value):
+    if value is None or (isinstance(value, float) and math.isnan(value)):
+        return "NaN"
+    return repr(float(value))
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield self.name, list(zip(self.labelnames, key)), value
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets)
+        self._series = {}               # 标签值 → [各桶计数..., +Inf 计数, 总和]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = tuple(labels[n] for n in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[-2] += 1
+            series[-1] += value
+
+    def samples(self):
+        with self._lock:
+            series = {key: list(values) for key, values in self._series.items()}
+        for key, values in sorted(series.items()):
+            labels = list(zip(self.labelnames, key))
+            for bound, count in zip(self.buckets, values):
+                yield self.name + "_bucket", labels + [("le", repr(bound))], count
+            yield self.name + "_bucket", labels + [("le", "+Inf")], values[-2]
+            yield self.name + "_count", labels, values[-2]
+            yield self.name + "_sum", labels, values[-1]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help_text, fn, labelnames=()):
+        """fn() 返回数值；有标签时返回 {标签值元组: 数值}"""
+        self.name = name
+        self.help = help_text
+        self.fn = fn
+        self.labelnames = tuple(labelnames)
+
+    def samples(self):
+        try:
+            value = self.fn()
+        except Exception:
+            value = None
+        if not self.labelnames:
+            yield self.name, [], value
+            return
+        for key, v in sorted((value or {}).items()):
+            yield self.name, list(zip(self.labelnames, key)), v
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def counter(self, name, help_text, labelnames=()):
+        return self._register(Counter(name, help_text, labelnames))
+
+    def histogram(self, name, help_text, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._register(Histogram(name, help_text, labelnames, buckets))
+
+    def gauge(self, name, help_text, fn, labelnames=()):
+        return self._register(Gauge(name, help_text, fn, labelnames))
+
+    def _register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        worker = [("worker", str(os.getpid()))]
+        lines = []
+        for metric in self._metrics:
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.kind}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{_format_labels(worker + labels)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+class StageTimer:
+    """一次请求的分阶段计时"""
+
+    def __init__(self, histogram, endpoint):
+        self.histogram = histogram
+        self.endpoint = endpoint
+        self.started = time.perf_counter()
+        self.stages = {}                # 阶段 → [累计秒数, 次数]
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.histogram.observe(elapsed, endpoint=self.endpoint, stage=name)
+            total = self.stages.setdefault(name, [0.0, 0])
+            total[0] += elapsed
+            total[1] += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def breakdown_ms(self):
+        """{阶段: 毫秒}，出现多次的阶段附带次数"""
+        return {name: round(seconds * 1000, 2) if count == 1 else {"ms": round(seconds * 1000, 2), "count": count}
+                for name, (seconds, count) in self.stages.items()}
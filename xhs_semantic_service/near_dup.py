@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+评论近重复索引（SimHash + 分段 LSH），与属性列、倒排索引一样按 vid 随写入维护。
+
+    签名  评论分词（与倒排索引同一套 tokenize）按词频加权的 64 位 SimHash；
+          没有可分词内容的评论（纯表情等）用规范化后的整段文本作为唯一的词
+    聚类  新评论与已有簇的代表签名海明距离 ≤ NEAR_DUP_MAX_DISTANCE 即归入该簇，否则自成一簇
+    查找  64 位签名切成 NEAR_DUP_BANDS 段，距离不超过阈值的两个签名至少有一段完全相同
+          （抽屉原理，要求段数 > 阈值），桶里只放簇的代表签名，
+          成千上万条相同的刷屏评论只占一个桶位，写入开销与簇大小无关
+
+搜索时同一簇只保留排名最靠前的一条，并返回簇内其余评论数，top_k 不再被复制粘贴的评论占满。
+"""
+import hashlib
+import os
+import threading
+from collections import Counter
+from functools import lru_cache
+
+import numpy as np
+
+from embed_cache import normalize_text
+from lexical_index import tokenize
+
+NEAR_DUP_MAX_DISTANCE = int(os.environ.get("NEAR_DUP_MAX_DISTANCE", 3))
+NEAR_DUP_BANDS = int(os.environ.get("NEAR_DUP_BANDS", 4))
+_INITIAL_CAPACITY = 1024
+_BITS = np.uint64(1) << np.arange(64, dtype="uint64")
+
+
+@lru_cache(maxsize=1 << 16)
+def _token_hash(token):
+    return int.from_bytes(hashlib.blake2b(token.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+def simhash(text):
+    """64 位 SimHash（Python int）"""
+    counts = Counter(tokenize(text)) or Counter([normalize_text(text)])
+    hashes = np.fromiter((_token_hash(t) for t in counts), dtype="uint64", count=len(counts))
+    weights = np.fromiter(counts.values(), dtype="float32", count=len(counts))
+    bits = (hashes[:, None] & _BITS) != 0
+    votes = (np.where(bits, 1.0, -1.0) * weights[:, None]).sum(axis=0)
+    return int(_BITS[votes > 0].sum(dtype="uint64"))
+
+
+def hamming(a, b):
+    return bin(a ^ b).count("1")
+
+
+class NearDupIndex:
+    def __init__(self, max_distance=NEAR_DUP_MAX_DISTANCE, bands=NEAR_DUP_BANDS):
+        if bands <= max_distance or 64 % bands:
+            raise ValueError("NEAR_DUP_BANDS 必须整除 64 且大于 NEAR_DUP_MAX_DISTANCE")
+        self.max_distance = max_distance
+        self.band_bits = 64 // bands
+        self.lock = threading.Lock()
+        self.ready = False                   # 全量加载完成前聚类不完整
+        self.cluster = np.full(_INITIAL_CAPACITY, -1, dtype="int32")   # vid → 簇号
+        self.cluster_sig = []                # 簇号 → 代表签名
+        self.cluster_size = []               # 簇号 → 当前成员数
+        self.buckets = [{} for _ in range(bands)]   # 每段：段值 → [簇号]
+
+    def __len__(self):
+        return int(np.count_nonzero(self.cluster >= 0))
+
+    def _bands(self, sig):
+        mask = (1 << self.band_bits) - 1
+        return [(sig >> (i * self.band_bits)) & mask for i in range(len(self.buckets))]
+
+    def _find(self, sig):
+        best, best_dist = None, self.max_distance + 1
+        for table, value in zip(self.buckets, self._bands(sig)):
+            for cluster in table.get(value, ()):
+                dist = hamming(sig, self.cluster_sig[cluster])
+                if dist < best_dist:
+                    best, best_dist = cluster, dist
+                    if dist == 0:
+                        return best
+        return best
+
+    def _detach(self, vid):
+        if vid < len(self.cluster) and self.cluster[vid] >= 0:
+            self.cluster_size[self.cluster[vid]] -= 1
+            self.cluster[vid] = -1
+
+    # ---------- 写入 ----------
+    def add(self, vids, texts):
+        """写入 / 替换评论；同一 vid 的旧内容先离开原簇"""
+        if not vids:
+            return
+        sigs = [simhash(text) for text in texts]
+        with self.lock:
+            need = max(vids) + 1
+            if need > len(self.cluster):
+                grown = np.full(max(need, len(self.cluster) * 2), -1, dtype="int32")
+                grown[:len(self.cluster)] = self.cluster
+                self.cluster = grown
+            for vid, sig in zip(vids, sigs):
+                self._detach(vid)
+                cluster = self._find(sig)
+                if cluster is None:
+                    cluster = len(self.cluster_sig)
+                    self.cluster_sig.append(sig)
+                    self.cluster_size.append(0)
+                    for table, value in zip(self.buckets, self._bands(sig)):
+                        table.setdefault(value, []).append(cluster)
+                self.cluster[vid] = cluster
+                self.cluster_size[cluster] += 1
+
+    def remove(self, vids):
+        """簇成员清零后代表签名仍保留，之后出现的同类评论继续归入该簇"""
+        with self.lock:
+            for vid in vids:
+                if vid is not None:
+                    self._detach(vid)
+
+    # ---------- 查询 ----------
+    def collapse(self, items):
+        """
+        items: 按排名排好的 [(key, vid)]。每个簇只保留第一次出现的那条，
+        返回 [(key, 簇内其余评论数)]；没有聚类信息的 vid 原样保留，其余数记为 0。
+        """
+        seen = set()
+        result = []
+        with self.lock:
+            for key, vid in items:
+                cluster = int(self.cluster[vid]) if vid is not None and 0 <= vid < len(self.cluster) else -1
+                if cluster < 0:
+                    result.append((key, 0))
+                    continue
+                if cluster in seen:
+                    continue
+                seen.add(cluster)
+                result.append((key, self.cluster_size[cluster] - 1))
+        return result
+
+    def stats(self):
+        with self.lock:
+            sizes = np.asarray(self.cluster_size, dtype="int64")
+            members = int(sizes.sum())
+            live = sizes[sizes > 0]
+            return {
+                "ready": self.ready,
+                "comments": members,
+                "clusters": int(len(live)),
+                "duplicate_clusters": int(np.count_nonzero(live > 1)),
+                # 每簇只存一个向量时可以省下的向量数
+                "redundant_vectors": members - int(len(live)),
+                "largest_cluster": int(live.max()) if len(live) else 0,
+                "max_distance": self.max_distance,
+            }
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+笔记级向量索引：每篇笔记一个向量，用于“哪些笔记在讨论 X”。
+
+    笔记向量 = normalize((1 - NOTE_TEXT_WEIGHT) * 评论向量均值 + NOTE_TEXT_WEIGHT * 笔记正文向量)
+
+笔记编号沿用 AttributeIndex 的笔记编码，成员关系来自属性列的 note 列。
+评论写入 / 删除只把所属笔记标记为待刷新，由后台按批重新聚合（成员向量从主索引取回），
+单篇笔记的刷新开销只与它的评论数有关。笔记数量远小于评论数，用精确的 flat 内积索引。
+"""
+import os
+import threading
+
+import faiss
+import numpy as np
+
+from vector_store import RWLock
+
+NOTE_TEXT_WEIGHT = float(os.environ.get("NOTE_TEXT_WEIGHT", 0.3))
+
+
+class NoteIndex:
+    def __init__(self, dim, text_weight=NOTE_TEXT_WEIGHT):
+        self.dim = dim
+        self.text_weight = text_weight
+        self.lock = RWLock()
+        self.ready = False               # 全部笔记至少聚合过一次之前结果不完整
+        self.index = faiss.IndexIDMap2(faiss.IndexFlatIP(dim))
+        self.text_vectors = {}           # 笔记编码 → 正文向量
+        self.comment_counts = {}         # 笔记编码 → 参与聚合的评论数
+        self._dirty = set()
+        self._dirty_lock = threading.Lock()
+
+    def __len__(self):
+        return self.index.ntotal
+
+    # ---------- 增量维护 ----------
+    def mark_dirty(self, note_codes):
+        codes = [int(c) for c in note_codes if c >= 0]
+        if codes:
+            with self._dirty_lock:
+                self._dirty.update(codes)
+
+    def take_dirty(self):
+        with self._dirty_lock:
+            dirty, self._dirty = self._dirty, set()
+        return dirty
+
+    def pending(self):
+        with self._dirty_lock:
+            return len(self._dirty)
+
+    def missing_text(self, note_codes):
+        return [code for code in note_codes if code not in self.text_vectors]
+
+    def set_text_vectors(self, note_codes, vectors):
+        """note_codes 与 vectors 一一对应；没有正文的笔记传 None，之后不再重复查询"""
+        for code, vector in zip(note_codes, vectors):
+            self.text_vectors[code] = None if vector is None else np.asarray(vector, dtype="float32")
+
+    def update(self, groups):
+        """
+        groups: {笔记编码: 该笔记当前全部评论向量 (n, dim)，n 可以为 0}。
+        重新计算这些笔记的向量并替换；既没有评论也没有正文的笔记从索引中移除。
+        """
+        if not groups:
+            return
+        codes, vectors, counts = [], [], {}
+        for code, comment_vectors in groups.items():
+            text = self.text_vectors.get(code)
+            has_text = text is not None
+            parts, weights = [], []
+            if len(comment_vectors):
+                parts.append(np.asarray(comment_vectors, dtype="float32").mean(axis=0))
+                weights.append(1.0 - self.text_weight if has_text else 1.0)
+            if has_text:
+                parts.append(text)
+                weights.append(self.text_weight if len(comment_vectors) else 1.0)
+            counts[code] = len(comment_vectors)
+            if not parts:
+                continue
+            vector = sum(w * p for w, p in zip(weights, parts))
+            norm = np.linalg.norm(vector)
+            if norm > 0:
+                codes.append(code)
+                vectors.append(vector / norm)
+        ids = np.fromiter(groups.keys(), dtype="int64", count=len(groups))
+        with self.lock.write():
+            self.index.remove_ids(ids)
+            if codes:
+                self.index.add_with_ids(np.stack(vectors).astype("float32"), np.asarray(codes, dtype="int64"))
+            for code, n in counts.items():
+                if n:
+                    self.comment_counts[code] = n
+                else:
+                    self.comment_counts.pop(code, None)
+
+    # ---------- 查询 ----------
+    def search(self, q_vec, k, allowed=None):
+        """返回 [(笔记编码, 相似度)]；allowed 为允许的笔记编码数组（None 表示不限）"""
+        params = sel = None
+        if allowed is not None:
+            if len(allowed) == 0:
+                return []
+            sel = faiss.IDSelectorBatch(np.asarray(allowed, dtype="int64"))
+            params = faiss.SearchParameters(sel=sel)
+        with self.lock.read():
+            D, I = self.index.search(np.asarray(q_vec, dtype="float32").reshape(1, -1), k, params=params)
+        return [(int(code), float(score)) for code, score in zip(I[0], D[0]) if code >= 0]
+
+    def stats(self):
+        with self.lock.read():
+            return {
+                "ready": self.ready,
+                "notes": int(self.index.ntotal),
+                "with_text": sum(1 for v in self.text_vectors.values() if v is not None),
+                "pending": self.pending(),
+                "text_weight": self.text_weight,
+            }
@@ -0,0 +1,70 @@
+# -*- coding: utf-8 -*-
+"""RemoteEncoder 按 max_batch_size 分批请求推理进程：整块文本的总耗时超过 timeout 也不会超时。"""
+import os
+import sys
+import threading
+import time
+from multiprocessing.connection import Listener
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import inference_server  # noqa: E402
+from encoder import InferenceError, RemoteEncoder  # noqa: E402
+
+AUTHKEY = b"test"
+SEC_PER_TEXT = 0.01
+
+
+class SlowEncoder:
+    """每条文本耗时 SEC_PER_TEXT 的假模型，向量第一维是文本本身（便于检查顺序）"""
+    model_name = "slow-fake"
+
+    def encode(self, texts):
+        time.sleep(SEC_PER_TEXT * len(texts))
+        vectors = np.zeros((len(texts), 4), dtype="float32")
+        vectors[:, 0] = [float(t) for t in texts]
+        return vectors
+
+    def stats(self):
+        return {}
+
+
+@pytest.fixture
+def address(tmp_path):
+    path = str(tmp_path / "embed.sock")
+    listener = Listener(path, family="AF_UNIX", authkey=AUTHKEY)
+
+    def serve():
+        while True:
+            try:
+                conn = listener.accept()
+            except OSError:
+                return
+            threading.Thread(target=inference_server.handle, args=(conn, SlowEncoder()), daemon=True).start()
+
+    threading.Thread(target=serve, daemon=True).start()
+    yield f"unix:{path}"
+    listener.close()
+
+
+def test_large_chunk_is_split_under_timeout(address):
+    texts = [str(i) for i in range(100)]     # 整块约 1s，每批 10 条约 0.1s
+    client = RemoteEncoder(address, authkey=AUTHKEY, timeout=0.5, max_batch_size=10)
+    vectors = client.encode(texts)
+    assert vectors.shape == (100, 4)
+    assert vectors[:, 0].tolist() == list(range(100))
+    assert client.stats()["client"]["calls"] == 10
+
+
+def test_unsplit_chunk_times_out(address):
+    client = RemoteEncoder(address, authkey=AUTHKEY, timeout=0.5, max_batch_size=1000)
+    with pytest.raises(InferenceError):
+        client.encode([str(i) for i in range(100)])
+
+
+def test_empty_input(address):
+    client = RemoteEncoder(address, authkey=AUTHKEY, timeout=0.5, max_batch_size=10)
+    assert client.encode([]).shape[0] == 0
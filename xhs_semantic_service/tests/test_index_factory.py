@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+"""index_factory.read_index 的 mmap 加载：没能映射时要报告出来，而不是悄悄整体读入内存。"""
+import os
+import sys
+
+import faiss
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import index_factory  # noqa: E402
+
+DIM = 32
+
+
+def _write(tmp_path, index_type):
+    idx = index_factory.create_index(DIM, index_type, expected_size=1000)
+    vecs = np.random.default_rng(0).standard_normal((1000, DIM)).astype("float32")
+    if not idx.is_trained:
+        idx.train(vecs)
+    idx.add(vecs)
+    path = str(tmp_path / f"{index_type}.index")
+    faiss.write_index(idx, path)
+    return path
+
+
+@pytest.mark.parametrize("index_type", ["flat", "ivf_flat", "hnsw"])
+def test_mmap_without_fallback(tmp_path, index_type):
+    if not index_factory.HAS_MMAP_IFC:
+        pytest.skip("faiss 不支持 IO_FLAG_MMAP_IFC")
+    fallbacks = []
+    idx = index_factory.read_index(_write(tmp_path, index_type), mmap=True, fallbacks=fallbacks)
+    assert idx.ntotal == 1000
+    assert fallbacks == []
+
+
+def test_fallback_reported_without_ifc(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_factory, "HAS_MMAP_IFC", False)
+    monkeypatch.setattr(index_factory, "MMAP_IO_FLAGS", faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+    fallbacks = []
+    index_factory.read_index(_write(tmp_path, "flat"), mmap=True, fallbacks=fallbacks)
+    # IVF 的倒排表不依赖 IO_FLAG_MMAP_IFC，仍然是映射的
+    index_factory.read_index(_write(tmp_path, "ivf_flat"), mmap=True, fallbacks=fallbacks)
+    assert len(fallbacks) == 1 and fallbacks[0].startswith("flat.index")
@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+"""LexicalIndex：稀疏累加的 BM25 与失效文档压缩。"""
+import math
+import os
+import random
+import sys
+from collections import Counter
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import lexical_index  # noqa: E402
+from lexical_index import BM25_B, BM25_K1, LexicalIndex, tokenize  # noqa: E402
+
+WORDS = ["面膜", "补水", "好用", "推荐", "敏感肌", "价格", "rtx-4090", "显卡", "散热", "回购"]
+
+
+def _texts(n, seed):
+    rng = random.Random(seed)
+    return [" ".join(rng.choices(WORDS, k=rng.randint(1, 6))) for _ in range(n)]
+
+
+def _brute_force(docs, query, k, mask=None):
+    """按定义对全部存活文档算 BM25"""
+    tokenized = {vid: tokenize(text) for vid, text in docs.items()}
+    n = len(tokenized)
+    avgdl = sum(len(t) for t in tokenized.values()) / n
+    scores = Counter()
+    for token, qtf in Counter(tokenize(query)).items():
+        df = sum(token in t for t in tokenized.values())
+        if not df:
+            continue
+        idf = math.log(1 + (n - df + 0.5) / (df + 0.5))
+        for vid, tokens in tokenized.items():
+            tf = tokens.count(token)
+            if tf and (mask is None or mask[vid]):
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * len(tokens) / avgdl)
+                scores[vid] += qtf * idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores.most_common(k)
+
+
+def _build(n=3000):
+    index, docs = LexicalIndex(), {}
+    texts = _texts(n, seed=0)
+    index.add(list(range(n)), texts)
+    docs.update(enumerate(texts))
+    # 替换前 1/3、删除中间 1/3：留下大量失效文档
+    replaced = _texts(n // 3, seed=1)
+    index.add(list(range(n // 3)), replaced)
+    docs.update(enumerate(replaced))
+    index.remove(list(range(n // 3, 2 * n // 3)))
+    for vid in range(n // 3, 2 * n // 3):
+        del docs[vid]
+    return index, docs
+
+
+def _assert_same(got, want):
+    # 词表很小，同分文档很多：比较全部命中文档的分数，以及返回顺序是否按分数降序
+    assert dict(got) == pytest.approx(dict(want), rel=1e-4)
+    assert [s for _, s in got] == sorted((s for _, s in got), reverse=True)
+
+
+@pytest.mark.parametrize("compact_ratio", [0.3, 2.0])
+def test_scores_match_brute_force(monkeypatch, compact_ratio):
+    monkeypatch.setattr(lexical_index, "LEXICAL_COMPACT_RATIO", compact_ratio)
+    index, docs = _build()
+    mask = np.zeros(3000, dtype=bool)
+    mask[::2] = True
+    for query in ["面膜补水", "rtx-4090 散热", "敏感肌 推荐 回购"]:
+        _assert_same(index.search(query, 3000), _brute_force(docs, query, 3000))
+        _assert_same(index.search(query, 3000, mask), _brute_force(docs, query, 3000, mask))
+        top = index.search(query, 20)
+        assert len(top) == 20 and top[-1][1] <= top[0][1]
+
+
+def test_compacts_when_dead_fraction_is_high(monkeypatch):
+    monkeypatch.setattr(lexical_index, "LEXICAL_COMPACT_RATIO", 0.3)
+    index, docs = _build()
+    stats = index.stats()
+    assert stats["docs"] == len(docs) == 2000
+    assert stats["dead_docs"] < 0.3 * (stats["docs"] + stats["dead_docs"])
+    assert all(index.doc_vid[doc] == vid for vid, doc in index.vid_doc.items())
+    # 压缩后继续写入、删除仍然正确
+    index.add([5000], ["独一无二 显卡"])
+    index.remove([0])
+    assert [vid for vid, _ in index.search("独一无二", 10)] == [5000]
+    assert 0 not in {vid for vid, _ in index.search(docs[0], 3000)}
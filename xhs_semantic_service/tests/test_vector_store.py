@@ -0,0 +1,76 @@
+# -*- coding: utf-8 -*-
+"""
+VectorStore 在不支持原地删除的索引（IVF / HNSW / PQ）上的墓碑处理：
+替换、删除之后搜索仍应返回满 top_k 条有效结果。
+"""
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vector_store import ReadOnlyVectorStore, VectorStore  # noqa: E402
+
+DIM = 64
+N = 2000
+TOP_K = 50
+
+
+def _vectors(n, seed):
+    vecs = np.random.default_rng(seed).standard_normal((n, DIM)).astype("float32")
+    return vecs / np.linalg.norm(vecs, axis=1, keepdims=True)
+
+
+def _build(index_type):
+    store = VectorStore.create(DIM, index_type=index_type, expected_size=N)
+    assert not store.supports_remove
+    vecs = _vectors(N, seed=0)
+    if not store.is_trained:
+        store.train(vecs)
+    store.add([f"c{i}" for i in range(N)], vecs)
+    # 前 300 条替换成新向量，接下来 300 条删除：都在索引里留下墓碑
+    store.add([f"c{i}" for i in range(300)], _vectors(300, seed=1))
+    assert store.remove([f"c{i}" for i in range(300, 600)]) == 300
+    return store
+
+
+def _search(store, queries):
+    # nprobe / efSearch 放到足够大，结果数只取决于墓碑有没有被排除
+    return store.search(queries, TOP_K, nprobe=4096, ef_search=512)
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw", "ivf_pq"])
+def test_search_fills_top_k_after_updates_and_deletes(index_type):
+    store = _build(index_type)
+    # 用被替换 / 删除的旧向量做查询，墓碑正好排在最前面
+    queries = _vectors(N, seed=0)[:600:20]
+    _, ids = _search(store, queries)
+    for row in ids:
+        assert len(row) == TOP_K
+        assert not {f"c{i}" for i in range(300, 600)} & set(row)
+
+
+@pytest.mark.parametrize("index_type", ["ivf_flat", "hnsw"])
+def test_tombstones_survive_snapshot_reload(tmp_path, index_type):
+    store = _build(index_type)
+    store.attach(str(tmp_path), 1, wal_fsync=False)
+    store.checkpoint()
+    queries = _vectors(N, seed=0)[:600:20]
+
+    reopened = VectorStore.open(str(tmp_path), DIM, wal_fsync=False)
+    assert reopened.dead_vids == store.dead_vids
+    replica = ReadOnlyVectorStore.open(str(tmp_path))
+    for loaded in (reopened, replica):
+        _, ids = _search(loaded, queries)
+        assert all(len(row) == TOP_K for row in ids)
+
+
+def test_compact_shard_clears_tombstones():
+    store = _build("ivf_flat")
+    assert len(store.dead_vids) == 600
+    store.compact_shard(next(iter(store.shards)))
+    assert not store.dead_vids
+    _, ids = _search(store, _vectors(N, seed=0)[:600:20])
+    assert all(len(row) == TOP_K for row in ids)
@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+"""
+评论主题聚类与关键词（离线批处理，结果落盘后由接口直接读取）。
+
+    聚类    球面 mini-batch k-means（Sculley 2010）：向量按批从 store 取回，
+            每批分配一次并按簇累计样本数衰减学习率更新质心，内存只与批大小有关；
+            跑 TOPIC_EPOCHS 轮后再完整分配一遍，得到每条评论的主题与到质心的相似度
+    关键词  在倒排索引上按主题统计词频，c-TF-IDF 打分：
+            tf(词, 主题) × log(1 + 平均每主题词数 / 词在全部主题的总频次)
+    落盘    DATA_DIR/topics.npz（临时文件 + rename）：质心、按主题分组并按相似度排序的评论 ID、
+            每个主题的摘要（大小 / 关键词 / 代表评论）；评论 ID 为键，重建索引后依然有效
+
+任务开始之后新写入的评论不在结果里，直到下一次运行。
+"""
+import io
+import json
+import os
+import time
+
+import faiss
+import numpy as np
+
+TOPICS_FILE = "topics.npz"
+TOPIC_CLUSTERS = int(os.environ.get("TOPIC_CLUSTERS", 50))
+TOPIC_BATCH_SIZE = int(os.environ.get("TOPIC_BATCH_SIZE", 10000))
+TOPIC_EPOCHS = int(os.environ.get("TOPIC_EPOCHS", 3))
+TOPIC_KEYWORDS = int(os.environ.get("TOPIC_KEYWORDS", 10))
+TOPIC_MIN_DF = int(os.environ.get("TOPIC_MIN_DF", 5))
+TOPIC_SAMPLES = 5  # 摘要里每个主题的代表评论数
+
+
+class MiniBatchKMeans:
+    """球面 mini-batch k-means；质心始终归一化，用内积分配"""
+
+    def __init__(self, k, dim, seed=0):
+        self.k = k
+        self.dim = dim
+        self.rng = np.random.default_rng(seed)
+        self.centroids = None
+        self.counts = np.zeros(k, dtype="int64")
+
+    def assign(self, x):
+        """返回 (簇号, 与质心的内积)"""
+        index = faiss.IndexFlatIP(self.dim)
+        index.add(self.centroids)
+        D, I = index.search(np.ascontiguousarray(x, dtype="float32"), 1)
+        return I[:, 0], D[:, 0]
+
+    def _reseed(self, dead, x):
+        self.centroids[dead] = x[self.rng.choice(len(x), size=len(dead), replace=len(x) < len(dead))]
+
+    def partial_fit(self, x):
+        if self.centroids is None:
+            self.centroids = np.zeros((self.k, self.dim), dtype="float32")
+            self._reseed(np.arange(self.k), x)
+        labels, _ = self.assign(x)
+        counts = np.bincount(labels, minlength=self.k)
+        sums = np.zeros((self.k, self.dim), dtype="float32")
+        np.add.at(sums, labels, x)
+        self.counts += counts
+        hit = counts > 0
+        self.centroids[hit] += (sums[hit] - counts[hit, None] * self.centroids[hit]) / self.counts[hit, None]
+        self.centroids /= np.maximum(np.linalg.norm(self.centroids, axis=1, keepdims=True), 1e-12)
+        # 至今没有分到样本的簇换成本批的随机样本，避免质心落在空旷处一直浪费
+        dead = np.flatnonzero(self.counts == 0)
+        if len(dead):
+            self._reseed(dead, x)
+
+
+def _batches(store, comment_ids, batch_size):
+    """按批取回向量，返回 (评论 ID 列表, 向量矩阵)；期间被删除的评论跳过"""
+    for start in range(0, len(comment_ids), batch_size):
+        vectors = store.reconstruct(comment_ids[start:start + batch_size])
+        if vectors:
+            yield list(vectors), np.stack(list(vectors.values())).astype("float32")
+
+
+def extract_keywords(lexical, labels, k, top_n=TOPIC_KEYWORDS, min_df=TOPIC_MIN_DF):
+    """labels 为按 vid 的主题号数组，返回每个主题的 [(关键词, 分数)]"""
+    terms, counts = lexical.term_counts(labels, k, min_df=min_df)
+    if not terms:
+        return [[] for _ in range(k)]
+    per_topic = counts.sum(axis=0)
+    tf = counts / np.maximum(per_topic, 1)
+    idf = np.log(1 + per_topic.mean() / np.maximum(counts.sum(axis=1), 1))
+    scores = tf * idf[:, None]
+    keywords = []
+    for topic in range(k):
+        column = scores[:, topic]
+        top = np.argsort(-column)[:top_n]
+        keywords.append([(terms[i], round(float(column[i]), 6)) for i in top if column[i] > 0])
+    return keywords
+
+
+def run_topics(store, lexical, dim, k=TOPIC_CLUSTERS, epochs=TOPIC_EPOCHS, batch_size=TOPIC_BATCH_SIZE,
+               progress=None):
+    """
+    对 store 中的全部向量聚类并提取关键词，返回 TopicResult；向量数少于 k 时返回 None。
+    progress(阶段, 已处理, 总数) 用于汇报进度。
+    """
+    started = time.time()
+    progress = progress or (lambda *args: None)
+    with store.lock.read():
+        comment_ids = list(store.cid_to_vid)
+    if len(comment_ids) < k:
+        return None
+    batch_size = max(batch_size, k)
+    model = MiniBatchKMeans(k, dim)
+    rng = np.random.default_rng(0)
+
+    for epoch in range(epochs):
+        order = [comment_ids[i] for i in rng.permutation(len(comment_ids))]
+        done = 0
+        for _, x in _batches(store, order, batch_size):
+            model.partial_fit(x)
+            done += len(x)
+            progress(f"train {epoch + 1}/{epochs}", done, len(order))
+
+    assigned_ids, labels, scores = [], [], []
+    done = 0
+    for cids, x in _batches(store, comment_ids, batch_size):
+        topic, score = model.assign(x)
+        assigned_ids.extend(cids)
+        labels.append(topic)
+        scores.append(score)
+        done += len(cids)
+        progress("assign", done, len(comment_ids))
+    labels = np.concatenate(labels).astype("int32")
+    scores = np.concatenate(scores).astype("float32")
+
+    progress("keywords", 0, k)
+    vids = np.fromiter((store.cid_to_vid.get(cid, -1) for cid in assigned_ids), dtype="int64",
+                       count=len(assigned_ids))
+    by_vid = np.full(int(vids.max()) + 1 if len(vids) else 0, -1, dtype="int32")
+    by_vid[vids[vids >= 0]] = labels[vids >= 0]
+    keywords = extract_keywords(lexical, by_vid, k)
+
+    # 按 (主题, 相似度降序) 排列，每个主题的评论是连续的一段
+    order = np.lexsort((-scores, labels))
+    comment_ids = np.asarray(assigned_ids)[order]
+    labels, scores = labels[order], scores[order]
+    offsets = np.searchsorted(labels, np.arange(k + 1))
+    topics = [{
+        "topic": topic,
+        "size": int(offsets[topic + 1] - offsets[topic]),
+        "keywords": keywords[topic],
+        "samples": comment_ids[offsets[topic]:offsets[topic] + TOPIC_SAMPLES].tolist(),
+    } for topic in range(k)]
+    summary = {
+        "generated_at": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "duration_sec": round(time.time() - started, 2),
+        "generation": store.generation,
+        "vectors": len(comment_ids),
+        "clusters": k,
+        "topics": topics,
+    }
+    return TopicResult(model.centroids, comment_ids, scores, offsets, summary)
+
+
+class TopicResult:
+    def __init__(self, centroids, comment_ids, scores, offsets, summary):
+        self.centroids = centroids
+        self.comment_ids = comment_ids
+        self.scores = scores
+        self.offsets = offsets
+        self.summary = summary
+
+    def __len__(self):
+        return len(self.summary["topics"])
+
+    def members(self, topic, offset=0, limit=20):
+        """主题内按与质心相似度排序的 [(comment_id, 相似度)]"""
+        start = int(self.offsets[topic]) + offset
+        end = min(start + limit, int(self.offsets[topic + 1]))
+        return [(str(cid), float(score)) for cid, score in zip(self.comment_ids[start:end], self.scores[start:end])]
+
+    def save(self, data_dir):
+        buf = io.BytesIO()
+        np.savez(buf, centroids=self.centroids, comment_ids=self.comment_ids, scores=self.scores,
+                 offsets=self.offsets, summary=np.frombuffer(json.dumps(self.summary).encode("utf-8"), "uint8"))
+        path = os.path.join(data_dir, TOPICS_FILE)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(buf.getvalue())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["comment_ids"], data["scores"], data["offsets"],
+                       json.loads(data["summary"].tobytes().decode("utf-8")))
@@ -0,0 +1,902 @@
+# -*- coding: utf-8 -*-
+"""
+向量存储：按分片划分的 FAISS IndexIDMap2 + 评论 ID ↔ int64 向量 ID（vid）映射。
+
+- 向量以稳定的 int64 vid 作为 FAISS 外部 ID，删除 / 重新编码不会导致位置错位；
+  vid 在所有分片间全局唯一，属性列 / 倒排索引等旁路索引不需要感知分片；
+- 分片（如按评论月份）各自是一个独立索引，新分片从已训练好的空模板索引克隆；
+  搜索时在线程池里并行查询各分片（FAISS 搜索期间释放 GIL）再合并 top-k，
+  限定分片或过滤条件在某分片没有命中时只查询相关分片；
+- 每次写入先追加到 WAL（含向量本身和分片名）并 fsync，之后才确认；
+- 定期做快照（每个分片一个索引文件 + npz 映射，临时文件 + rename），
+  上次快照之后没有变化的分片直接沿用已有文件，冷分片不会被反复序列化；
+  manifest.json 原子替换后才算提交，随后删除被覆盖的旧日志段；
+- 启动时加载 manifest 指向的快照，再回放同一代（generation）的日志尾部。
+
+/api/init 重建出的新 store 使用新的 generation，提交前旧一代的文件仍然完整有效。
+
+ReadOnlyVectorStore 以只读内存映射方式加载快照，供多个 worker 进程共享。
+"""
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import faiss
+import numpy as np
+
+import index_factory
+import wal
+
+MANIFEST_NAME = "manifest.json"
+DEFAULT_SHARD = "default"
+# 并行查询分片的线程数
+SHARD_SEARCH_THREADS = int(os.environ.get("SHARD_SEARCH_THREADS", min(8, os.cpu_count() or 1)))
+_INITIAL_CAPACITY = 1024
+
+# 进程内所有 store 提交 manifest 时互斥（重建期间新旧两代 store 并存）
+_manifest_lock = threading.Lock()
+
+# 分片搜索线程池，第一次用到时创建（gunicorn fork 之后）
+_search_pool = None
+_search_pool_lock = threading.Lock()
+
+
+class RWLock:
+    """简单的读写锁：允许多个读者并发，写者独占"""
+
+    def __init__(self):
+        self._cond = threading.Condition()
+        self._readers = 0
+        self._writer = False
+
+    def acquire_read(self):
+        with self._cond:
+            while self._writer:
+                self._cond.wait()
+            self._readers += 1
+
+    def release_read(self):
+        with self._cond:
+            self._readers -= 1
+            if self._readers == 0:
+                self._cond.notify_all()
+
+    def acquire_write(self):
+        with self._cond:
+            while self._writer or self._readers:
+                self._cond.wait()
+            self._writer = True
+
+    def release_write(self):
+        with self._cond:
+            self._writer = False
+            self._cond.notify_all()
+
+    def read(self):
+        return _Guard(self.acquire_read, self.release_read)
+
+    def write(self):
+        return _Guard(self.acquire_write, self.release_write)
+
+
+class _Guard:
+    def __init__(self, acquire, release):
+        self._acquire = acquire
+        self._release = release
+
+    def __enter__(self):
+        self._acquire()
+        return self
+
+    def __exit__(self, *exc):
+        self._release()
+        return False
+
+
+class VectorStore:
+    read_only = False
+
+    def __init__(self, template=None, shards=None, template_path=None):
+        """
+        template：空索引（需要训练的索引须先 train），新分片由它克隆；
+        shards：{分片名: 索引}，从快照 / 旧格式加载时传入；
+        template_path：快照里的模板文件，第一次用到时才读取。
+        """
+        self.shards = {name: _wrap(idx) for name, idx in (shards or {}).items()}
+        self._template = _wrap(template) if template is not None else None
+        self._template_path = template_path
+        self.lock = RWLock()
+        self.cid_to_vid = {}
+        self.vid_to_cid = {}
+        self.next_vid = 0
+        self.shard_names = []           # 分片编号 → 分片名
+        self.shard_codes = {}           # 分片名 → 分片编号
+        self.vid_shard = np.full(_INITIAL_CAPACITY, -1, dtype="int16")   # vid → 分片编号
+        for name in self.shards:
+            self._shard_code(name)
+        self.supports_remove = index_factory.supports_remove(self._probe_index())
+        # 不支持删除的索引里已作废的 vid（墓碑）：搜索时用 IDSelector 排除，compact_shard() 后清空
+        self.dead_vids = set()
+        # 以 mmap 方式加载时没能映射、整体读入内存的快照文件及原因（见 index_factory.read_index）
+        self.mmap_fallbacks = []
+
+        # 持久化状态：attach() 之前只存在于内存（如重建过程中）
+        self.data_dir = None
+        self.generation = 0
+        self.seq = 0            # 最后一条日志记录的序号
+        self.wal = None
+        self.wal_fsync = True
+        self._snapshot_lock = threading.Lock()
+        self._legacy_paths = ()
+        # 分片内容每变化一次版本 +1；快照文件记录写入时的版本，版本没变的分片沿用已有文件
+        self._shard_versions = {name: 0 for name in self.shards}
+        self._snapshot_files = {}       # 分片名 → (快照文件名, 版本)
+        self._template_file = None
+
+    # ---------- 构造 ----------
+    @classmethod
+    def create(cls, dim, index_type=None, expected_size=0):
+        return cls(template=index_factory.create_index(dim, index_type, expected_size))
+
+    @classmethod
+    def open(cls, data_dir, dim, wal_fsync=True):
+        """
+        从 data_dir 加载：manifest 指向的快照 + 同代日志回放。
+        没有 manifest 时尝试迁移旧格式，都没有则新建空索引。
+        """
+        manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+        if os.path.exists(manifest_path):
+            with open(manifest_path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+            store = cls._load_snapshot(data_dir, manifest)
+            replayed = store._replay(data_dir)
+            store.attach(data_dir, store.generation, wal_fsync)
+            store._cleanup(manifest)
+            print(f"✅ 已加载快照（{manifest['seq']}，{len(store.shards)} 个分片）"
+                  f"并回放 {replayed} 条日志，共 {len(store)} 条向量")
+            return store
+
+        store = cls._load_legacy(data_dir)
+        if store is None:
+            store = cls.create(dim)
+            print(f"🆕 创建新向量索引（余弦相似度，{index_factory.INDEX_TYPE}）")
+        store.attach(data_dir, 1, wal_fsync)
+        store.checkpoint()
+        return store
+
+    @classmethod
+    def _load_snapshot(cls, data_dir, manifest, mmap=False):
+        # 分片之前的快照只有一个 index_file，作为默认分片加载
+        files = manifest.get("shards") or {DEFAULT_SHARD: manifest["index_file"]}
+        fallbacks = []
+        shards = {name: index_factory.read_index(os.path.join(data_dir, file), mmap=mmap, fallbacks=fallbacks)
+                  for name, file in files.items()}
+        template_path = os.path.join(data_dir, manifest["template_file"]) if manifest.get("template_file") else None
+        store = cls(shards=shards, template_path=template_path)
+        store.mmap_fallbacks = fallbacks
+        if fallbacks:
+            print(f"⚠️ {len(fallbacks)}/{len(files)} 个分片未能内存映射，已整体读入内存：{fallbacks[0]}")
+        data = np.load(os.path.join(data_dir, manifest["map_file"]))
+        vids = data["vids"]
+        if "shard_names" in data.files:
+            remap = np.array([store._shard_code(name) for name in data["shard_names"].tolist()], dtype="int16")
+            codes = remap[data["vid_shards"]] if len(remap) else data["vid_shards"]
+        else:
+            codes = None
+        store._set_mapping(vids.tolist(), data["comment_ids"].tolist(), codes)
+        store.next_vid = int(data["next_vid"])
+        store.generation = int(manifest["generation"])
+        store.seq = int(manifest["seq"])
+        store._snapshot_files = {name: (file, 0) for name, file in files.items()}
+        store._template_file = manifest.get("template_file")
+        store._collect_dead_vids()
+        return store
+
+    @classmethod
+    def _load_legacy(cls, data_dir):
+        """
+        迁移旧格式：
+          - vector_store.faiss（普通索引）+ id_map.npy（位置即 ID，pickle）
+          - vector_store.faiss（IndexIDMap2）+ id_map.npz + id_map.journal
+        迁移后由 open() 写成新快照（单个默认分片），旧文件随即删除。
+        """
+        index_path = os.path.join(data_dir, "vector_store.faiss")
+        if not os.path.exists(index_path):
+            return None
+        legacy_paths = [index_path] + [os.path.join(data_dir, name)
+                                       for name in ("id_map.npy", "id_map.npz", "id_map.journal")]
+        index = faiss.read_index(index_path)
+        if isinstance(index, faiss.IndexIDMap2):
+            store = cls(shards={DEFAULT_SHARD: index})
+            data = np.load(legacy_paths[2])
+            store._set_mapping(data["vids"].tolist(), data["comment_ids"].tolist())
+            store.next_vid = int(data["next_vid"])
+            if os.path.exists(legacy_paths[3]):
+                store._replay_journal(legacy_paths[3])
+        else:
+            legacy_ids = np.load(legacy_paths[1], allow_pickle=True).tolist()
+            wrapped = faiss.IndexIDMap2(index)
+            vids = np.arange(index.ntotal, dtype="int64")
+            faiss.copy_array_to_vector(vids, wrapped.id_map)
+            wrapped.construct_rev_map()
+            store = cls(shards={DEFAULT_SHARD: wrapped})
+            store._set_mapping(vids[:len(legacy_ids)].tolist(), legacy_ids)
+            store.next_vid = int(index.ntotal)
+        store._legacy_paths = legacy_paths
+        store._collect_dead_vids()
+        print(f"🔁 已迁移旧版向量索引（{len(store)} 条）")
+        return store
+
+    def _set_mapping(self, vids, comment_ids, shard_codes=None):
+        """shard_codes 为每个 vid 的分片编号，省略时全部属于默认分片"""
+        self.cid_to_vid = dict(zip(comment_ids, vids))
+        self.vid_to_cid = dict(zip(vids, comment_ids))
+        if not vids:
+            return
+        if shard_codes is None:
+            shard_codes = self._shard_code(DEFAULT_SHARD)
+        self._set_vid_shard(np.asarray(vids, dtype="int64"), shard_codes)
+
+    def _collect_dead_vids(self):
+        """加载后找出分片里有、映射里没有的 vid（之前作废、尚未压缩掉的墓碑）"""
+        for idx in self.shards.values():
+            ids = faiss.vector_to_array(idx.id_map)
+            ids = ids[~np.isin(ids, self._base_vids())]
+            self.dead_vids.update(ids.tolist())
+
+    def _alive_selector(self, sel):
+        """在 sel 之外再排除墓碑；没有墓碑时原样返回"""
+        if not self.dead_vids:
+            return sel
+        alive = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(self.dead_vids, dtype="int64")))
+        return alive if sel is None else faiss.IDSelectorAnd(alive, sel)
+
+    def _replay_journal(self, path):
+        default_code = self._shard_code(DEFAULT_SHARD)
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                parts = line.rstrip("\n").split("\t")
+                if parts[0] == "+" and len(parts) == 3:
+                    vid, cid = int(parts[1]), parts[2]
+                    self.cid_to_vid[cid] = vid
+                    self.vid_to_cid[vid] = cid
+                    self.next_vid = max(self.next_vid, vid + 1)
+                    self._set_vid_shard(np.asarray([vid], dtype="int64"), default_code)
+                elif parts[0] == "-" and len(parts) >= 2:
+                    cid = self.vid_to_cid.pop(int(parts[1]), None)
+                    if cid is not None and self.cid_to_vid.get(cid) == int(parts[1]):
+                        del self.cid_to_vid[cid]
+
+    # ---------- 分片 ----------
+    @property
+    def template(self):
+        """新分片的模板：快照里单独保存的空索引；旧快照没有时从已有分片克隆后清空"""
+        if self._template is None:
+            if self._template_path is not None:
+                self._template = _wrap(index_factory.read_index(self._template_path))
+            else:
+                self._template = faiss.clone_index(next(iter(self.shards.values())))
+                self._template.reset()
+        return self._template
+
+    def _probe_index(self):
+        """用来判断索引类型 / 参数的代表索引"""
+        if self._template is None and self.shards:
+            return next(iter(self.shards.values()))
+        return self.template
+
+    def _shard_code(self, name):
+        code = self.shard_codes.get(name)
+        if code is None:
+            code = self.shard_codes[name] = len(self.shard_names)
+            self.shard_names.append(name)
+        return code
+
+    def _shard(self, name):
+        """取分片，不存在时从模板克隆一个空分片"""
+        idx = self.shards.get(name)
+        if idx is None:
+            idx = self.shards[name] = faiss.clone_index(self.template)
+            self._shard_versions[name] = 0
+            self._shard_code(name)
+        return idx
+
+    def _set_vid_shard(self, vids, codes):
+        need = int(vids.max()) + 1
+        if need > len(self.vid_shard):
+            grown = np.full(max(need, len(self.vid_shard) * 2), -1, dtype="int16")
+            grown[:len(self.vid_shard)] = self.vid_shard
+            self.vid_shard = grown
+        self.vid_shard[vids] = codes
+
+    def _base_vids(self):
+        """存放在分片索引里的有效 vid"""
+        return np.fromiter(self.vid_to_cid.keys(), dtype="int64", count=len(self.vid_to_cid))
+
+    def train(self, sample):
+        """训练模板索引；之后创建的分片都是训练好的"""
+        self.template.train(sample)
+
+    # ---------- 日志回放 ----------
+    def _replay(self, data_dir, touched=None):
+        """回放本代中 seq 大于当前 seq 的日志记录，返回回放条数；touched 收集涉及的 comment_id"""
+        replayed = 0
+        segments = wal.list_segments(data_dir, self.generation)
+        for i, (_, _, path) in enumerate(segments):
+            reader = wal.SegmentReader(path)
+            adds = []
+            for op, seq, vid, cid, vector, shard in reader.records():
+                if seq <= self.seq:
+                    continue
+                if touched is not None:
+                    touched.append(cid)
+                if op == wal.OP_ADD:
+                    adds.append((cid, vid, vector, shard or DEFAULT_SHARD))
+                    if len(adds) >= 1024:
+                        self._replay_adds(adds)
+                else:
+                    self._replay_adds(adds)
+                    self._apply_remove([vid])
+                self.seq = seq
+                replayed += 1
+            self._replay_adds(adds)
+
+            if reader.corrupted and not self.read_only:
+                if i == len(segments) - 1:
+                    # 最后一段的尾部是崩溃时写了一半的记录，从未被确认，直接截断
+                    print(f"⚠️ 截断日志尾部不完整记录：{path}")
+                    with open(path, "r+b") as f:
+                        f.truncate(reader.valid_size)
+                else:
+                    raise RuntimeError(f"日志段损坏：{path}")
+        return replayed
+
+    def _replay_adds(self, adds):
+        if not adds:
+            return
+        self._apply_add([a[0] for a in adds], [a[1] for a in adds], np.stack([a[2] for a in adds]),
+                        [a[3] for a in adds])
+        adds.clear()
+
+    # ---------- 快照 ----------
+    def attach(self, data_dir, generation, wal_fsync=True):
+        """绑定数据目录和代号；日志段在第一次快照时开启"""
+        self.data_dir = data_dir
+        self.generation = generation
+        self.wal_fsync = wal_fsync
+        if self.wal is None:
+            self.wal = wal.WriteAheadLog(data_dir, generation, self.seq + 1, fsync=wal_fsync)
+
+    def prepare_snapshot(self):
+        """
+        第一阶段：在读锁内切换日志段并复制有变化的分片 / 映射，锁外写文件。
+        返回的快照信息需要 commit_snapshot() 之后才生效；store 已关闭时返回 None。
+        """
+        with self.lock.read():
+            if self.wal is None:
+                return None
+            seq = self.seq
+            self.wal.rotate(seq + 1)
+            versions = dict(self._shard_versions)
+            changed = {name: faiss.serialize_index(idx) for name, idx in self.shards.items()
+                       if self._snapshot_files.get(name, (None, -1))[1] != versions[name]}
+            template_bytes = faiss.serialize_index(self.template) if self._template_file is None else None
+            vids = np.fromiter(self.vid_to_cid.keys(), dtype="int64", count=len(self.vid_to_cid))
+            cids = np.array(list(self.vid_to_cid.values()), dtype="U")
+            vid_shards = self.vid_shard[vids] if len(vids) else np.zeros(0, dtype="int16")
+            shard_names = np.array(self.shard_names, dtype="U")
+            next_vid = self.next_vid
+
+        base = f"snapshot-{self.generation:06d}-{seq:016d}"
+        files = {name: file for name, (file, _) in self._snapshot_files.items() if name in versions}
+        # 序列化结果直接按 memoryview 写出（不再 tobytes() 复制一份），写完一个分片就释放一个
+        while changed:
+            name, index_bytes = changed.popitem()
+            files[name] = f"{base}-shard-{name}.faiss"
+            _write_atomic(os.path.join(self.data_dir, files[name]), memoryview(index_bytes))
+            del index_bytes
+        template_file = self._template_file
+        if template_bytes is not None:
+            template_file = base + "-template.faiss"
+            _write_atomic(os.path.join(self.data_dir, template_file), memoryview(template_bytes))
+        map_file = base + ".npz"
+        tmp_map = os.path.join(self.data_dir, map_file + ".tmp")
+        with open(tmp_map, "wb") as f:
+            np.savez(f, vids=vids, comment_ids=cids, next_vid=np.int64(next_vid),
+                     vid_shards=vid_shards, shard_names=shard_names)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_map, os.path.join(self.data_dir, map_file))
+        return {
+            "generation": self.generation,
+            "seq": seq,
+            "shards": files,
+            "template_file": template_file,
+            "map_file": map_file,
+            "wal_first_seq": seq + 1,
+            "created_at": time.time(),
+            "_versions": versions,
+        }
+
+    def commit_snapshot(self, snapshot):
+        """
+        第二阶段：原子替换 manifest，然后清理被覆盖的快照和日志段。
+        磁盘上已经是更新一代的 manifest 时（本 store 已被重建替换）放弃提交，返回 False。
+        """
+        manifest_path = os.path.join(self.data_dir, MANIFEST_NAME)
+        manifest = {key: value for key, value in snapshot.items() if not key.startswith("_")}
+        with _manifest_lock:
+            if os.path.exists(manifest_path):
+                with open(manifest_path, "r", encoding="utf-8") as f:
+                    if json.load(f)["generation"] > snapshot["generation"]:
+                        return False
+            payload = json.dumps(manifest, ensure_ascii=False, indent=2).encode("utf-8")
+            _write_atomic(manifest_path, payload)
+            versions = snapshot["_versions"]
+            self._snapshot_files = {name: (file, versions[name]) for name, file in snapshot["shards"].items()}
+            self._template_file = snapshot["template_file"]
+            self._cleanup(manifest)
+        return True
+
+    def checkpoint(self):
+        """写一次完整快照，返回快照信息；store 已关闭或已被新一代替换时返回 None"""
+        with self._snapshot_lock:
+            snapshot = self.prepare_snapshot()
+            if snapshot is None or not self.commit_snapshot(snapshot):
+                return None
+        return snapshot
+
+    def _cleanup(self, manifest):
+        """
+        删除 manifest 未引用的快照，以及已被快照覆盖或属于其它代的日志段。
+        更新一代的快照文件不动（重建中的新 store 可能已经写好、尚未提交）。
+        """
+        keep_files = {manifest["map_file"], manifest.get("template_file"), manifest.get("index_file"),
+                      *(manifest.get("shards") or {}).values()}
+        for gen, first_seq, path in wal.list_segments(self.data_dir):
+            if gen != manifest["generation"] or first_seq < manifest["wal_first_seq"]:
+                if self.wal is None or path != self.wal.path:
+                    os.remove(path)
+        for name in os.listdir(self.data_dir):
+            if name.startswith("snapshot-") and name not in keep_files \
+                    and _snapshot_generation(name) <= manifest["generation"]:
+                os.remove(os.path.join(self.data_dir, name))
+        for path in self._legacy_paths:
+            if os.path.exists(path):
+                os.remove(path)
+        self._legacy_paths = ()
+
+    def close(self):
+        with self.lock.write():
+            if self.wal is not None:
+                self.wal.close()
+                self.wal = None
+
+    # ---------- 读写 ----------
+    @property
+    def ntotal(self):
+        return sum(idx.ntotal for idx in self.shards.values())
+
+    @property
+    def is_trained(self):
+        return self._probe_index().is_trained
+
+    def __len__(self):
+        return len(self.cid_to_vid)
+
+    def __contains__(self, comment_id):
+        return comment_id in self.cid_to_vid
+
+    def _remove_vids(self, vids):
+        """
+        从各自的分片中删除 vid。HNSW / IVF / 精排索引不支持删除时只删除映射（墓碑），
+        搜索时遇到无映射的 vid 会被跳过，compact_shard() 时清理。
+        """
+        if not vids:
+            return
+        if not self.supports_remove:
+            self.dead_vids.update(int(vid) for vid in vids)
+            return
+        vids = np.asarray(vids, dtype="int64")
+        codes = self.vid_shard[vids]
+        for code in np.unique(codes):
+            if code < 0:
+                continue
+            name = self.shard_names[code]
+            self.shards[name].remove_ids(vids[codes == code])
+            self._shard_versions[name] += 1
+
+    def _apply_add(self, comment_ids, vids, vectors, shards):
+        """按给定 vid 和分片写入（写入路径和日志回放共用）"""
+        replace, stale = [], []
+        for cid, vid in zip(comment_ids, vids):
+            old = self.cid_to_vid.get(cid)
+            if old == vid:
+                replace.append(vid)
+            elif old is not None:
+                stale.append(old)
+                self.vid_to_cid.pop(old, None)
+        self._remove_vids(replace + stale)
+        for cid, vid in zip(comment_ids, vids):
+            self.cid_to_vid[cid] = vid
+            self.vid_to_cid[vid] = cid
+            self.next_vid = max(self.next_vid, vid + 1)
+        vids = np.asarray(vids, dtype="int64")
+        vectors = np.asarray(vectors, dtype="float32")
+        shards = np.asarray(shards)
+        for name in dict.fromkeys(shards.tolist()):
+            pick = shards == name
+            self._shard(name).add_with_ids(vectors[pick], vids[pick])
+            self._set_vid_shard(vids[pick], self.shard_codes[name])
+            self._shard_versions[name] += 1
+
+    def _apply_remove(self, vids):
+        vids = [vid for vid in vids if vid in self.vid_to_cid]
+        self._remove_vids(vids)
+        for vid in vids:
+            del self.cid_to_vid[self.vid_to_cid.pop(vid)]
+        return vids
+
+    def _log(self, records):
+        if self.wal is not None:
+            self.wal.append(records)
+
+    def add(self, comment_ids, vectors, shards=None):
+        """
+        写入向量，日志落盘后返回 vid 列表。shards 为每条向量的分片名，省略时写入默认分片。
+        已存在的 comment_id 会被替换（可能换到另一个分片）：
+        支持删除的索引原地复用 vid，否则旧 vid 作废并分配新 vid。
+        """
+        vectors = np.asarray(vectors, dtype="float32")
+        shards = list(shards) if shards is not None else [DEFAULT_SHARD] * len(comment_ids)
+        with self.lock.write():
+            vids = []
+            for cid in comment_ids:
+                old = self.cid_to_vid.get(cid)
+                if old is not None and self.supports_remove:
+                    vids.append(old)
+                else:
+                    vids.append(self.next_vid)
+                    self.next_vid += 1
+            self._apply_add(comment_ids, vids, vectors, shards)
+
+            records = []
+            for cid, vid, vector, shard in zip(comment_ids, vids, vectors, shards):
+                self.seq += 1
+                records.append(wal.encode_record(wal.OP_ADD, self.seq, vid, cid, vector,
+                                                 shard=None if shard == DEFAULT_SHARD else shard))
+            self._log(records)
+        return vids
+
+    def remove(self, comment_ids):
+        """删除评论向量，日志落盘后返回实际删除的条数"""
+        with self.lock.write():
+            pairs = [(cid, self.cid_to_vid[cid]) for cid in dict.fromkeys(comment_ids) if cid in self.cid_to_vid]
+            self._apply_remove([vid for _, vid in pairs])
+            records = []
+            for cid, vid in pairs:
+                self.seq += 1
+                records.append(wal.encode_record(wal.OP_DEL, self.seq, vid, cid))
+            self._log(records)
+        return len(pairs)
+
+    def _mask_counts(self, mask):
+        """过滤位图在各分片的命中数 {分片名: 条数}"""
+        vids = np.flatnonzero(mask)
+        codes = self.vid_shard[vids[vids < len(self.vid_shard)]]
+        counts = np.bincount(codes[codes >= 0], minlength=len(self.shard_names))
+        return {name: int(counts[code]) for code, name in enumerate(self.shard_names)}
+
+    def shard_mask(self, shards):
+        """属于给定分片的 vid 布尔数组（用于让词法检索等旁路索引同样只看这些分片）"""
+        with self.lock.read():
+            codes = [self.shard_codes[name] for name in shards if name in self.shard_codes]
+            return np.isin(self.vid_shard, codes)
+
+    def _search_targets(self, shards, mask, nprobe, ef_search, sel):
+        """
+        需要查询的 [(分片索引, 搜索参数)]。mask 为构造 sel 的按 vid 布尔数组：
+        按分片计算命中比例（IVF / HNSW 据此放大 nprobe / efSearch），没有命中的分片不查。
+        """
+        names = list(self.shards) if shards is None else [name for name in shards if name in self.shards]
+        hits = self._mask_counts(mask) if mask is not None else None
+        targets = []
+        for name in names:
+            idx = self.shards[name]
+            if idx.ntotal == 0:
+                continue
+            selectivity = 1.0
+            if hits is not None:
+                if not hits.get(name):
+                    continue
+                selectivity = min(1.0, hits[name] / idx.ntotal)
+            targets.append((idx, index_factory.search_params(idx, nprobe=nprobe, ef_search=ef_search,
+                                                             sel=sel, selectivity=selectivity)))
+        return targets
+
+    def search(self, q_vecs, k, nprobe=None, ef_search=None, sel=None, mask=None, shards=None):
+        """
+        返回 (D, comment_ids)：comment_ids 为每个查询的评论 ID 列表，
+        已删除 / 无映射的结果会被跳过，D 与之一一对应。
+        sel 为按 vid 过滤的 faiss.IDSelector，mask 为构造它的按 vid 布尔数组；
+        shards 限定只查询这些分片（None 表示全部）。
+        """
+        with self.lock.read():
+            # 墓碑在索引里排除，而不是搜出来后再丢掉，否则结果会少于 k 条
+            targets = self._search_targets(shards, mask, nprobe, ef_search, self._alive_selector(sel))
+            D, I = _search_all(q_vecs, k, targets)
+            return self._to_comment_ids(D, I)
+
+    def reconstruct(self, comment_ids):
+        """
+        取回评论的（可能已量化的）向量，返回 {comment_id: 向量}，不存在的跳过。
+        IVF 没有 vid → 倒排位置的映射，第一次调用时建立 direct map，之后随写入自动维护。
+        """
+        self._ensure_direct_map()
+        with self.lock.read():
+            return {cid: self._reconstruct_vid(self.cid_to_vid[cid])
+                    for cid in comment_ids if cid in self.cid_to_vid}
+
+    def _reconstruct_vid(self, vid):
+        return self.shards[self.shard_names[self.vid_shard[vid]]].reconstruct(int(vid))
+
+    def _ensure_direct_map(self):
+        missing = [ivf for ivf in map(_ivf_without_direct_map, list(self.shards.values())) if ivf is not None]
+        if not missing:
+            return
+        with self.lock.write():
+            for ivf in missing:
+                if ivf.direct_map.type == faiss.DirectMap.NoMap:
+                    ivf.set_direct_map_type(faiss.DirectMap.Hashtable)
+
+    def compact_shard(self, name):
+        """
+        重建一个分片，清理不支持删除的索引（IVF / HNSW / 精排）里累积的墓碑向量。
+        vid 与向量都不变，不写日志；期间该分片有写入时放弃，返回 None。
+        """
+        self._ensure_direct_map()
+        with self.lock.read():
+            shard = self.shards.get(name)
+            if shard is None:
+                return None
+            version = self._shard_versions[name]
+            vids = self._base_vids()
+            vids = vids[self.vid_shard[vids] == self.shard_codes[name]]
+            vectors = shard.reconstruct_batch(vids) if len(vids) else None
+            before = shard.ntotal
+        fresh = faiss.clone_index(self.template)
+        if vectors is not None:
+            fresh.add_with_ids(vectors, vids)
+        with self.lock.write():
+            if self.shards.get(name) is not shard or self._shard_versions[name] != version:
+                return None
+            self.shards[name] = fresh
+            self._shard_versions[name] += 1
+            self.dead_vids.difference_update(faiss.vector_to_array(shard.id_map).tolist())
+        return {"shard": name, "before": before, "after": int(fresh.ntotal)}
+
+    def shard_stats(self):
+        """各分片的向量数 / 有效数 / 墓碑数，以及自上次快照以来是否有变化"""
+        with self.lock.read():
+            vids = self._base_vids()
+            codes = self.vid_shard[vids]
+            alive = np.bincount(codes[codes >= 0], minlength=len(self.shard_names))
+            stats = []
+            for name, idx in self.shards.items():
+                n_alive = int(alive[self.shard_codes[name]])
+                stats.append({
+                    "name": name,
+                    "ntotal": int(idx.ntotal),
+                    "alive": n_alive,
+                    "dead": int(idx.ntotal) - n_alive,
+                    "dirty": self._snapshot_files.get(name, (None, -1))[1] != self._shard_versions[name],
+                })
+        return sorted(stats, key=lambda s: s["name"])
+
+    def describe(self):
+        """索引类型与参数（来自模板 / 任一分片），以及总量和分片数"""
+        info = index_factory.describe(self._probe_index())
+        info.update(ntotal=int(self.ntotal), is_trained=bool(self.is_trained), shards=len(self.shards))
+        return info
+
+    def _to_comment_ids(self, D, I):
+        scores, ids = [], []
+        for row_d, row_i in zip(D, I):
+            row_scores, row_ids = [], []
+            for score, vid in zip(row_d, row_i):
+                cid = self.vid_to_cid.get(int(vid)) if vid >= 0 else None
+                if cid is None:
+                    continue
+                row_scores.append(float(score))
+                row_ids.append(cid)
+            scores.append(row_scores)
+            ids.append(row_ids)
+        return scores, ids
+
+
+class ReadOnlyVectorStore(VectorStore):
+    """
+    只读副本：各分片快照以只读内存映射方式加载，多个 worker 进程共享同一份页缓存；
+    快照之后的日志记录回放到一个很小的内存 delta 索引（flat，不分片），
+    被替换 / 删除的快照内向量记为墓碑，搜索时用 IDSelector 排除。
+    """
+    read_only = True
+
+    def __init__(self, template=None, shards=None, template_path=None):
+        super().__init__(template, shards, template_path)
+        self.delta = faiss.IndexIDMap2(faiss.IndexFlatIP(self._probe_index().d))
+        self.delta_vids = set()
+        self.tombstones = set()
+        self.snapshot_seq = 0   # 加载的快照对应的 seq，用于判断写入节点是否提交了新快照
+
+    @classmethod
+    def open(cls, data_dir, dim=None, wal_fsync=True):
+        manifest_path = os.path.join(data_dir, MANIFEST_NAME)
+        with open(manifest_path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+        store = cls._load_snapshot(data_dir, manifest, mmap=True)
+        store.tombstones |= store.dead_vids
+        store.data_dir = data_dir
+        store.snapshot_seq = store.seq
+        replayed = store._replay(data_dir)
+        print(f"✅ 只读加载快照（{manifest['seq']}，{len(store.shards)} 个分片）"
+              f"并回放 {replayed} 条日志，共 {len(store)} 条向量")
+        return store
+
+    def catch_up(self):
+        """
+        回放写入节点在打开之后追加的日志，返回涉及的 comment_id 列表。
+        写入节点已提交了新快照（旧日志段可能已被删除）时返回 None，调用方需要重新 open。
+        """
+        if self._snapshot_changed():
+            return None
+        touched = []
+        with self.lock.write():
+            self._replay(self.data_dir, touched)
+        # 回放期间新快照提交并删掉了旧日志段时，可能漏读记录
+        if self._snapshot_changed():
+            return None
+        return touched
+
+    def _snapshot_changed(self):
+        try:
+            with open(os.path.join(self.data_dir, MANIFEST_NAME), "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return False
+        return (int(manifest["generation"]), int(manifest["seq"])) != (self.generation, self.snapshot_seq)
+
+    @property
+    def ntotal(self):
+        return super().ntotal + self.delta.ntotal
+
+    def _base_vids(self):
+        vids = super()._base_vids()
+        if self.delta_vids:
+            vids = vids[~np.isin(vids, np.fromiter(self.delta_vids, dtype="int64"))]
+        return vids
+
+    def _drop(self, vid):
+        if vid in self.delta_vids:
+            self.delta.remove_ids(np.asarray([vid], dtype="int64"))
+            self.delta_vids.discard(vid)
+        else:
+            self.tombstones.add(vid)
+
+    def _apply_add(self, comment_ids, vids, vectors, shards):
+        for cid, vid in zip(comment_ids, vids):
+            old = self.cid_to_vid.get(cid)
+            if old is not None:
+                self._drop(old)
+                self.vid_to_cid.pop(old, None)
+            self.cid_to_vid[cid] = vid
+            self.vid_to_cid[vid] = cid
+            self.next_vid = max(self.next_vid, vid + 1)
+        vids = np.asarray(vids, dtype="int64")
+        self._set_vid_shard(vids, np.array([self._shard_code(name) for name in shards], dtype="int16"))
+        self.delta.add_with_ids(np.asarray(vectors, dtype="float32"), vids)
+        self.delta_vids.update(vids.tolist())
+
+    def _apply_remove(self, vids):
+        vids = [vid for vid in vids if vid in self.vid_to_cid]
+        for vid in vids:
+            self._drop(vid)
+            del self.cid_to_vid[self.vid_to_cid.pop(vid)]
+        return vids
+
+    def add(self, comment_ids, vectors, shards=None):
+        raise RuntimeError("只读副本不支持写入")
+
+    def remove(self, comment_ids):
+        raise RuntimeError("只读副本不支持删除")
+
+    def checkpoint(self):
+        return None
+
+    def compact_shard(self, name):
+        raise RuntimeError("只读副本不支持压缩分片")
+
+    def _reconstruct_vid(self, vid):
+        if vid in self.delta_vids:
+            return self.delta.reconstruct(int(vid))
+        return super()._reconstruct_vid(vid)
+
+    def search(self, q_vecs, k, nprobe=None, ef_search=None, sel=None, mask=None, shards=None):
+        with self.lock.read():
+            # 墓碑只作用于快照分片；同一 vid 被原地替换时新向量在 delta 里，不能被排除
+            base_sel = sel
+            if self.tombstones:
+                alive = faiss.IDSelectorNot(faiss.IDSelectorBatch(np.fromiter(self.tombstones, dtype="int64")))
+                base_sel = alive if sel is None else faiss.IDSelectorAnd(alive, sel)
+            targets = self._search_targets(shards, mask, nprobe, ef_search, base_sel)
+            delta_sel = sel
+            if self.delta.ntotal and shards is not None:
+                # delta 不分片：限定分片时只保留属于这些分片的 delta 向量
+                delta_vids = np.fromiter(self.delta_vids, dtype="int64", count=len(self.delta_vids))
+                codes = [self.shard_codes[name] for name in shards if name in self.shard_codes]
+                delta_vids = delta_vids[np.isin(self.vid_shard[delta_vids], codes)]
+                scope = faiss.IDSelectorBatch(delta_vids) if len(delta_vids) else None
+                delta_sel = scope if sel is None or scope is None else faiss.IDSelectorAnd(scope, sel)
+            if self.delta.ntotal and (shards is None or delta_sel is not None):
+                targets.append((self.delta, index_factory.search_params(self.delta, sel=delta_sel)))
+            D, I = _search_all(q_vecs, k, targets)
+            return self._to_comment_ids(D, I)
+
+
+def _wrap(index):
+    return index if isinstance(index, faiss.IndexIDMap2) else faiss.IndexIDMap2(index)
+
+
+def _ivf_without_direct_map(idx):
+    refine, inner = index_factory.unwrap_refine(idx)
+    ivf = faiss.try_extract_index_ivf(inner) if refine is None else None
+    if ivf is None or ivf.direct_map.type != faiss.DirectMap.NoMap:
+        return None
+    return ivf
+
+
+def _snapshot_generation(name):
+    """snapshot-{generation}-... → generation；无法解析时返回 0"""
+    try:
+        return int(name.split("-")[1])
+    except (IndexError, ValueError):
+        return 0
+
+
+def _get_search_pool():
+    global _search_pool
+    with _search_pool_lock:
+        if _search_pool is None:
+            _search_pool = ThreadPoolExecutor(SHARD_SEARCH_THREADS, thread_name_prefix="shard-search")
+        return _search_pool
+
+
+def _search_all(q_vecs, k, targets):
+    """在 [(索引, 搜索参数)] 上搜索并合并 top-k；多个分片时在线程池里并行"""
+    if not targets:
+        return np.zeros((len(q_vecs), 0), dtype="float32"), np.zeros((len(q_vecs), 0), dtype="int64")
+    if len(targets) == 1:
+        idx, params = targets[0]
+        return idx.search(q_vecs, k, params=params)
+    results = list(_get_search_pool().map(lambda target: target[0].search(q_vecs, k, params=target[1]), targets))
+    return _merge_topk(results, k)
+
+
+def _merge_topk(results, k):
+    """合并多路内积搜索结果 [(D, I)]（分数越大越好），每行保留前 k 个"""
+    D = np.concatenate([D for D, _ in results], axis=1)
+    I = np.concatenate([I for _, I in results], axis=1)
+    order = np.argsort(-D, axis=1, kind="stable")[:, :k]
+    return np.take_along_axis(D, order, axis=1), np.take_along_axis(I, order, axis=1)
+
+
+def _write_atomic(path, data):
+    """写临时文件 → fsync → rename"""
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
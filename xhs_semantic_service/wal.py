@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""
+向量追加日志（WAL）。
+
+每条记录：
+    [payload 长度 uint32][crc32 uint32][payload]
+    payload = op uint8 | seq uint64 | vid int64 | cid 长度 uint16 | cid utf-8
+              [| 分片名长度 uint8 | 分片名 utf-8]（仅 ADD_SHARDED）| 向量 float32 * dim（仅 ADD / ADD_SHARDED）
+
+写入默认分片时仍使用 ADD，与分片之前的日志格式兼容。
+
+日志按段存储：wal-{generation}-{起始 seq}.log。做快照时切换到新段，
+快照提交后删除已被快照覆盖的旧段。启动时回放快照之后的记录；
+最后一段末尾若有写了一半的记录（崩溃时未确认的写入），会被截断。
+"""
+import os
+import re
+import struct
+import zlib
+
+import numpy as np
+
+OP_ADD = 1
+OP_DEL = 2
+OP_ADD_SHARDED = 3
+
+_HEADER = struct.Struct("<II")
+_FIXED = struct.Struct("<BQqH")
+_SEGMENT_RE = re.compile(r"^wal-(\d+)-(\d+)\.log$")
+
+
+def segment_name(generation, first_seq):
+    return f"wal-{generation:06d}-{first_seq:016d}.log"
+
+
+def list_segments(data_dir, generation=None):
+    """返回 [(generation, first_seq, path)]，按 (generation, first_seq) 排序"""
+    segments = []
+    for name in os.listdir(data_dir):
+        m = _SEGMENT_RE.match(name)
+        if not m:
+            continue
+        gen, first_seq = int(m.group(1)), int(m.group(2))
+        if generation is None or gen == generation:
+            segments.append((gen, first_seq, os.path.join(data_dir, name)))
+    return sorted(segments)
+
+
+def encode_record(op, seq, vid, comment_id, vector=None, shard=None):
+    cid = comment_id.encode("utf-8")
+    if op == OP_ADD and shard:
+        op = OP_ADD_SHARDED
+    payload = _FIXED.pack(op, seq, vid, len(cid)) + cid
+    if op == OP_ADD_SHARDED:
+        name = shard.encode("utf-8")
+        payload += bytes([len(name)]) + name
+    if vector is not None:
+        payload += np.ascontiguousarray(vector, dtype="float32").tobytes()
+    return _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+class SegmentReader:
+    """
+    逐条读取一个日志段。遇到不完整或校验失败的记录即停止，
+    此时 corrupted 为 True，valid_size 为最后一条完整记录的结束位置。
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.valid_size = 0
+        self.corrupted = False
+
+    def records(self):
+        """生成 (op, seq, vid, comment_id, vector 或 None, 分片名或 None)；ADD_SHARDED 统一报告为 ADD"""
+        with open(self.path, "rb") as f:
+            data = f.read()
+        offset = 0
+        while offset + _HEADER.size <= len(data):
+            length, crc = _HEADER.unpack_from(data, offset)
+            start = offset + _HEADER.size
+            payload = data[start:start + length]
+            if len(payload) < length or zlib.crc32(payload) != crc:
+                self.corrupted = True
+                return
+            op, seq, vid, cid_len = _FIXED.unpack_from(payload)
+            cid_end = _FIXED.size + cid_len
+            comment_id = payload[_FIXED.size:cid_end].decode("utf-8")
+            shard = None
+            if op == OP_ADD_SHARDED:
+                name_end = cid_end + 1 + payload[cid_end]
+                shard = payload[cid_end + 1:name_end].decode("utf-8")
+                op, cid_end = OP_ADD, name_end
+            vector = np.frombuffer(payload, dtype="float32", offset=cid_end) if op == OP_ADD else None
+            offset = start + length
+            self.valid_size = offset
+            yield op, seq, vid, comment_id, vector, shard
+        if offset != len(data):
+            self.corrupted = True
+
+
+class WriteAheadLog:
+    def __init__(self, data_dir, generation, first_seq, fsync=True):
+        self.data_dir = data_dir
+        self.generation = generation
+        self.fsync = fsync
+        self._file = None
+        self.path = None
+        self.rotate(first_seq)
+
+    def rotate(self, first_seq):
+        """关闭当前段，新开一段，后续记录从 first_seq 开始"""
+        self.close()
+        self.path = os.path.join(self.data_dir, segment_name(self.generation, first_seq))
+        self._file = open(self.path, "ab")
+        self.first_seq = first_seq
+
+    def append(self, records):
+        """写入一组已编码的记录；fsync 后才返回，调用方随后才能确认写入"""
+        if not records:
+            return
+        self._file.write(b"".join(records))
+        self._file.flush()
+        if self.fsync:
+            os.fsync(self._file.fileno())
+
+    def size(self):
+        return self._file.tell() if self._file else 0
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None